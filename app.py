@@ -22,15 +22,36 @@ For research and educational purposes only. Not for clinical decision-making.
 
 from flask import Flask, request, render_template, redirect, url_for, send_file, session, send_from_directory, Response, jsonify
 import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
 import pandas as pd
 import sqlite3
-from datetime import datetime
+from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
+import asyncio
+import glob
+import gzip
+import hashlib
+import html
+import io
+import uuid
 import json
 import os
 import re
+import shutil
+import ssl
+import tempfile
 import time
+from urllib.parse import quote, urljoin, urlsplit, urlunsplit
+import urllib.request
 import threading
-from queue import Queue
+import multiprocessing
+import zipfile
+import zlib
+from queue import Queue, Empty, Full
+from itertools import count
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import ExitStack, contextmanager
 
 import sys
 import argparse
@@ -53,6 +74,10 @@ parser = argparse.ArgumentParser()
 parser.add_argument('--port', type=int, default=5005, help='Port to run the Flask app on')
 parser.add_argument('--host', type=str, default='127.0.0.1', help='Host to bind to (0.0.0.0 for Docker)')
 parser.add_argument('--data-dir', type=str, default='.', help='Directory to store the database')
+parser.add_argument('--resume', action='store_true', help='Resume the last interrupted extraction before starting the server')
+parser.add_argument('--ingest-dir', type=str, default=None, help='Load openFDA device-event bulk zips from this directory before starting the server')
+parser.add_argument('--refresh', action='store_true', help='Fetch reports added or changed since the stored dataset was pulled before starting the server')
+parser.add_argument('--corpus', action='store_true', help='Keep reports across searches instead of replacing them (persistent corpus mode)')
 args, unknown = parser.parse_known_args()
 
 DATABASE = os.path.join(args.data_dir, 'fda_data.db')
@@ -67,16 +92,237 @@ def quit_app():
 # Set via environment variable or hardcode below
 FDA_API_KEY = os.environ.get('FDA_API_KEY', '')
 
+# Parallel extraction: large date-ranged queries are split into date windows of
+# roughly SHARD_TARGET_RECORDS reports (kept under the 25,000 skip limit so the
+# skip fallback still works per window) and fetched on FETCH_WORKERS threads.
+FETCH_WORKERS = int(os.environ.get('MAUDE_FETCH_WORKERS', '4'))
+SHARD_TARGET_RECORDS = int(os.environ.get('MAUDE_SHARD_TARGET_RECORDS', '20000'))
+# Fetch engine for page requests: 'threads' (requests sessions on a thread
+# pool) or 'asyncio' (every window on one event loop)
+FETCH_ENGINE = os.environ.get('MAUDE_FETCH_ENGINE', 'threads')
+# Background extraction jobs: pool size and how many finished jobs stay listed
+JOB_WORKERS = int(os.environ.get('MAUDE_JOB_WORKERS', '2'))
+MAX_FINISHED_JOBS = int(os.environ.get('MAUDE_MAX_FINISHED_JOBS', '50'))
+MAUDE_EARLIEST_DATE = '19840101'  # No MAUDE/MDR reports predate the 1984 MDR regulation
+
+# Pooled HTTP settings for openFDA calls. Timeouts are (connect, read) seconds;
+# HTTP_POOL_SIZE caps the keep-alive connections held open per host.
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('MAUDE_HTTP_CONNECT_TIMEOUT', '10'))
+HTTP_READ_TIMEOUT = float(os.environ.get('MAUDE_HTTP_READ_TIMEOUT', '60'))
+# Events buffered by BulkWriter before its executemany flush
+WRITE_BATCH_SIZE = int(os.environ.get('MAUDE_WRITE_BATCH_SIZE', '5000'))
+# Processes decoding and flattening stored events when the events_flat
+# projection is rebuilt, one WRITE_BATCH_SIZE range of event ids each
+FLATTEN_WORKERS = int(os.environ.get('MAUDE_FLATTEN_WORKERS', str(os.cpu_count() or 1)))
+# Events per chunk streamed through the Excel export; its peak memory grows
+# with this rather than with the dataset
+EXPORT_CHUNK_SIZE = int(os.environ.get('MAUDE_EXPORT_CHUNK_SIZE', '2000'))
+# Pages buffered between the fetch and database-write stages of an extraction
+PIPELINE_QUEUE_PAGES = int(os.environ.get('MAUDE_PIPELINE_QUEUE_PAGES', '8'))
+# Persistent corpus mode: stored reports (one row per mdr_report_key) are kept
+# across launches and when a dataset is replaced or dropped, so later searches
+# reuse them; datasets only change which reports they list (extraction_reports)
+CORPUS_MODE = args.corpus or os.environ.get('MAUDE_CORPUS_MODE', '0') == '1'
+# Dataset that searches without a dataset name are stored in
+DEFAULT_DATASET = 'default'
+
+HTTP_POOL_SIZE = int(os.environ.get('MAUDE_HTTP_POOL_SIZE', str(max(2 * FETCH_WORKERS, 10))))
+
+# SQLite connections: seconds a connection waits for a lock before failing,
+# seconds a thread waits for the shared writer connection, how many
+# read-only connections are pooled, and each reader's memory map and page
+# cache
+DB_BUSY_TIMEOUT = float(os.environ.get('MAUDE_DB_BUSY_TIMEOUT', '30'))
+DB_WRITER_TIMEOUT = float(os.environ.get('MAUDE_DB_WRITER_TIMEOUT', '300'))
+READ_POOL_SIZE = int(os.environ.get('MAUDE_READ_POOL_SIZE', '4'))
+READ_MMAP_SIZE = int(os.environ.get('MAUDE_READ_MMAP_MB', '256')) * 1024 * 1024
+READ_CACHE_KB = int(os.environ.get('MAUDE_READ_CACHE_MB', '32')) * 1024
+
+# On-disk cache of openFDA pages. Entries live for HTTP_CACHE_TTL seconds (0
+# disables the cache) and the oldest are evicted beyond HTTP_CACHE_MAX_BYTES.
+HTTP_CACHE_DIR = os.path.join(args.data_dir, 'http_cache')
+HTTP_CACHE_TTL = int(os.environ.get('MAUDE_HTTP_CACHE_TTL', str(24 * 3600)))
+HTTP_CACHE_MAX_BYTES = int(os.environ.get('MAUDE_HTTP_CACHE_MAX_MB', '1024')) * 1024 * 1024
+
+# Finished export files, downloaded again without rebuilding while the data
+# is unchanged. The least recently used are evicted beyond
+# EXPORT_CACHE_MAX_BYTES (0 disables the cache).
+EXPORT_CACHE_DIR = os.path.join(args.data_dir, 'export_cache')
+EXPORT_CACHE_MAX_BYTES = int(os.environ.get('MAUDE_EXPORT_CACHE_MAX_MB', '512')) * 1024 * 1024
+
 # Global message queues for real-time updates
 extraction_messages = Queue()
 export_messages = Queue()
 
-# Function to get a database connection
+# Function to get a database connection (a private read-write connection;
+# app code goes through db_writer() and db_reader() instead)
 def get_db_connection():
-    conn = sqlite3.connect(DATABASE)
+    conn = sqlite3.connect(DATABASE, timeout=DB_BUSY_TIMEOUT)
     conn.row_factory = sqlite3.Row
     return conn
 
+class PooledConnection(sqlite3.Connection):
+    """A read-only connection lent by ConnectionPool.reader().
+
+    close() and leaving a `with` block hand it back to the pool instead of
+    closing it (closing it again does nothing), so callers use it like any
+    other connection.
+    """
+    pool = None
+    borrowed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def close(self):
+        if self.borrowed:
+            self.borrowed = False
+            self.pool._release(self)
+
+class ConnectionPool:
+    """The database connections shared by every thread of the app.
+
+    Writes go through a single writer connection that threads take turns
+    on: it waits in a one-slot queue and a thread holds it for the whole of
+    a writer() block (re-entering on the same thread gets the same
+    connection). Reads use up to `readers` read-only (mode=ro) connections
+    with their own page cache and memory map. The database is switched to
+    WAL, so readers see the last committed data and never wait on, or
+    block, a write in progress.
+
+    data_version changes after every writer() block that changed rows
+    (once its changes are committed), and is never reused by another pool
+    of this process, so anything derived from the data can be keyed by it.
+    """
+
+    def __init__(self, path, readers=None):
+        self.path = path
+        self.max_readers = readers or READ_POOL_SIZE
+        self._writer = Queue(maxsize=1)
+        self._writer_conn = None
+        self._owner = None
+        self._depth = 0
+        self._readers = Queue()
+        self._opened_readers = 0
+        self._lock = threading.Lock()
+        self.data_version = next(_data_versions)
+
+    def _connect(self, target, **kwargs):
+        conn = sqlite3.connect(target, timeout=DB_BUSY_TIMEOUT, check_same_thread=False, **kwargs)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _open_writer(self):
+        conn = self._connect(self.path)
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+        except sqlite3.OperationalError:
+            pass  # Read-only file system or a legacy lock; readers then rely on the busy timeout
+        return conn
+
+    def _open_reader(self):
+        conn = self._connect(f'file:{quote(os.path.abspath(self.path))}?mode=ro', uri=True,
+                             factory=PooledConnection)
+        conn.execute(f'PRAGMA mmap_size={READ_MMAP_SIZE}')
+        conn.execute(f'PRAGMA cache_size=-{READ_CACHE_KB}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        return conn
+
+    @contextmanager
+    def writer(self, timeout=None):
+        """Hold the writer connection; commits on success and rolls back on error, like `with conn:`.
+
+        Waits up to `timeout` seconds (default DB_WRITER_TIMEOUT) for
+        another thread to hand it back, then raises sqlite3.OperationalError.
+        """
+        me = threading.get_ident()
+        if self._owner == me:
+            self._depth += 1
+            try:
+                yield self._writer_conn
+            finally:
+                self._depth -= 1
+            return
+        with self._lock:
+            if self._writer_conn is None:
+                self._writer_conn = self._open_writer()
+                self._writer.put(self._writer_conn)
+        try:
+            conn = self._writer.get(timeout=timeout or DB_WRITER_TIMEOUT)
+        except Empty:
+            raise sqlite3.OperationalError("database writer is busy") from None
+        self._owner = me
+        changes = conn.total_changes
+        try:
+            with conn:
+                yield conn
+        finally:
+            if conn.total_changes != changes:
+                self.data_version = next(_data_versions)
+            self._owner = None
+            self._writer.put(conn)
+
+    def reader(self):
+        """Borrow a read-only connection, waiting for one if all are in use.
+
+        The connection goes back to the pool when it is closed or at the end
+        of a `with` block over it.
+        """
+        with self._lock:
+            opened = self._readers.empty() and self._opened_readers < self.max_readers
+            if opened:
+                self._opened_readers += 1
+        try:
+            conn = self._open_reader() if opened else self._readers.get()
+        except Exception:
+            with self._lock:
+                self._opened_readers -= 1
+            raise
+        conn.pool, conn.borrowed = self, True
+        return conn
+
+    def _release(self, conn):
+        # Leave no connection-local state (an open read, result views) for
+        # the next borrower
+        conn.rollback()
+        for row in conn.execute("SELECT name FROM temp.sqlite_master WHERE type = 'view'").fetchall():
+            conn.execute(f'DROP VIEW temp.{row[0]}')
+        self._readers.put(conn)
+
+    def close(self):
+        """Close the idle connections; ones in use are closed by garbage collection."""
+        while not self._readers.empty():
+            sqlite3.Connection.close(self._readers.get())
+        if self._writer_conn is not None and self._owner is None:
+            self._writer.get().close()
+            self._writer_conn = None
+
+_pool = None
+_pool_lock = threading.Lock()
+_data_versions = count()
+
+def get_connection_pool():
+    """The pool for DATABASE, replacing (and closing) one opened for another path."""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.path != DATABASE:
+            if _pool is not None:
+                _pool.close()
+            _pool = ConnectionPool(DATABASE)
+        return _pool
+
+def db_writer():
+    """Context manager lending the shared writer connection (see ConnectionPool)."""
+    return get_connection_pool().writer()
+
+def db_reader():
+    """A pooled read-only connection; close it (or use it in a `with` block) to return it."""
+    return get_connection_pool().reader()
+
 # Real-time message logging functions
 def log_extraction_message(message):
     """Log a message for real-time extraction updates"""
@@ -93,8 +339,8 @@ def log_export_message(message):
     })
 
 # Create comprehensive database tables
-def init_db():
-    with get_db_connection() as conn:
+def init_db(keep_data=False):
+    with db_writer() as conn:
         # Main events table
         conn.execute('''
             CREATE TABLE IF NOT EXISTS events (
@@ -126,9 +372,11 @@ def init_db():
                 manufacturer_postal_code TEXT,
                 type_of_report TEXT,
                 remedial_action TEXT,
-                raw_json TEXT
+                raw_json BLOB,
+                mdr_report_key TEXT
             )
         ''')
+        _ensure_columns(conn, 'events', [('mdr_report_key', 'TEXT'), ('content_hash', 'TEXT')])
         
         # Device details table
         conn.execute('''
@@ -150,7 +398,7 @@ def init_db():
                 regulation_number TEXT,
                 device_class TEXT,
                 implant_flag TEXT,
-                raw_device_json TEXT,
+                raw_device_json BLOB,
                 FOREIGN KEY (event_id) REFERENCES events (id)
             )
         ''')
@@ -168,7 +416,7 @@ def init_db():
                 patient_race TEXT,
                 sequence_number_outcome TEXT,
                 sequence_number_treatment TEXT,
-                raw_patient_json TEXT,
+                raw_patient_json BLOB,
                 FOREIGN KEY (event_id) REFERENCES events (id)
             )
         ''')
@@ -186,12 +434,1009 @@ def init_db():
             )
         ''')
         
-        # Clear any stale data from previous sessions so each launch starts fresh
-        conn.execute('DELETE FROM mdr_texts')
-        conn.execute('DELETE FROM patients')
-        conn.execute('DELETE FROM devices')
-        conn.execute('DELETE FROM events')
+        # Multi-valued fields, one row per value (see MULTI_VALUE_TABLES)
+        for table, field in MULTI_VALUE_TABLES.items():
+            key = ('event_id', 'patient_position', 'position') if field.startswith('patient.') else ('event_id', 'position')
+            conn.execute(f'''
+                CREATE TABLE IF NOT EXISTS {table} (
+                    {' '.join(f'{column} INTEGER,' for column in key)}
+                    value TEXT,
+                    PRIMARY KEY ({', '.join(key)})
+                ) WITHOUT ROWID
+            ''')
+        
+        # Extraction checkpoints: one row per extraction, one cursor per
+        # date window (or a single cursor), so interrupted pulls can resume
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS extractions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                base_query TEXT,
+                max_records INTEGER,
+                total_count INTEGER,
+                rows_written INTEGER DEFAULT 0,
+                status TEXT,
+                mode TEXT DEFAULT 'full',
+                created_at TEXT,
+                updated_at TEXT
+            )
+        ''')
+        _ensure_columns(conn, 'extractions', [('mode', "TEXT DEFAULT 'full'"), ('dataset_id', 'INTEGER')])
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS extraction_cursors (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                extraction_id INTEGER,
+                position INTEGER,
+                query TEXT,
+                expected_count INTEGER,
+                next_url TEXT,
+                page_count INTEGER DEFAULT 0,
+                rows_written INTEGER DEFAULT 0,
+                status TEXT,
+                FOREIGN KEY (extraction_id) REFERENCES extractions (id)
+            )
+        ''')
+        
+        # Reports matched by each extraction, so several searches' results can
+        # be stored side by side without duplicating shared reports
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS extraction_reports (
+                extraction_id INTEGER,
+                event_id INTEGER,
+                PRIMARY KEY (extraction_id, event_id)
+            ) WITHOUT ROWID
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_extraction_reports_event_id ON extraction_reports (event_id)')
+        
+        # Named datasets: each shows the reports of its current extraction,
+        # with row counts kept up to date as runs finish
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS datasets (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT UNIQUE NOT NULL,
+                extraction_id INTEGER,
+                event_count INTEGER DEFAULT 0,
+                device_count INTEGER DEFAULT 0,
+                patient_count INTEGER DEFAULT 0,
+                text_count INTEGER DEFAULT 0,
+                created_at TEXT,
+                updated_at TEXT
+            )
+        ''')
+        
+        # An extraction still marked running was cut off by the previous process
+        conn.execute("UPDATE extractions SET status = 'interrupted' WHERE status = 'running'")
+        _ensure_flat_events(conn)
+        
+        # Clear any stale data from previous sessions so each launch starts fresh,
+        # unless an interrupted extraction is waiting to be resumed, the
+        # stored dataset is about to be refreshed or the corpus is persistent
+        if not keep_data and not CORPUS_MODE and get_resumable_extraction(conn) is None:
+            _drop_narrative_index(conn)  # Recreated empty below rather than emptied trigger by trigger
+            conn.execute('DELETE FROM mdr_texts')
+            for table in MULTI_VALUE_TABLES:
+                conn.execute(f'DELETE FROM {table}')
+            conn.execute('DELETE FROM patients')
+            conn.execute('DELETE FROM devices')
+            conn.execute('DELETE FROM events')
+            conn.execute('DELETE FROM extraction_cursors')
+            conn.execute('DELETE FROM extractions')
+            conn.execute('DELETE FROM extraction_reports')
+            conn.execute('DELETE FROM datasets')
+            _reset_flat_events(conn)
+        _ensure_report_key_index(conn)
+        _adopt_unlisted_reports(conn)
+        conn.commit()
+    # Flattening is a transaction of its own, so the schema work above stays
+    # committed whatever happens to a long rebuild; the next start picks up
+    # the events still missing
+    with db_writer() as conn:
+        rebuild_flat_events(conn)
+        create_managed_indexes(conn, analyze=False)
+        conn.commit()
+
+# Multi-valued MAUDE fields stored long-form, one (event_id, position, value)
+# row per value, so their frequencies are a GROUP BY rather than a flattening
+# of every event; patient fields also record the patient's position.
+# table -> field, as named in FLAT_EVENT_FIELDS
+MULTI_VALUE_TABLES = {
+    'event_product_problems': 'product_problems',
+    'event_remedial_actions': 'remedial_action',
+    'patient_problems': 'patient.patient_problems',
+    'patient_outcomes': 'patient.sequence_number_outcome',
+    'patient_treatments': 'patient.sequence_number_treatment',
+}
+
+# Tables whose rows belong to one event through event_id
+EVENT_CHILD_TABLES = ('mdr_texts', 'patients', 'devices', 'events_flat', *MULTI_VALUE_TABLES)
+
+# Secondary indexes serving the read paths: child-table joins on event_id
+# (results, analytics, exports, the missing-patient anti-join), the results
+# page's date_added ordering, date/report-number lookups and the value
+# counts over the multi-valued fields. They are dropped
+# when a fresh dataset starts loading and rebuilt, followed by ANALYZE, once
+# it is in; the unique idx_events_mdr_report_key is created in init_db and
+# kept through loads because upserts look reports up by key.
+MANAGED_INDEXES = {
+    'idx_devices_event_id': 'devices (event_id)',
+    'idx_patients_event_id': 'patients (event_id)',
+    'idx_mdr_texts_event_id': 'mdr_texts (event_id, text_type_code)',
+    'idx_events_date_received': 'events (date_received)',
+    'idx_events_date_added': 'events (date_added)',
+    'idx_events_report_number': 'events (report_number)',
+    **{f'idx_{table}_value': f'{table} (value)' for table in MULTI_VALUE_TABLES},
+}
+
+# Full-text index over the MDR narratives: an external-content FTS5 table on
+# mdr_texts.text, kept in step by triggers on insert, delete and update. It
+# is dropped and rebuilt with the managed indexes, so bulk loads don't
+# index texts one by one.
+NARRATIVE_INDEX = 'mdr_texts_fts'
+
+def drop_managed_indexes(conn):
+    """Drop the secondary indexes so a bulk load does not maintain them row by row."""
+    for name in MANAGED_INDEXES:
+        conn.execute(f'DROP INDEX IF EXISTS {name}')
+    _drop_narrative_index(conn)
+
+def create_managed_indexes(conn, analyze=True):
+    """Create any missing secondary index and refresh planner statistics.
+
+    Returns the names of the indexes that had to be built.
+    """
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    created = [name for name in MANAGED_INDEXES if name not in existing]
+    for name in created:
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {MANAGED_INDEXES[name]}')
+    if _create_narrative_index(conn):
+        created.append(NARRATIVE_INDEX)
+    if analyze:
+        conn.execute('ANALYZE')
+    return created
+
+def _drop_narrative_index(conn):
+    for action in ('insert', 'delete', 'update'):
+        conn.execute(f'DROP TRIGGER IF EXISTS {NARRATIVE_INDEX}_{action}')
+    conn.execute(f'DROP TABLE IF EXISTS {NARRATIVE_INDEX}')
+
+def _create_narrative_index(conn):
+    """Build the narrative index from mdr_texts if it is missing; returns whether it was built."""
+    if has_narrative_index(conn):
+        return False
+    conn.execute(f"CREATE VIRTUAL TABLE {NARRATIVE_INDEX} USING fts5(text, content='mdr_texts', content_rowid='id')")
+    insert = f'INSERT INTO {NARRATIVE_INDEX} (rowid, text) VALUES (new.id, new.text);'
+    delete = f"INSERT INTO {NARRATIVE_INDEX} ({NARRATIVE_INDEX}, rowid, text) VALUES ('delete', old.id, old.text);"
+    for action, body in (('insert', insert), ('delete', delete), ('update', delete + ' ' + insert)):
+        conn.execute(f'CREATE TRIGGER {NARRATIVE_INDEX}_{action} AFTER {action.upper()} ON mdr_texts BEGIN {body} END')
+    conn.execute(f"INSERT INTO {NARRATIVE_INDEX} ({NARRATIVE_INDEX}) VALUES ('rebuild')")
+    return True
+
+def has_narrative_index(conn):
+    return conn.execute('SELECT 1 FROM main.sqlite_master WHERE name = ?', (NARRATIVE_INDEX,)).fetchone() is not None
+
+def _ensure_report_key_index(conn):
+    """Make mdr_report_key unique so reports can be upserted on it.
+
+    Databases from before the upsert had a plain index and could hold the
+    same report twice; only the newest copy of each is kept.
+    """
+    unique = {row['name']: row['unique'] for row in conn.execute('PRAGMA index_list(events)')}
+    if unique.get('idx_events_mdr_report_key'):
+        return
+    conn.execute('DROP INDEX IF EXISTS idx_events_mdr_report_key')
+    stale = ('SELECT id FROM events WHERE mdr_report_key IS NOT NULL '
+             'AND id NOT IN (SELECT MAX(id) FROM events GROUP BY mdr_report_key)')
+    for table in EVENT_CHILD_TABLES:
+        conn.execute(f'DELETE FROM {table} WHERE event_id IN ({stale})')
+    conn.execute(f'DELETE FROM events WHERE id IN ({stale})')
+    conn.execute('CREATE UNIQUE INDEX idx_events_mdr_report_key ON events (mdr_report_key)')
+
+def _adopt_unlisted_reports(conn):
+    """Turn data stored before named datasets into the default dataset.
+
+    The newest extraction (one is recorded if there is none) becomes the
+    dataset's current run and, if no reports are listed yet, lists every
+    stored report.
+    """
+    if conn.execute('SELECT 1 FROM datasets LIMIT 1').fetchone() or not conn.execute('SELECT 1 FROM events LIMIT 1').fetchone():
+        return
+    now = datetime.now().isoformat(timespec='seconds')
+    row = conn.execute("SELECT id FROM extractions WHERE status != 'superseded' ORDER BY id DESC LIMIT 1").fetchone()
+    extraction_id = row[0] if row else conn.execute('''
+        INSERT INTO extractions (rows_written, status, created_at, updated_at)
+        VALUES ((SELECT COUNT(*) FROM events), 'completed', ?, ?)
+    ''', (now, now)).lastrowid
+    if not conn.execute('SELECT 1 FROM extraction_reports LIMIT 1').fetchone():
+        conn.execute('INSERT INTO extraction_reports (extraction_id, event_id) SELECT ?, id FROM events', (extraction_id,))
+    dataset_id = _dataset_id(conn, DEFAULT_DATASET)
+    conn.execute('UPDATE extractions SET dataset_id = ? WHERE dataset_id IS NULL', (dataset_id,))
+    conn.execute('UPDATE datasets SET extraction_id = ? WHERE id = ?', (extraction_id, dataset_id))
+    _update_dataset_stats(conn, extraction_id)
+
+def _dataset_id(conn, name):
+    """Id of the named dataset, creating it (without data) if it does not exist."""
+    row = conn.execute('SELECT id FROM datasets WHERE name = ?', (name,)).fetchone()
+    if row:
+        return row[0]
+    now = datetime.now().isoformat(timespec='seconds')
+    return conn.execute('INSERT INTO datasets (name, created_at, updated_at) VALUES (?, ?, ?)',
+                        (name, now, now)).lastrowid
+
+def get_dataset(conn, name=None):
+    """Return the named dataset, or with no name the one with the most recent results."""
+    if name:
+        return conn.execute('SELECT * FROM datasets WHERE name = ?', (name,)).fetchone()
+    return conn.execute('''
+        SELECT * FROM datasets WHERE extraction_id IS NOT NULL ORDER BY extraction_id DESC LIMIT 1
+    ''').fetchone()
+
+def list_datasets(conn):
+    """Every dataset with its current query, status and row counts, newest results first."""
+    return conn.execute('''
+        SELECT d.*, x.base_query, x.mode, x.status, x.total_count
+        FROM datasets d LEFT JOIN extractions x ON x.id = d.extraction_id
+        ORDER BY d.extraction_id IS NULL, d.extraction_id DESC, d.id DESC
+    ''').fetchall()
+
+def _activate_extraction(conn, extraction_id):
+    """Make an extraction the run its dataset shows, retiring the dataset's older runs.
+
+    Called before a run writes its first rows; a no-op once it is current.
+    Runs other than refreshes replace the dataset's reports: those listed
+    only by older runs are deleted, except in corpus mode. When the dataset
+    is the only one that is a plain wipe of the tables.
+    """
+    extraction = conn.execute('SELECT dataset_id, mode FROM extractions WHERE id = ?', (extraction_id,)).fetchone()
+    dataset_id = extraction['dataset_id']
+    current = conn.execute('SELECT extraction_id FROM datasets WHERE id = ?', (dataset_id,)).fetchone()
+    if current is None or current[0] == extraction_id:
+        return
+    replace = extraction['mode'] != 'refresh'
+    alone = not conn.execute('SELECT 1 FROM datasets WHERE id != ? LIMIT 1', (dataset_id,)).fetchone()
+    if replace and alone and not CORPUS_MODE:
+        _clear_data_tables(conn)
+        conn.execute("UPDATE extractions SET status = 'superseded' WHERE id != ?", (extraction_id,))
+        conn.execute('DELETE FROM extraction_cursors WHERE extraction_id != ?', (extraction_id,))
+    else:
+        older = 'SELECT id FROM extractions WHERE dataset_id = ? AND id != ?'
+        conn.execute(f'DELETE FROM extraction_reports WHERE extraction_id IN ({older})', (dataset_id, extraction_id))
+        conn.execute(f'DELETE FROM extraction_cursors WHERE extraction_id IN ({older})', (dataset_id, extraction_id))
+        conn.execute("UPDATE extractions SET status = 'superseded' WHERE dataset_id = ? AND id != ?",
+                     (dataset_id, extraction_id))
+        if replace and not CORPUS_MODE:
+            _delete_unlisted_reports(conn)
+    conn.execute('UPDATE datasets SET extraction_id = ?, updated_at = ? WHERE id = ?',
+                 (extraction_id, datetime.now().isoformat(timespec='seconds'), dataset_id))
+
+def _create_extraction(conn, dataset, base_query, max_records=None, total_count=None, mode='full', status='running'):
+    """Record a new run for the named dataset (created if needed) and return its id."""
+    now = datetime.now().isoformat(timespec='seconds')
+    return conn.execute('''
+        INSERT INTO extractions (base_query, max_records, total_count, rows_written, status, mode, dataset_id,
+                                 created_at, updated_at)
+        VALUES (?, ?, ?, 0, ?, ?, ?, ?, ?)
+    ''', (base_query, max_records, total_count, status, mode, _dataset_id(conn, dataset), now, now)).lastrowid
+
+def _delete_unlisted_reports(conn):
+    """Delete stored reports that no extraction lists any more."""
+    unlisted = 'SELECT id FROM events WHERE id NOT IN (SELECT event_id FROM extraction_reports)'
+    for table in EVENT_CHILD_TABLES:
+        conn.execute(f'DELETE FROM {table} WHERE event_id IN ({unlisted})')
+    conn.execute(f'DELETE FROM events WHERE id IN ({unlisted})')
+
+def _update_dataset_stats(conn, extraction_id):
+    """Store the row counts of the dataset whose current run is extraction_id."""
+    members = 'SELECT event_id FROM extraction_reports WHERE extraction_id = ?'
+    counts = [conn.execute('SELECT COUNT(*) FROM extraction_reports WHERE extraction_id = ?', (extraction_id,)).fetchone()[0]]
+    counts += [conn.execute(f'SELECT COUNT(*) FROM {table} WHERE event_id IN ({members})', (extraction_id,)).fetchone()[0]
+               for table in ('devices', 'patients', 'mdr_texts')]
+    conn.execute('''
+        UPDATE datasets SET event_count = ?, device_count = ?, patient_count = ?, text_count = ?, updated_at = ?
+        WHERE extraction_id = ?
+    ''', (*counts, datetime.now().isoformat(timespec='seconds'), extraction_id))
+
+def drop_dataset(name):
+    """Delete a dataset and its runs, leaving every other dataset untouched.
+
+    Reports no other dataset lists are deleted too, except in corpus mode.
+    Returns False if there is no such dataset.
+    """
+    with db_writer() as conn:
+        dataset = get_dataset(conn, name)
+        if dataset is None:
+            return False
+        runs = 'SELECT id FROM extractions WHERE dataset_id = ?'
+        conn.execute(f'DELETE FROM extraction_reports WHERE extraction_id IN ({runs})', (dataset['id'],))
+        conn.execute(f'DELETE FROM extraction_cursors WHERE extraction_id IN ({runs})', (dataset['id'],))
+        conn.execute('DELETE FROM extractions WHERE dataset_id = ?', (dataset['id'],))
+        conn.execute('DELETE FROM datasets WHERE id = ?', (dataset['id'],))
+        if not CORPUS_MODE:
+            _delete_unlisted_reports(conn)
         conn.commit()
+    log_extraction_message(f"Dropped dataset '{name}'")
+    return True
+
+RESULT_TABLES = ('events', 'devices', 'patients', 'mdr_texts')
+
+def get_results_connection(dataset=None):
+    """Borrow a pooled read-only connection for reading one dataset's results.
+
+    Readers query the result_events, result_devices, result_patients,
+    result_mdr_texts and result_events_flat views (and one per
+    MULTI_VALUE_TABLES table), which are temporary to this connection and
+    show the reports listed by the dataset's current run. `dataset` is a dataset
+    name; without one (or if it no longer exists) the dataset with the most
+    recent results is shown. Closing the connection, or leaving a `with`
+    block over it, returns it to the pool.
+    """
+    conn = db_reader()
+    try:
+        row = (get_dataset(conn, dataset) if dataset else None) or get_dataset(conn)
+        members = f"SELECT event_id FROM extraction_reports WHERE extraction_id = {int(row['extraction_id'] if row else 0)}"
+        for table in RESULT_TABLES:
+            key = 'id' if table == 'events' else 'event_id'
+            conn.execute(f'CREATE TEMP VIEW result_{table} AS SELECT * FROM main.{table} WHERE {key} IN ({members})')
+        for table in ('events_flat', *MULTI_VALUE_TABLES):
+            conn.execute(f'CREATE TEMP VIEW result_{table} AS SELECT * FROM main.{table} WHERE event_id IN ({members})')
+    except BaseException:
+        conn.close()
+        raise
+    return conn
+
+def count_values(conn, table):
+    """Frequency of each non-blank value of a multi-valued field in the results.
+
+    `table` is a MULTI_VALUE_TABLES table, read through its result_ view.
+    Returns (value, count) rows, most frequent first.
+    """
+    return conn.execute(f'''
+        SELECT value, COUNT(*) AS count FROM result_{table}
+        WHERE TRIM(value, char(32, 9, 10, 13)) != ''
+        GROUP BY value ORDER BY count DESC, value
+    ''').fetchall()
+
+def search_narratives(conn, query, limit=20, after=None):
+    """Full-text search of the MDR narratives in the results, best match first.
+
+    `query` uses FTS5 syntax: words, "exact phrases", prefix*, AND / OR /
+    NOT and parentheses. Hits are ranked by BM25 and returned as dicts with
+    the event they belong to, a snippet (HTML-escaped, matches wrapped in
+    <mark>) and the MAUDE report link. `after` is the (rank, id) of the
+    previous page's last hit. Raises sqlite3.OperationalError for a query
+    FTS5 cannot parse.
+    """
+    keyset = 'AND (f.rank, t.id) > (?, ?)' if after else ''
+    rows = conn.execute(f'''
+        SELECT t.id, t.event_id, t.text_type_code, e.report_number, e.mdr_report_key, f.rank AS rank,
+               snippet({NARRATIVE_INDEX}, 0, char(2), char(3), '...', 24) AS snippet,
+               (SELECT d.device_report_product_code FROM devices d
+                WHERE d.event_id = t.event_id ORDER BY d.id LIMIT 1) AS product_code
+        FROM {NARRATIVE_INDEX} f
+        JOIN result_mdr_texts t ON t.id = f.rowid
+        JOIN events e ON e.id = t.event_id
+        WHERE {NARRATIVE_INDEX} MATCH ? {keyset}
+        ORDER BY f.rank, t.id LIMIT ?
+    ''', (query, *(after or ()), limit)).fetchall()
+    return [{
+        'id': row['id'], 'event_id': row['event_id'], 'report_number': row['report_number'],
+        'mdr_report_key': row['mdr_report_key'], 'text_type_code': row['text_type_code'], 'rank': row['rank'],
+        'snippet': html.escape(row['snippet'] or '').replace('\x02', '<mark>').replace('\x03', '</mark>'),
+        'maude_report_link': maude_report_link(row['mdr_report_key'], row['product_code']),
+    } for row in rows]
+
+def _ensure_columns(conn, table, columns):
+    """Add columns missing from a table created by an older version of the app."""
+    existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+    for name, declaration in columns:
+        if name not in existing:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {declaration}")
+
+def get_resumable_extraction(conn):
+    """Return the most recent interrupted extraction row, or None."""
+    return conn.execute('''
+        SELECT * FROM extractions WHERE status = 'interrupted' ORDER BY id DESC LIMIT 1
+    ''').fetchone()
+
+# Shared keep-alive HTTP layer: one connection pool (per host) shared by
+# thread-local sessions, so parallel fetchers reuse TLS connections safely.
+_http_adapter = None
+_http_adapter_lock = threading.Lock()
+_http_local = threading.local()
+
+def _get_http_adapter():
+    global _http_adapter
+    if _http_adapter is None:
+        with _http_adapter_lock:
+            if _http_adapter is None:
+                _http_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE, pool_block=True)
+    return _http_adapter
+
+def get_http_session():
+    """Return this thread's requests.Session, backed by the shared connection pool."""
+    http_session = getattr(_http_local, 'session', None)
+    if http_session is None:
+        http_session = requests.Session()
+        adapter = _get_http_adapter()
+        http_session.mount('https://', adapter)
+        http_session.mount('http://', adapter)
+        http_session.headers.update({
+            'Accept-Encoding': 'gzip, deflate',
+            'User-Agent': 'MAUDEMetrics',
+        })
+        _http_local.session = http_session
+    return http_session
+
+def http_get(url, timeout=None):
+    """GET a URL over the pooled keep-alive session with gzip negotiation.
+
+    `timeout` overrides the read timeout; the connect timeout always comes
+    from HTTP_CONNECT_TIMEOUT.
+    """
+    return get_http_session().get(url, timeout=(HTTP_CONNECT_TIMEOUT, timeout or HTTP_READ_TIMEOUT))
+
+class _AsyncResponse:
+    """Response returned by AsyncHTTPClient, mirroring the requests.Response bits we use."""
+
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+class AsyncHTTPClient:
+    """Minimal keep-alive HTTP/1.1 GET client on asyncio streams.
+
+    Used by the asyncio fetch engine so one event loop can drive many openFDA
+    requests without a thread each. Handles gzip, chunked and fixed-length
+    bodies, follows up to MAX_REDIRECTS redirects and keeps up to pool_size
+    idle connections per host. Certificates are checked against the same CA
+    bundle requests uses. Proxies are not supported, so a client refuses to
+    start when HTTP_PROXY or HTTPS_PROXY is set. Network failures are raised
+    as requests exceptions so the shared retry logic treats both engines
+    alike.
+    """
+
+    MAX_REDIRECTS = 10
+    REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+    def __init__(self, pool_size=10):
+        proxies = sorted(f'{scheme.upper()}_PROXY' for scheme in urllib.request.getproxies()
+                         if scheme in ('http', 'https'))
+        if proxies:
+            raise ValueError(f"The asyncio fetch engine does not support proxies ({', '.join(proxies)} set); "
+                             "use MAUDE_FETCH_ENGINE=threads")
+        self.pool_size = pool_size
+        self.idle = {}
+        self.ssl_context = None
+
+    async def get(self, url, timeout=None):
+        for _ in range(self.MAX_REDIRECTS + 1):
+            response = await self._get_once(url, timeout)
+            location = response.headers.get('Location')
+            if response.status_code not in self.REDIRECT_STATUSES or not location:
+                return response
+            url = urljoin(url, location)
+        raise requests.exceptions.TooManyRedirects(f"Exceeded {self.MAX_REDIRECTS} redirects")
+
+    async def _get_once(self, url, timeout):
+        parts = urlsplit(url)
+        secure = parts.scheme == 'https'
+        host = parts.hostname
+        port = parts.port or (443 if secure else 80)
+        target = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+        request_bytes = (
+            f'GET {target} HTTP/1.1\r\n'
+            f'Host: {parts.netloc}\r\n'
+            'Accept: application/json\r\n'
+            'Accept-Encoding: gzip\r\n'
+            'User-Agent: MAUDEMetrics\r\n'
+            'Connection: keep-alive\r\n\r\n'
+        ).encode('latin-1')
+        pool_key = (parts.scheme, host, port)
+
+        while True:
+            connection = self._checkout(pool_key)
+            reused = connection is not None
+            try:
+                if connection is None:
+                    if secure and self.ssl_context is None:
+                        self.ssl_context = ssl.create_default_context(cafile=requests.certs.where())
+                    connection = await asyncio.wait_for(
+                        asyncio.open_connection(host, port, ssl=self.ssl_context if secure else None),
+                        HTTP_CONNECT_TIMEOUT)
+                reader, writer = connection
+                writer.write(request_bytes)
+                await writer.drain()
+                status, headers, content, keep_alive = await asyncio.wait_for(
+                    self._read_response(reader), timeout or HTTP_READ_TIMEOUT)
+            except asyncio.TimeoutError:
+                self._discard(connection)
+                raise requests.exceptions.Timeout(f"Timed out waiting for {host}")
+            except (OSError, EOFError, ValueError) as e:
+                self._discard(connection)
+                if reused:
+                    continue  # The server closed an idle keep-alive connection; retry on a fresh one
+                raise requests.exceptions.ConnectionError(f"Connection to {host} failed: {e}")
+            if keep_alive and len(self.idle.setdefault(pool_key, [])) < self.pool_size:
+                self.idle[pool_key].append(connection)
+            else:
+                self._discard(connection)
+            return _AsyncResponse(status, headers, content)
+
+    def _checkout(self, pool_key):
+        connections = self.idle.get(pool_key)
+        while connections:
+            reader, writer = connections.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer
+        return None
+
+    @staticmethod
+    def _discard(connection):
+        if connection is not None:
+            connection[1].close()
+
+    async def _read_response(self, reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise EOFError("connection closed before a response was received")
+        version, status = status_line.decode('latin-1').split(None, 2)[:2]
+        headers = CaseInsensitiveDict()
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            name, value = name.strip(), value.strip()
+            headers[name] = f'{headers[name]}, {value}' if name in headers else value
+
+        status = int(status)
+        keep_alive = version == 'HTTP/1.1' and headers.get('Connection', '').lower() != 'close'
+        if status < 200 or status in (204, 304):
+            content = b''  # Never has a body
+        elif headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass  # Skip trailers
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            content = b''.join(chunks)
+        elif 'Content-Length' in headers:
+            content = await reader.readexactly(int(headers['Content-Length']))
+        elif not keep_alive:
+            content = await reader.read()  # The body runs until the server closes the connection
+        else:
+            raise ValueError("response on a keep-alive connection has neither Content-Length nor chunked encoding")
+        if headers.get('Content-Encoding', '').lower() == 'gzip':
+            content = gzip.decompress(content)
+        return status, headers, content, keep_alive
+
+    async def close(self):
+        writers = [writer for connections in self.idle.values() for _, writer in connections]
+        self.idle.clear()
+        for writer in writers:
+            writer.close()
+        for writer in writers:
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+# openFDA quotas: (requests per minute, requests per day), with and without an API key
+OPENFDA_QUOTAS = {
+    'key': (240, 120000),
+    'keyless': (240, 1000),
+}
+
+class RateLimiter:
+    """Adaptive token bucket shared by every fetcher using the same API key.
+
+    The refill rate starts at half the per-minute quota and ramps up
+    additively on each successful response until it reaches the quota; a 429
+    halves it and blocks every caller for the server's Retry-After. The
+    X-RateLimit-Remaining header is used to slow down before the quota is hit.
+    """
+
+    def __init__(self, per_minute, per_day, burst=4):
+        self.max_rate = per_minute / 60.0
+        self.min_rate = self.max_rate / 16
+        self.rate = self.max_rate / 2
+        self.per_day = per_day
+        self.capacity = burst
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.day = datetime.now().date()
+        self.requests_today = 0
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token and return how many seconds the caller must wait first."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+            today = datetime.now().date()
+            if today != self.day:
+                self.day, self.requests_today = today, 0
+            self.requests_today += 1
+            if self.requests_today == int(self.per_day * 0.9):
+                log_extraction_message(f"Approaching the daily openFDA quota ({self.requests_today:,}/{self.per_day:,} requests today)")
+            return max(wait, self.blocked_until - now)
+
+    def acquire(self):
+        """Block until the caller may send a request."""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def on_success(self, headers):
+        """Ramp up after a successful response, unless the quota is nearly spent."""
+        with self.lock:
+            limit = _int_header(headers, 'X-RateLimit-Limit')
+            remaining = _int_header(headers, 'X-RateLimit-Remaining')
+            if limit and remaining is not None and remaining < limit * 0.05:
+                self.rate = max(self.min_rate, self.rate / 2)
+            else:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+    def on_throttle(self, retry_after=None):
+        """Shrink the rate after a 429 and hold all callers for retry_after seconds.
+
+        Returns the number of seconds callers will be held.
+        """
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            wait = retry_after if retry_after is not None else 1.0 / self.rate
+            self.blocked_until = max(self.blocked_until, time.monotonic() + wait)
+            self.tokens = min(self.tokens, 0.0)
+            return wait
+
+def _int_header(headers, name):
+    try:
+        return int(headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+def _parse_retry_after(value):
+    """Parse a Retry-After header (seconds or HTTP date) into seconds, or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.now(retry_at.tzinfo)).total_seconds())
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+def get_rate_limiter(api_key=None):
+    """Return the limiter shared by all requests made with this API key (or none)."""
+    name = api_key or ''
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(name)
+        if limiter is None:
+            limiter = RateLimiter(*OPENFDA_QUOTAS['key' if api_key else 'keyless'])
+            _rate_limiters[name] = limiter
+        return limiter
+
+def rate_limited_get(url, timeout=None):
+    """GET an openFDA URL once, paced by the limiter for the URL's API key.
+
+    A 429 response is reported to the limiter (honoring Retry-After) and
+    returned to the caller, who decides whether to retry.
+    """
+    limiter = _limiter_for_url(url)
+    limiter.acquire()
+    response = http_get(url, timeout=timeout)
+    _report_to_limiter(limiter, response)
+    return response
+
+def _limiter_for_url(url):
+    key_match = re.search(r'[?&]api_key=([^&]+)', url)
+    return get_rate_limiter(key_match.group(1) if key_match else None)
+
+def _report_to_limiter(limiter, response):
+    """Feed a response's status and rate-limit headers back to the limiter."""
+    if response.status_code == 429:
+        response.throttle_wait = limiter.on_throttle(_parse_retry_after(response.headers.get('Retry-After')))
+    elif response.status_code < 500:
+        limiter.on_success(response.headers)
+
+class _CachedResponse:
+    """Stand-in for a requests.Response replayed from the response cache."""
+
+    def __init__(self, entry):
+        self.status_code = entry['status']
+        self.headers = CaseInsensitiveDict(entry['headers'])
+        self.text = entry['body']
+        self.from_cache = True
+
+    def json(self):
+        return json.loads(self.text)
+
+class ResponseCache:
+    """On-disk cache of openFDA page responses with TTL and LRU eviction.
+
+    Entries are gzip-compressed JSON files named by the SHA-256 of the
+    normalized URL (query parameters sorted, api_key removed), so keyed and
+    keyless runs share entries. An entry is served only while it is younger
+    than ttl seconds and was stored for the same openFDA `meta.last_updated`
+    as the API data of the extraction asking (from its count query). The
+    least recently used entries are evicted once the cache exceeds max_bytes.
+    """
+
+    def __init__(self, directory, ttl, max_bytes):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.total_bytes = None
+        self.counters = {'hits': 0, 'misses': 0, 'bytes_served': 0, 'bytes_stored': 0}
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_bytes > 0
+
+    @staticmethod
+    def normalize_url(url):
+        parts = urlsplit(url)
+        params = sorted(p for p in parts.query.split('&') if p and not p.startswith('api_key='))
+        return urlunsplit((parts.scheme, parts.netloc.lower(), parts.path, '&'.join(params), ''))
+
+    def _path(self, url):
+        digest = hashlib.sha256(self.normalize_url(url).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest[:2], f'{digest}.json.gz')
+
+    def get(self, url, last_updated=None):
+        """Return a cached response for url, or None on a miss.
+
+        With last_updated, only an entry stored for that meta.last_updated
+        is a hit.
+        """
+        if not self.enabled:
+            return None
+        path = self._path(url)
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                entry = json.load(f)
+            size = os.path.getsize(path)
+        except (OSError, ValueError):
+            entry = None
+        fresh = (
+            entry is not None
+            and time.time() - entry['stored_at'] < self.ttl
+            and (last_updated is None or entry.get('last_updated') == last_updated)
+        )
+        with self.lock:
+            if not fresh:
+                self.counters['misses'] += 1
+                return None
+            self.counters['hits'] += 1
+            self.counters['bytes_served'] += size
+        try:
+            os.utime(path)  # Mark as recently used for LRU eviction
+        except OSError:
+            pass
+        return _CachedResponse(entry)
+
+    def put(self, url, response, last_updated=None):
+        """Store a successful response for url and evict old entries if needed.
+
+        With last_updated, a page from other API data than that is not stored.
+        """
+        if not self.enabled or response.status_code != 200:
+            return
+        try:
+            page_updated = response.json().get('meta', {}).get('last_updated')
+        except ValueError:
+            return
+        if last_updated is not None and page_updated != last_updated:
+            return
+        entry = {
+            'url': self.normalize_url(url),
+            'stored_at': time.time(),
+            'last_updated': page_updated,
+            'status': response.status_code,
+            'headers': {name: value for name, value in response.headers.items() if name.lower() == 'link'},
+            'body': response.text,
+        }
+        path = self._path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f'{path}.{threading.get_ident()}.tmp'
+        with gzip.open(temp_path, 'wt', encoding='utf-8', compresslevel=5) as f:
+            json.dump(entry, f)
+        size = os.path.getsize(temp_path)
+        try:
+            previous = os.path.getsize(path)
+        except OSError:
+            previous = 0
+        os.replace(temp_path, path)
+        with self.lock:
+            self.counters['bytes_stored'] += size
+            if self.total_bytes is not None:
+                self.total_bytes += size - previous
+        self._evict()
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat.st_mtime, stat.st_size
+
+    def _evict(self):
+        with self.lock:
+            if self.total_bytes is None:
+                self.total_bytes = sum(size for _, _, size in self._entries())
+            if self.total_bytes <= self.max_bytes:
+                return
+            # Evict least recently used entries down to 90% of the cap
+            for path, _, size in sorted(self._entries(), key=lambda entry: entry[1]):
+                if self.total_bytes <= self.max_bytes * 0.9:
+                    break
+                try:
+                    os.remove(path)
+                    self.total_bytes -= size
+                except OSError:
+                    pass
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counters)
+
+    def log_stats_since(self, before):
+        """Log hit/miss/byte counts accumulated since a snapshot()."""
+        if not self.enabled:
+            return
+        now = self.snapshot()
+        delta = {name: now[name] - before.get(name, 0) for name in now}
+        if delta['hits'] or delta['misses']:
+            log_extraction_message(
+                f"Response cache: {delta['hits']:,} hits, {delta['misses']:,} misses, "
+                f"{delta['bytes_served'] / 1e6:.1f} MB served from disk, {delta['bytes_stored'] / 1e6:.1f} MB stored")
+
+response_cache = ResponseCache(HTTP_CACHE_DIR, HTTP_CACHE_TTL, HTTP_CACHE_MAX_BYTES)
+
+class ExportCache:
+    """On-disk cache of finished export files with LRU eviction.
+
+    Entries are keyed by the export, its parameters, the database and the
+    connection pool's data_version, which moves with every write, so a
+    file is served again only while the data it was built from is
+    unchanged. Files are named by the SHA-256 of their key followed by
+    the export's own file name. The least recently used are evicted once
+    the cache exceeds max_bytes. Versions mean nothing to a new process,
+    so on first use the files an earlier one left are removed, along with
+    exports it left in the temp directory.
+    """
+
+    ORPHAN_PATTERNS = ('MAUDEMetrics_*', 'fda_mdr_texts_full_*')
+    ORPHAN_AGE = 3600  # Seconds; younger temp files may be another instance's export in progress
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.build_locks = {}
+        self.prepared = False
+        self.counters = {'hits': 0, 'misses': 0}
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def fetch(self, key, build):
+        """Return (path, download name) of the export for key, calling build() on a miss.
+
+        build() returns the path of a new export file, which is moved into
+        the cache. Concurrent requests for the same key build it once.
+        """
+        if not self.enabled:
+            path = build()
+            return path, os.path.basename(path)
+        self._prepare()
+        digest = hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        with self.lock:
+            build_lock = self.build_locks.setdefault(digest, threading.Lock())
+        with build_lock:
+            cached = glob.glob(os.path.join(self.directory, f'{digest}_*'))
+            if cached:
+                try:
+                    os.utime(cached[0])  # Mark as recently used for LRU eviction
+                except OSError:
+                    pass
+                with self.lock:
+                    self.counters['hits'] += 1
+                log_export_message("Data unchanged since this export was built; serving the cached file")
+                return cached[0], os.path.basename(cached[0])[len(digest) + 1:]
+            path = build()
+            name = os.path.basename(path)
+            target = os.path.join(self.directory, f'{digest}_{name}')
+            os.makedirs(self.directory, exist_ok=True)
+            shutil.move(path, target)
+            with self.lock:
+                self.counters['misses'] += 1
+            self._evict(target)
+            return target, name
+
+    def _entries(self):
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            yield path, stat.st_mtime, stat.st_size
+
+    def _evict(self, keep):
+        with self.lock:
+            entries = sorted(self._entries(), key=lambda entry: entry[1])
+            total = sum(size for _, _, size in entries)
+            if total <= self.max_bytes:
+                return
+            # Evict least recently used entries down to 90% of the cap, never the one just built
+            for path, _, size in entries:
+                if total <= self.max_bytes * 0.9:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass  # Still being sent on a platform that cannot delete open files
+
+    def _prepare(self):
+        with self.lock:
+            if self.prepared:
+                return
+            self.prepared = True
+            orphans = [path for path, _, _ in self._entries()]
+            cutoff = time.time() - self.ORPHAN_AGE
+            for pattern in self.ORPHAN_PATTERNS:
+                for path in glob.glob(os.path.join(tempfile.gettempdir(), pattern)):
+                    try:
+                        if os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+                            orphans.append(path)
+                    except OSError:
+                        pass
+            for path in orphans:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+export_cache = ExportCache(EXPORT_CACHE_DIR, EXPORT_CACHE_MAX_BYTES)
+
+def cached_export(export, **params):
+    """Run export(**params) through export_cache; returns (path, download name)."""
+    pool = get_connection_pool()
+    key = [os.path.abspath(pool.path), pool.data_version, export.__name__, params]
+    return export_cache.fetch(key, lambda: export(**params))
 
 # Enhanced fetch function with pagination and real-time logging
 def _api_url(base_query, api_key=None, **params):
@@ -221,25 +1466,38 @@ def _extract_next_url(response):
         return match.group(1)
     return None
 
-def _fetch_with_retry(url, max_retries=3, timeout=60):
-    """Fetch a URL with exponential backoff retry logic.
+def _fetch_with_retry(url, max_retries=3, timeout=None, last_updated=None):
+    """Fetch a URL with retry logic.
+
+    Pages still fresh in the response cache for the extraction's
+    last_updated (see ResponseCache) are served from disk. Other
+    requests are paced by the shared rate limiter, which also absorbs 429
+    responses; server and network errors back off exponentially.
+
+    This is a step generator (see _run_steps): it yields ('get', url,
+    timeout) and ('sleep', seconds) requests to the fetch engine driving it,
+    so the threaded and asyncio engines share the same retry logic.
     
     Returns (response, error_msg). response is None on total failure.
     """
+    cached = response_cache.get(url, last_updated)
+    if cached is not None:
+        return cached, None
     response = None
     for attempt in range(max_retries):
         try:
             print(f"API request (attempt {attempt + 1}): {url[:120]}...")
-            response = requests.get(url, timeout=timeout)
+            response = yield ('get', url, timeout)
             print(f"API response status: {response.status_code}")
             
             if response.status_code == 200:
+                response_cache.put(url, response, last_updated)
                 return response, None
             elif response.status_code == 429:
-                wait_time = 2 ** (attempt + 1)
-                log_extraction_message(f"Rate limited by FDA API. Waiting {wait_time}s before retry...")
-                print(f"Rate limited. Waiting {wait_time}s...")
-                time.sleep(wait_time)
+                # The shared rate limiter holds every fetcher for Retry-After
+                wait_time = response.throttle_wait
+                log_extraction_message(f"Rate limited by FDA API. Waiting {wait_time:.0f}s before retry...")
+                print(f"Rate limited. Waiting {wait_time:.1f}s...")
             elif response.status_code == 404:
                 error_body = response.text[:500]
                 log_extraction_message(f"FDA API returned 404 (no more data): {error_body}")
@@ -251,13 +1509,13 @@ def _fetch_with_retry(url, max_retries=3, timeout=60):
                 print(f"API error (attempt {attempt + 1}): HTTP {response.status_code} - {error_body}")
                 if attempt < max_retries - 1:
                     wait_time = 2 ** (attempt + 1)
-                    time.sleep(wait_time)
+                    yield ('sleep', wait_time)
         except requests.exceptions.RequestException as e:
             log_extraction_message(f"Network error (attempt {attempt + 1}/{max_retries}): {str(e)}")
             print(f"Network error (attempt {attempt + 1}): {str(e)}")
             if attempt < max_retries - 1:
                 wait_time = 2 ** (attempt + 1)
-                time.sleep(wait_time)
+                yield ('sleep', wait_time)
             response = None
     
     error_msg = f"Failed to fetch data after {max_retries} attempts"
@@ -265,64 +1523,153 @@ def _fetch_with_retry(url, max_retries=3, timeout=60):
         error_msg += f" (HTTP {response.status_code}: {response.text[:200]})"
     return None, error_msg
 
-def fetch_all_API_data(base_query, max_records=None, api_key=None):
-    """Fetch all records from the FDA API using search_after cursor-based pagination.
-    
-    Uses the openFDA 'search_after' feature (via Link header) to paginate through
-    unlimited result sets. Falls back to skip-based pagination if search_after
-    is not available.
-    
-    Preserves: API key batching, retry logic, progress logging, max_records, 
-    partial data on failure.
+async def _async_sleep(seconds):
+    await asyncio.sleep(seconds)
+
+def _run_steps(steps):
+    """Drive a step generator with blocking I/O and return its result.
+
+    Step generators hold the request, retry and pagination logic but do no
+    I/O themselves: they yield ('get', url, timeout) to have a rate-limited
+    GET performed (the response is sent back in, network errors are thrown
+    in) and ('sleep', seconds) to back off.
     """
-    all_data = []
-    key_to_use = api_key or FDA_API_KEY
-    limit = 1000 if key_to_use else 500
-    max_retries = 3
-    
-    if key_to_use:
-        log_extraction_message("Using FDA API key for faster extraction (1000 records per batch)...")
-    else:
-        log_extraction_message("No FDA API key provided. Downloading 500 records per batch. For 2x faster downloads, paste a free API key into the search form above.")
-    log_extraction_message("Starting FDA API data extraction (using search_after pagination)...")
-    print("Starting FDA API data extraction (search_after mode)...")
-    
-    # Get total count from a lightweight initial call
-    total_count = 0
     try:
-        count_url = _api_url(base_query, api_key=key_to_use, limit=1)
-        count_response = requests.get(count_url, timeout=30)
-        print(f"Count query response status: {count_response.status_code}")
-        if count_response.status_code == 200:
-            count_data = count_response.json()
-            total_count = count_data.get('meta', {}).get('results', {}).get('total', 0)
-            log_extraction_message(f"Found {total_count:,} total records available in FDA database")
-            print(f"Found {total_count:,} total records available in FDA database")
-        else:
-            error_body = count_response.text[:500]
-            log_extraction_message(f"Error on initial count query: HTTP {count_response.status_code} - {error_body}")
-            print(f"Error on initial count query: HTTP {count_response.status_code} - {error_body}")
-    except requests.exceptions.RequestException as e:
-        log_extraction_message(f"Network error on initial count query: {str(e)}")
-        print(f"Network error on initial count query: {str(e)}")
-    
-    # --- Try search_after pagination first ---
-    # Build the first request URL with sort (required for search_after) and NO skip
-    first_url = _api_url(base_query, api_key=key_to_use, limit=limit, sort="date_received:desc")
-    next_url = first_url
-    page_number = 0
-    use_search_after = True  # Will flip to False if we need to fall back
+        step = next(steps)
+        while True:
+            if step[0] == 'sleep':
+                time.sleep(step[1])
+                step = steps.send(None)
+                continue
+            _, url, timeout = step
+            try:
+                response = rate_limited_get(url, timeout=timeout)
+            except requests.exceptions.RequestException as e:
+                step = steps.throw(e)
+                continue
+            step = steps.send(response)
+    except StopIteration as done:
+        return done.value
+
+async def _run_steps_async(steps, client):
+    """Drive a step generator on the event loop; see _run_steps."""
+    try:
+        step = next(steps)
+        while True:
+            if step[0] == 'sleep':
+                await _async_sleep(step[1])
+                step = steps.send(None)
+                continue
+            _, url, timeout = step
+            limiter = _limiter_for_url(url)
+            wait = limiter.reserve()
+            if wait > 0:
+                await _async_sleep(wait)
+            try:
+                response = await client.get(url, timeout=timeout)
+            except requests.exceptions.RequestException as e:
+                step = steps.throw(e)
+                continue
+            _report_to_limiter(limiter, response)
+            step = steps.send(response)
+    except StopIteration as done:
+        return done.value
+
+def _run_step_generators(step_generators, workers, engine=None):
+    """Run step generators with at most `workers` in flight; return their results in order.
+
+    The threaded engine gives each generator a pool thread (a single one
+    runs inline); the asyncio engine runs them all as tasks on one event
+    loop sharing a keep-alive AsyncHTTPClient.
+    """
+    engine = engine or FETCH_ENGINE
+    if engine == 'asyncio':
+        async def run_all():
+            client = AsyncHTTPClient(pool_size=workers)
+            slots = asyncio.Semaphore(workers)
+
+            async def run_one(steps):
+                async with slots:
+                    return await _run_steps_async(steps, client)
+
+            try:
+                return await asyncio.gather(*(run_one(steps) for steps in step_generators))
+            finally:
+                await client.close()
+
+        return asyncio.run(run_all())
+    if engine != 'threads':
+        raise ValueError(f"Unknown fetch engine {engine!r} (expected 'threads' or 'asyncio')")
+    if len(step_generators) == 1:
+        return [_run_steps(step_generators[0])]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_run_steps, step_generators))
+
+def _strip_api_key(url):
+    """Remove the api_key parameter from a URL so it can be persisted safely."""
+    if not url:
+        return url
+    return re.sub(r'([?&])api_key=[^&]*&?', r'\1', url).rstrip('&?')
+
+def _with_api_key(url, key_to_use):
+    """Inject the API key into a URL if it is not already present."""
+    if key_to_use and "api_key=" not in url:
+        separator = "&" if "?" in url else "?"
+        url += f"{separator}api_key={key_to_use}"
+    return url
+
+def _fetch_pages(base_query, key_to_use, limit, on_page, total_count=0, max_records=None, verbose=True,
+                 max_retries=3, start_url=None, start_page=0, already_fetched=0, on_checkpoint=None,
+                 last_updated=None):
+    """Walk one query to completion, handing each page of records to on_page.
+
+    Tries search_after pagination first and falls back to skip-based
+    pagination if the first search_after request fails. With verbose=False
+    page-level progress only goes to stdout (used by the sharded engine,
+    which reports one line per shard instead). Pages are trimmed so no more
+    than max_records are delivered. Returns the number of records delivered.
+
+    After every delivered page on_checkpoint(next_url, page_number) is called
+    with the api_key-free URL of the following page, or None once the query
+    is exhausted; passing that URL back as start_url resumes the walk.
+    last_updated is the API data's meta.last_updated, keying the response
+    cache (see _fetch_with_retry).
+
+    Like _fetch_with_retry this is a step generator, run by a fetch engine.
+    """
+    log = log_extraction_message if verbose else (lambda message: None)
+    checkpoint = on_checkpoint or (lambda next_url, page_number: None)
+    fetched = 0
+    page_number = start_page
+
+    resume_skip = None
+    if start_url:
+        skip_match = re.search(r'[?&]skip=(\d+)', start_url)
+        if skip_match:
+            resume_skip = int(skip_match.group(1))
+
+    # --- Try search_after pagination first ---
+    use_search_after = resume_skip is None  # Will flip to False if we need to fall back
+    if use_search_after:
+        if start_url:
+            next_url = _with_api_key(start_url, key_to_use)
+        else:
+            # Build the first request URL with sort (required for search_after) and NO skip
+            next_url = _api_url(base_query, api_key=key_to_use, limit=limit, sort="date_received:desc")
+    else:
+        next_url = None
     
     while next_url:
         page_number += 1
-        records_so_far = len(all_data)
+        records_so_far = already_fetched + fetched
         
         if total_count > 0:
-            log_extraction_message(f"Fetching page {page_number}: records {records_so_far + 1:,} to {min(records_so_far + limit, total_count):,} of {total_count:,}...")
+            log(f"Fetching page {page_number}: records {records_so_far + 1:,} to {min(records_so_far + limit, total_count):,} of {total_count:,}...")
         else:
-            log_extraction_message(f"Fetching page {page_number}: records {records_so_far + 1:,} to {records_so_far + limit:,}...")
+            log(f"Fetching page {page_number}: records {records_so_far + 1:,} to {records_so_far + limit:,}...")
         
-        response, error_msg = _fetch_with_retry(next_url, max_retries=max_retries)
+        response, error_msg = yield from _fetch_with_retry(next_url, max_retries=max_retries,
+                                                           last_updated=last_updated)
         
         if response is None or response.status_code != 200:
             if error_msg:
@@ -335,334 +1682,2296 @@ def fetch_all_API_data(base_query, max_records=None, api_key=None):
                 use_search_after = False
                 break
             # Otherwise, return what we have
-            if all_data:
-                log_extraction_message(f"Returning {len(all_data):,} records collected before the error")
-                print(f"Returning {len(all_data):,} records collected before error")
+            if fetched:
+                log_extraction_message(f"Returning {fetched:,} records collected before the error")
+                print(f"Returning {fetched:,} records collected before error")
             break
         
         data = response.json()
         results = data.get('results', [])
         
         if not results:
-            log_extraction_message("No more results found")
+            log("No more results found")
             print("No more results in response")
+            checkpoint(None, page_number)
             break
         
-        all_data.extend(results)
+        if max_records:
+            results = results[:max_records - fetched]
+        next_url = _extract_next_url(response)
+        on_page(results)
+        fetched += len(results)
+        checkpoint(_strip_api_key(next_url), page_number)
         if total_count > 0:
-            log_extraction_message(f"Retrieved {len(results):,} records (Progress: {len(all_data):,}/{total_count:,})")
+            log(f"Retrieved {len(results):,} records (Progress: {already_fetched + fetched:,}/{total_count:,})")
         else:
-            log_extraction_message(f"Retrieved {len(results):,} records (Total: {len(all_data):,})")
-        print(f"Total collected so far: {len(all_data):,}")
+            log(f"Retrieved {len(results):,} records (Total: {already_fetched + fetched:,})")
+        print(f"Total collected so far: {already_fetched + fetched:,}")
         
         # Check if we hit max_records
-        if max_records and len(all_data) >= max_records:
-            log_extraction_message(f"Reached max_records limit ({max_records:,})")
+        if max_records and fetched >= max_records:
+            log(f"Reached max_records limit ({max_records:,})")
             break
         
-        # Extract next page URL from Link header
-        next_url = _extract_next_url(response)
+        # Next page URL comes from the Link header
         if not next_url:
-            log_extraction_message("No more pages (Link header absent — last page reached)")
+            log("No more pages (Link header absent — last page reached)")
             print("No Link header in response — reached last page")
             break
         
         # Inject API key into the next URL if not already present
-        if key_to_use and f"api_key=" not in next_url:
-            separator = "&" if "?" in next_url else "?"
-            next_url += f"{separator}api_key={key_to_use}"
-        
-        # Small delay to avoid rate limiting
-        time.sleep(0.3)
+        next_url = _with_api_key(next_url, key_to_use)
     
     # --- Fallback: skip-based pagination (if search_after failed on page 1) ---
-    if not use_search_after and not all_data:
-        log_extraction_message("Using skip-based pagination (26,000 record limit)...")
+    if not use_search_after and not fetched:
+        log("Using skip-based pagination (26,000 record limit)...")
         print("Using skip-based pagination fallback...")
-        skip = 0
+        skip = resume_skip or 0
         
         while True:
+            page_number += 1
             query = _api_url(base_query, api_key=key_to_use, limit=limit, skip=skip)
             current_batch = skip + limit
             if total_count > 0:
-                log_extraction_message(f"Fetching records {skip + 1:,} to {min(current_batch, total_count):,} of {total_count:,}...")
+                log(f"Fetching records {skip + 1:,} to {min(current_batch, total_count):,} of {total_count:,}...")
             else:
-                log_extraction_message(f"Fetching records {skip + 1:,} to {current_batch:,}...")
+                log(f"Fetching records {skip + 1:,} to {current_batch:,}...")
             
-            response, error_msg = _fetch_with_retry(query, max_retries=max_retries)
+            response, error_msg = yield from _fetch_with_retry(query, max_retries=max_retries,
+                                                               last_updated=last_updated)
             
             if response is None or response.status_code != 200:
                 if error_msg:
                     log_extraction_message(error_msg)
                     print(error_msg)
-                if all_data:
-                    log_extraction_message(f"Returning {len(all_data):,} records collected before the error")
-                    print(f"Returning {len(all_data):,} records collected before error")
+                if fetched:
+                    log_extraction_message(f"Returning {fetched:,} records collected before the error")
+                    print(f"Returning {fetched:,} records collected before error")
                 break
             
             data = response.json()
             results = data.get('results', [])
             
             if not results:
-                log_extraction_message("No more results found")
+                log("No more results found")
                 print("No more results in response")
+                checkpoint(None, page_number)
                 break
             
-            all_data.extend(results)
+            if max_records:
+                results = results[:max_records - fetched]
+            on_page(results)
+            fetched += len(results)
+            total_results = data.get('meta', {}).get('results', {}).get('total', 0)
+            exhausted = skip + limit >= total_results
+            checkpoint(None if exhausted else _strip_api_key(_api_url(base_query, limit=limit, skip=skip + limit)), page_number)
             if total_count > 0:
-                log_extraction_message(f"Retrieved {len(results):,} records (Progress: {len(all_data):,}/{total_count:,})")
+                log(f"Retrieved {len(results):,} records (Progress: {already_fetched + fetched:,}/{total_count:,})")
             else:
-                log_extraction_message(f"Retrieved {len(results):,} records (Total: {len(all_data):,})")
-            print(f"Total collected so far: {len(all_data):,}")
+                log(f"Retrieved {len(results):,} records (Total: {already_fetched + fetched:,})")
+            print(f"Total collected so far: {already_fetched + fetched:,}")
             
-            total_results = data.get('meta', {}).get('results', {}).get('total', 0)
-            if skip + limit >= total_results or (max_records and len(all_data) >= max_records):
+            if exhausted or (max_records and fetched >= max_records):
                 break
             
             skip += limit
-            time.sleep(0.3)
+
+    return fetched
+
+_DATE_RANGE_PATTERN = re.compile(r'date_received:\[(\d{8})\+TO\+(\d{8})\]')
+
+def _parse_date_range(base_query):
+    """Return the (lo, hi) YYYYMMDD bounds of the date_received clause, or None."""
+    match = _DATE_RANGE_PATTERN.search(base_query)
+    if not match:
+        return None
+    return match.group(1), match.group(2)
+
+def _with_date_range(base_query, lo, hi):
+    """Return base_query with its date_received clause narrowed to [lo TO hi]."""
+    return _DATE_RANGE_PATTERN.sub(f'date_received:[{lo}+TO+{hi}]', base_query, count=1)
+
+def _count_records(base_query, key_to_use):
+    """Return the total number of matching records, or None if the count query fails."""
+    try:
+        response = rate_limited_get(_api_url(base_query, api_key=key_to_use, limit=1), timeout=30)
+    except requests.exceptions.RequestException as e:
+        print(f"Network error on shard count query: {str(e)}")
+        return None
+    if response.status_code == 404:
+        return 0  # openFDA answers an empty window with 404 NOT_FOUND
+    if response.status_code != 200:
+        print(f"Shard count query failed: HTTP {response.status_code}")
+        return None
+    return response.json().get('meta', {}).get('results', {}).get('total', 0)
+
+def _plan_date_shards(base_query, total_count, key_to_use, target=None):
+    """Split the query's date_received range into windows of at most ~target records.
+
+    Windows are found by bisecting the date range with count queries, so busy
+    periods get narrow windows and quiet ones wide windows. Returns a list of
+    (lo, hi, count) tuples ordered newest first (matching date_received:desc),
+    or None if the query has no date range or a count probe fails.
+    """
+    target = target or SHARD_TARGET_RECORDS
+    bounds = _parse_date_range(base_query)
+    if not bounds:
+        return None
+    today = datetime.now().strftime('%Y%m%d')
+    pending = [(bounds[0], bounds[1], total_count)]
+    shards = []
+    while pending:
+        lo, hi, count = pending.pop()
+        if count == 0:
+            continue
+        # Open bounds (00010101 / 99991231) are kept in the query string but
+        # clamped when choosing split points so bisection stays in real dates.
+        lo_date = datetime.strptime(max(lo, MAUDE_EARLIEST_DATE), '%Y%m%d')
+        hi_date = datetime.strptime(min(hi, today), '%Y%m%d')
+        if count <= target or hi_date <= lo_date:
+            shards.append((lo, hi, count))
+            continue
+        mid_date = lo_date + (hi_date - lo_date) / 2
+        mid = mid_date.strftime('%Y%m%d')
+        next_day = (mid_date + timedelta(days=1)).strftime('%Y%m%d')
+        left_count = _count_records(_with_date_range(base_query, lo, mid), key_to_use)
+        if left_count is None:
+            return None
+        pending.append((lo, mid, left_count))
+        pending.append((next_day, hi, max(count - left_count, 0)))
+    shards.sort(key=lambda shard: shard[0], reverse=True)
+    return shards
+
+def _run_cursors(cursors, key_to_use, limit, workers, on_page, on_checkpoint=None, max_records=None,
+                 preserve_order=False, seen_keys=None, engine=None, last_updated=None):
+    """Walk a list of extraction cursors, handing pages to on_page.
+
+    Each cursor is a dict with the query to walk plus optional resume state
+    (next_url, page_count, rows_written) and, for date windows, lo/hi/count.
+    A single cursor is walked with page-level progress; several are fetched
+    `workers` at a time with one progress line per window, on threads or on
+    an event loop depending on `engine` (default FETCH_ENGINE).
+    on_checkpoint(position, next_url, page_number, rows) is called after
+    each page of the cursor at that position, with the number of records
+    delivered for that cursor since its previous checkpoint.
+
+    Records from several windows are de-duplicated on mdr_report_key (seeded
+    from seen_keys when resuming) in case the API returns a report in two
+    adjacent windows. Pages are delivered as soon as they arrive; with
+    preserve_order=True a window's pages are held back until every newer
+    window has been delivered, so the output stays newest first.
+    last_updated keys the response cache (see _fetch_pages).
+    Returns the number of records delivered.
+    """
+    if len(cursors) == 1:
+        cursor = cursors[0]
+        checkpoint = None
+        page_rows = [0]
+
+        def single_page(results):
+            on_page(results)
+            page_rows[0] += len(results)
+
+        if on_checkpoint:
+            def checkpoint(next_url, page_number):
+                on_checkpoint(0, next_url, page_number, page_rows[0])
+                page_rows[0] = 0
+        steps = _fetch_pages(cursor['query'], key_to_use, limit, single_page, total_count=cursor.get('count') or 0,
+                             max_records=max_records, start_url=cursor.get('next_url'),
+                             start_page=cursor.get('page_count', 0), already_fetched=cursor.get('rows_written', 0),
+                             on_checkpoint=checkpoint, last_updated=last_updated)
+        return _run_step_generators([steps], 1, engine)[0]
+
+    log_extraction_message(f"Splitting extraction into {len(cursors)} date windows across {workers} parallel workers...")
+    print(f"Sharded extraction: {len(cursors)} windows, {workers} workers")
+
+    lock = threading.Lock()
+    seen_keys = set(seen_keys or ())
+    counters = {'delivered': 0, 'duplicates': 0}
+    held_pages = {i: [] for i in range(len(cursors))}
+    rows_since_checkpoint = [0] * len(cursors)
+    finished = set()
+    next_shard = [0]
+
+    def unique(results):
+        kept = []
+        for record in results:
+            report_key = record.get('mdr_report_key')
+            if report_key:
+                if report_key in seen_keys:
+                    counters['duplicates'] += 1
+                    continue
+                seen_keys.add(report_key)
+            kept.append(record)
+        return kept
+
+    def release_held():
+        # Deliver completed windows in order, plus the head window's pages so far
+        while next_shard[0] < len(cursors):
+            index = next_shard[0]
+            for page in held_pages[index]:
+                deliver(page, index)
+            held_pages[index] = []
+            if index not in finished:
+                break
+            next_shard[0] += 1
+
+    def deliver(results, index):
+        results = unique(results)
+        if results:
+            on_page(results)
+            counters['delivered'] += len(results)
+            rows_since_checkpoint[index] += len(results)
+
+    def fetch_shard(index, cursor):
+        def shard_page(results):
+            with lock:
+                if preserve_order and index != next_shard[0]:
+                    held_pages[index].append(results)
+                else:
+                    deliver(results, index)
+
+        checkpoint = None
+        if on_checkpoint:
+            def checkpoint(next_url, page_number):
+                with lock:
+                    rows = rows_since_checkpoint[index]
+                    rows_since_checkpoint[index] = 0
+                on_checkpoint(index, next_url, page_number, rows)
+        records = yield from _fetch_pages(cursor['query'], key_to_use, limit, shard_page,
+                                          total_count=cursor.get('count') or 0, verbose=False,
+                                          start_url=cursor.get('next_url'), start_page=cursor.get('page_count', 0),
+                                          already_fetched=cursor.get('rows_written', 0), on_checkpoint=checkpoint,
+                                          last_updated=last_updated)
+        with lock:
+            finished.add(index)
+            if preserve_order:
+                release_held()
+        label = f"{cursor['lo']}-{cursor['hi']}" if cursor.get('lo') else cursor['query']
+        log_extraction_message(f"Shard {index + 1}/{len(cursors)} ({label}): retrieved {records:,} of {cursor.get('count') or 0:,} records")
+        return records
+
+    _run_step_generators([fetch_shard(i, cursor) for i, cursor in enumerate(cursors)], workers, engine)
+
+    if counters['duplicates']:
+        log_extraction_message(f"Dropped {counters['duplicates']:,} duplicate reports returned by overlapping windows")
+    return counters['delivered']
+
+def _probe_total_count(base_query, key_to_use):
+    """Log the start of an extraction and return (total matching records, API meta.last_updated).
+
+    Cached pages are only reused for the same last_updated, so callers pass
+    it on to the extraction's cursors; it is None when the count query failed.
+    """
+    if key_to_use:
+        log_extraction_message("Using FDA API key for faster extraction (1000 records per batch)...")
+    else:
+        log_extraction_message("No FDA API key provided. Downloading 500 records per batch. For 2x faster downloads, paste a free API key into the search form above.")
+    log_extraction_message("Starting FDA API data extraction (using search_after pagination)...")
+    print("Starting FDA API data extraction (search_after mode)...")
     
+    # Get total count from a lightweight initial call
+    total_count = 0
+    last_updated = None
+    try:
+        count_url = _api_url(base_query, api_key=key_to_use, limit=1)
+        count_response = rate_limited_get(count_url, timeout=30)
+        print(f"Count query response status: {count_response.status_code}")
+        if count_response.status_code == 200:
+            count_data = count_response.json()
+            total_count = count_data.get('meta', {}).get('results', {}).get('total', 0)
+            last_updated = count_data.get('meta', {}).get('last_updated')
+            log_extraction_message(f"Found {total_count:,} total records available in FDA database")
+            print(f"Found {total_count:,} total records available in FDA database")
+        else:
+            error_body = count_response.text[:500]
+            log_extraction_message(f"Error on initial count query: HTTP {count_response.status_code} - {error_body}")
+            print(f"Error on initial count query: HTTP {count_response.status_code} - {error_body}")
+    except requests.exceptions.RequestException as e:
+        log_extraction_message(f"Network error on initial count query: {str(e)}")
+        print(f"Network error on initial count query: {str(e)}")
+    return total_count, last_updated
+
+def _plan_cursors(base_query, total_count, key_to_use, max_records, workers):
+    """Return the cursors for an extraction: one per date window, or a single one."""
+    # Shard only when it pays off: several workers, a date range to split and
+    # more records than a single window holds (and no smaller max_records cap).
+    if workers > 1 and total_count > SHARD_TARGET_RECORDS and not (max_records and max_records < total_count):
+        shards = _plan_date_shards(base_query, total_count, key_to_use)
+        if shards and len(shards) > 1:
+            return [{'query': _with_date_range(base_query, lo, hi), 'lo': lo, 'hi': hi, 'count': count}
+                    for lo, hi, count in shards]
+    return [{'query': base_query, 'count': total_count}]
+
+def _log_extraction_summary(delivered, total_count, max_records, cache_before=None):
+    if cache_before is not None:
+        response_cache.log_stats_since(cache_before)
     # Final summary
-    if max_records and len(all_data) >= max_records:
-        all_data = all_data[:max_records]
-        log_extraction_message(f"API extraction completed. Retrieved {len(all_data):,} records (limited to {max_records:,})")
+    if max_records and delivered >= max_records:
+        log_extraction_message(f"API extraction completed. Retrieved {delivered:,} records (limited to {max_records:,})")
     else:
-        log_extraction_message(f"API extraction completed. Retrieved {len(all_data):,} records out of {total_count:,} available")
-    print(f"API extraction completed. Total records: {len(all_data):,}")
+        log_extraction_message(f"API extraction completed. Retrieved {delivered:,} records out of {total_count:,} available")
+    print(f"API extraction completed. Total records: {delivered:,}")
+
+def fetch_API_pages(base_query, on_page, max_records=None, api_key=None, workers=None, preserve_order=False):
+    """Stream records from the FDA API, calling on_page(results) for every page.
+
+    Uses the openFDA 'search_after' feature (via Link header) to paginate through
+    unlimited result sets. Falls back to skip-based pagination if search_after
+    is not available.
+
+    Large queries with a date_received range are split into date windows
+    sized from count queries and fetched in parallel, `workers` at a time
+    (default FETCH_WORKERS), with de-duplication on mdr_report_key. With the
+    threaded engine on_page may then be called from several threads; with
+    MAUDE_FETCH_ENGINE=asyncio all windows share one event loop instead.
+    
+    Preserves: API key batching, retry logic, progress logging, max_records, 
+    partial data on failure. Returns the number of records delivered.
+    """
+    key_to_use = api_key or FDA_API_KEY
+    limit = 1000 if key_to_use else 500
+    workers = FETCH_WORKERS if workers is None else workers
+    cache_before = response_cache.snapshot()
+    total_count, last_updated = _probe_total_count(base_query, key_to_use)
+    cursors = _plan_cursors(base_query, total_count, key_to_use, max_records, workers)
+    delivered = _run_cursors(cursors, key_to_use, limit, min(workers, len(cursors)), on_page,
+                             max_records=max_records, preserve_order=preserve_order, last_updated=last_updated)
+    _log_extraction_summary(delivered, total_count, max_records, cache_before)
+    return delivered
+
+def fetch_all_API_data(base_query, max_records=None, api_key=None, workers=None):
+    """Fetch all records from the FDA API into a list, newest first.
+
+    See fetch_API_pages for pagination, sharding and error handling.
+    """
+    all_data = []
+    fetch_API_pages(base_query, all_data.extend, max_records=max_records, api_key=api_key,
+                    workers=workers, preserve_order=True)
     return all_data
 
-# Enhanced save function for comprehensive data with real-time logging
-def save_comprehensive_data(data):
+def _clear_data_tables(conn):
+    """Delete all stored query results and reset the id counters.
+
+    The secondary indexes are dropped too; callers rebuild them with
+    create_managed_indexes() once the new dataset is loaded.
+    """
+    log_extraction_message("Clearing previous query results from database...")
+    drop_managed_indexes(conn)
+    for table in ['mdr_texts', 'patients', 'devices', 'events', 'extraction_reports']:
+        conn.execute(f"DELETE FROM {table}")
+    _reset_flat_events(conn)
+    
+    # Reset auto-increment counters if the sqlite_sequence table exists
+    try:
+        conn.execute("DELETE FROM sqlite_sequence WHERE name IN ('events', 'devices', 'patients', 'mdr_texts')")
+    except sqlite3.OperationalError:
+        pass  # Ignore if sqlite_sequence doesn't exist yet
+
+def save_comprehensive_data(data, base_query=None, dataset=None):
     log_extraction_message("Starting database save operation...")
     
-    with get_db_connection() as conn:
-        # Clear existing data before saving new query results
-        log_extraction_message("Clearing previous query results from database...")
-        for table in ['mdr_texts', 'patients', 'devices', 'events']:
-            conn.execute(f"DELETE FROM {table}")
-        
-        # Reset auto-increment counters if the sqlite_sequence table exists
-        try:
-            conn.execute("DELETE FROM sqlite_sequence WHERE name IN ('events', 'devices', 'patients', 'mdr_texts')")
-        except sqlite3.OperationalError:
-            pass  # Ignore if sqlite_sequence doesn't exist yet
+    with db_writer() as conn, bulk_load_settings(conn):
+        # Replace the dataset's previous query results with these
+        extraction_id = _create_extraction(conn, dataset or DEFAULT_DATASET, base_query, total_count=len(data),
+                                           status='completed')
+        _activate_extraction(conn, extraction_id)
             
         total_records = len(data)
         log_extraction_message(f"Processing {total_records:,} records for database storage...")
+        _insert_event_records(conn, data, log_progress=True, extraction_id=extraction_id)
+        conn.execute('UPDATE extractions SET rows_written = ? WHERE id = ?', (total_records, extraction_id))
+        _update_dataset_stats(conn, extraction_id)
+        create_managed_indexes(conn)
         
-        for i, record in enumerate(data, 1):
-            if i % 100 == 0:  # Log progress every 100 records
-                log_extraction_message(f"Processing record {i:,}/{total_records:,}...")
-            
-            # Insert main event record
-            cursor = conn.execute('''
-                INSERT INTO events (
-                    report_number, event_type, event_location, date_received, 
-                    date_of_event, report_date, date_facility_aware, date_added,
-                    date_changed, report_to_fda, adverse_event_flag, product_problem_flag,
-                    report_source_code, health_professional, number_devices_in_event,
-                    number_patients_in_event, noe_summarized, manufacturer_name,
-                    manufacturer_address_1, manufacturer_address_2, manufacturer_city,
-                    manufacturer_state, manufacturer_zip_code, manufacturer_country,
-                    manufacturer_postal_code, type_of_report, remedial_action, raw_json
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                record.get('report_number'),
-                record.get('event_type'),
-                record.get('event_location'),
-                record.get('date_received'),
-                record.get('date_of_event'),
-                record.get('report_date'),
-                record.get('date_facility_aware'),
-                record.get('date_added'),
-                record.get('date_changed'),
-                record.get('report_to_fda'),
-                record.get('adverse_event_flag'),
-                record.get('product_problem_flag'),
-                record.get('report_source_code'),
-                record.get('health_professional'),
-                record.get('number_devices_in_event'),
-                record.get('number_patients_in_event'),
-                record.get('noe_summarized'),
-                record.get('manufacturer_name'),
-                record.get('manufacturer_address_1'),
-                record.get('manufacturer_address_2'),
-                record.get('manufacturer_city'),
-                record.get('manufacturer_state'),
-                record.get('manufacturer_zip_code'),
-                record.get('manufacturer_country'),
-                record.get('manufacturer_postal_code'),
-                json.dumps(record.get('type_of_report', [])),
-                json.dumps(record.get('remedial_action', [])),
-                json.dumps(record)
+        conn.commit()
+        log_extraction_message("Database save completed successfully!")
+
+_encode_json = json.JSONEncoder().encode
+
+def _json_list(value):
+    # Most list fields are empty; skip the encoder for them
+    return '[]' if not value else _encode_json(value)
+
+# Storage codec for the raw_json / raw_device_json / raw_patient_json
+# payloads. Values are stored as BLOBs: one codec byte followed by a zlib
+# stream compressed against a preset dictionary. Rows written before the
+# codec existed are plain TEXT and decode unchanged. A new dictionary must
+# get a new codec byte so existing rows keep decoding.
+PAYLOAD_CODEC_ZLIB_V1 = 1
+PAYLOAD_COMPRESSION_LEVEL = int(os.environ.get('MAUDE_PAYLOAD_COMPRESSION_LEVEL', '6'))
+
+def _payload_dictionary():
+    """Hand-built preset zlib dictionary of recurring openFDA device-event field names and values.
+
+    Built from the openFDA record layout: every field name with the separators
+    and values that recur across reports. zlib prefers recent dictionary
+    content, so the most frequent strings come last.
+    """
+    rare = [
+        'manufacturer_g1_name', 'manufacturer_g1_address_1', 'manufacturer_g1_address_2',
+        'manufacturer_g1_city', 'manufacturer_g1_state', 'manufacturer_g1_zip_code',
+        'manufacturer_g1_zip_code_ext', 'manufacturer_g1_country', 'manufacturer_g1_postal_code',
+        'manufacturer_contact_t_name', 'manufacturer_contact_f_name', 'manufacturer_contact_l_name',
+        'manufacturer_contact_address_1', 'manufacturer_contact_address_2', 'manufacturer_contact_city',
+        'manufacturer_contact_state', 'manufacturer_contact_zip_code', 'manufacturer_contact_zip_ext',
+        'manufacturer_contact_postal_code', 'manufacturer_contact_country', 'manufacturer_contact_pcountry',
+        'manufacturer_contact_area_code', 'manufacturer_contact_exchange', 'manufacturer_contact_phone_number',
+        'manufacturer_contact_extension', 'manufacturer_contact_pcity', 'manufacturer_contact_plocal',
+        'manufacturer_d_address_1', 'manufacturer_d_address_2', 'manufacturer_d_city', 'manufacturer_d_state',
+        'manufacturer_d_zip_code', 'manufacturer_d_zip_code_ext', 'manufacturer_d_country',
+        'manufacturer_d_postal_code', 'manufacturer_link_flag', 'distributor_name', 'distributor_address_1',
+        'distributor_address_2', 'distributor_city', 'distributor_state', 'distributor_zip_code',
+        'distributor_zip_code_ext', 'removal_correction_number', 'reprocessed_and_reused_flag',
+        'reporter_occupation_code', 'initial_report_to_fda', 'single_use_flag', 'previous_use_code',
+        'exemption_number', 'source_type', 'type_of_report', 'remedial_action', 'device_date_of_manufacturer',
+        'device_evaluated_by_manufacturer', 'device_age_text', 'expiration_date_of_device',
+        'date_returned_to_manufacturer', 'date_manufacturer_received', 'pma_pmn_number',
+        'registration_number', 'fei_number', 'k_number', 'other_id_number', 'udi_di', 'udi_public',
+        'combination_product_flag', 'baseline_510_k_number', 'product_problems', 'patient_problems',
+    ]
+    common = [
+        'report_number', 'event_type', 'event_location', 'date_of_event', 'date_report',
+        'date_facility_aware', 'report_date', 'report_to_fda', 'report_to_manufacturer',
+        'date_report_to_manufacturer', 'event_key', 'adverse_event_flag', 'product_problem_flag',
+        'report_source_code', 'health_professional', 'number_devices_in_event',
+        'number_patients_in_event', 'noe_summarized', 'summary_report_flag', 'manufacturer_name',
+        'manufacturer_address_1', 'manufacturer_address_2', 'manufacturer_city', 'manufacturer_state',
+        'manufacturer_zip_code', 'manufacturer_zip_code_ext', 'manufacturer_country',
+        'manufacturer_postal_code', 'mdr_report_key', 'date_received', 'date_added', 'date_changed',
+        'patient_sequence_number', 'patient_age', 'patient_sex', 'patient_weight', 'patient_ethnicity',
+        'patient_race', 'sequence_number_outcome', 'sequence_number_treatment',
+        'device_sequence_number', 'brand_name', 'generic_name', 'manufacturer_d_name', 'model_number',
+        'catalog_number', 'lot_number', 'device_operator', 'device_availability',
+        'device_report_product_code', 'implant_flag', 'date_removed_flag', 'device_name',
+        'medical_specialty_description', 'regulation_number', 'device_class', 'openfda',
+        'mdr_text_key', 'text_type_code', 'text', 'mdr_text', 'patient', 'device',
+    ]
+    values = [
+        'Malfunction', 'Injury', 'Death', 'Other', 'No answer provided', 'Not Applicable',
+        'Unknown', 'UNKNOWN', 'Manufacturer report', 'Voluntary report', 'User facility report',
+        'Distributor report', 'Initial submission', 'Followup', 'HEALTH PROFESSIONAL', 'LAY USER/PATIENT',
+        'Device Not Returned to Manufacturer', 'Device was Returned to Manufacturer',
+        'Hospitalization', 'Required Intervention', 'Life Threatening', 'Disability',
+        'No Known Impact Or Consequence To Patient', 'Patient Problem/Medical Problem',
+        'Device Operates Differently Than Expected', 'Adverse Event Without Identified Device or Use Problem',
+        'Additional Manufacturer Narrative', 'Description of Event or Problem', 'Manufacturer Evaluation Summary',
+        'UNITED STATES', 'US', 'INC', 'LLC', 'CORPORATION', 'MEDICAL', 'Female', 'Male', 'YR', 'LB', 'KG',
+        'White', 'Hispanic or Latino', 'Not Hispanic or Latino', 'Black or African American',
+    ]
+    flags = ['"N"', '"Y"', '""', '[]', '"1"', '"2"', '"0"', 'null', 'true', 'false']
+    parts = [f'"{name}": ' for name in rare]
+    parts += [f'"{value}"' for value in values]
+    parts += flags
+    parts += [f'"{name}": ' for name in common]
+    parts.append('{"sequence_number_outcome": ["Other"], "patient_sequence_number": "1", ')
+    parts.append('"openfda": {"device_name": "", "device_class": "2", "regulation_number": "", '
+                 '"medical_specialty_description": ""}, ')
+    return ', '.join(parts).encode('utf-8')
+
+_PAYLOAD_DICTIONARIES = {PAYLOAD_CODEC_ZLIB_V1: _payload_dictionary()}
+
+def encode_payload(text):
+    """Compress a JSON payload string for storage."""
+    compressor = zlib.compressobj(PAYLOAD_COMPRESSION_LEVEL, zdict=_PAYLOAD_DICTIONARIES[PAYLOAD_CODEC_ZLIB_V1])
+    return bytes([PAYLOAD_CODEC_ZLIB_V1]) + compressor.compress(text.encode('utf-8')) + compressor.flush()
+
+def decode_payload(value):
+    """Return the JSON text of a stored payload, compressed or not.
+
+    This is the single read path for raw_json, raw_device_json and
+    raw_patient_json; None passes through.
+    """
+    if value is None or isinstance(value, str):
+        return value
+    codec = value[0]
+    if codec not in _PAYLOAD_DICTIONARIES:
+        raise ValueError(f'Unknown payload codec {codec}')
+    decompressor = zlib.decompressobj(zdict=_PAYLOAD_DICTIONARIES[codec])
+    return (decompressor.decompress(value[1:]) + decompressor.flush()).decode('utf-8')
+
+def load_payload(value):
+    """Decode a stored payload and parse it as JSON."""
+    return json.loads(decode_payload(value))
+
+def _decode_payload_columns(df, columns):
+    """Replace stored payloads in DataFrame columns with their JSON text."""
+    for column in columns:
+        if column in df.columns:
+            df[column] = df[column].map(decode_payload)
+    return df
+
+class BulkWriter:
+    """Buffers event, device, patient and MDR text rows and writes them with executemany.
+
+    Reports are upserted on mdr_report_key: a report whose content hash
+    matches the stored row is left alone, a changed one is updated in place
+    (keeping its event id) with its child rows replaced, and a new one gets
+    an id continuing after the highest id SQLite has handed out, so child
+    rows are linked without a lastrowid round-trip per event. With an
+    extraction_id every report passed in, written or not, is recorded in
+    extraction_reports. Each written report is also flattened into
+    events_flat and its multi-valued fields into MULTI_VALUE_TABLES. Records are buffered until batch_size events and by flush(),
+    which callers must invoke before committing.
+    """
+
+    EVENT_COLUMNS = ('id', 'report_number', 'event_type', 'event_location', 'date_received',
+                     'date_of_event', 'report_date', 'date_facility_aware', 'date_added',
+                     'date_changed', 'report_to_fda', 'adverse_event_flag', 'product_problem_flag',
+                     'report_source_code', 'health_professional', 'number_devices_in_event',
+                     'number_patients_in_event', 'noe_summarized', 'manufacturer_name',
+                     'manufacturer_address_1', 'manufacturer_address_2', 'manufacturer_city',
+                     'manufacturer_state', 'manufacturer_zip_code', 'manufacturer_country',
+                     'manufacturer_postal_code', 'type_of_report', 'remedial_action', 'raw_json',
+                     'mdr_report_key', 'content_hash')
+    DEVICE_COLUMNS = ('event_id', 'device_sequence_number', 'brand_name', 'generic_name',
+                      'manufacturer_d_name', 'model_number', 'catalog_number', 'lot_number',
+                      'device_operator', 'device_availability', 'device_report_product_code',
+                      'device_name', 'medical_specialty_description', 'regulation_number',
+                      'device_class', 'implant_flag', 'raw_device_json')
+    PATIENT_COLUMNS = ('event_id', 'patient_sequence_number', 'patient_age', 'patient_sex',
+                       'patient_weight', 'patient_ethnicity', 'patient_race',
+                       'sequence_number_outcome', 'sequence_number_treatment', 'raw_patient_json')
+    TEXT_COLUMNS = ('event_id', 'text_type_code', 'patient_sequence_number', 'text', 'mdr_text_key')
+
+    def __init__(self, conn, batch_size=None, extraction_id=None):
+        self.conn = conn
+        self.batch_size = batch_size or WRITE_BATCH_SIZE
+        self.extraction_id = extraction_id
+        self.next_id = None
+        self.pending = []
+        self.inserted = self.updated = self.unchanged = 0
+        self.events, self.devices, self.patients, self.texts, self.members = [], [], [], [], []
+        self.flat = []
+        self.values = {table: [] for table in MULTI_VALUE_TABLES}
+        event_updates = ', '.join(f'{column} = excluded.{column}' for column in self.EVENT_COLUMNS[1:])
+        self.statements = [
+            (self.events, self._insert_sql('events', self.EVENT_COLUMNS) +
+             f' ON CONFLICT (mdr_report_key) DO UPDATE SET {event_updates}'),
+            (self.devices, self._insert_sql('devices', self.DEVICE_COLUMNS)),
+            (self.patients, self._insert_sql('patients', self.PATIENT_COLUMNS)),
+            (self.texts, self._insert_sql('mdr_texts', self.TEXT_COLUMNS)),
+            (self.members, 'INSERT OR IGNORE INTO extraction_reports (extraction_id, event_id) VALUES (?, ?)'),
+        ] + [(rows, _multi_value_insert_sql(table)) for table, rows in self.values.items()]
+
+    @staticmethod
+    def _insert_sql(table, columns):
+        return f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+
+    def _allocate_id(self):
+        if self.next_id is None:
+            highest = self.conn.execute('SELECT COALESCE(MAX(id), 0) FROM events').fetchone()[0]
+            try:
+                row = self.conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'events'").fetchone()
+            except sqlite3.OperationalError:
+                row = None  # sqlite_sequence is created by the first AUTOINCREMENT insert
+            self.next_id = max(highest, row[0] if row else 0) + 1
+        event_id = self.next_id
+        self.next_id += 1
+        return event_id
+
+    def _stored_reports(self, keys):
+        """Map each stored mdr_report_key in keys to its (event id, content hash)."""
+        stored = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            for row in self.conn.execute(
+                    f'SELECT mdr_report_key, id, content_hash FROM events WHERE mdr_report_key IN ({placeholders})', chunk):
+                stored[row[0]] = (row[1], row[2])
+        return stored
+
+    def add(self, records):
+        """Buffer API records (with their devices, patients and MDR texts)."""
+        self.pending.extend(records)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def _buffer_rows(self):
+        # A report repeated within the buffer is written once, with its last content
+        records = {}
+        for record in self.pending:
+            key = record.get('mdr_report_key')
+            records[key if key else ('', len(records))] = record
+        self.pending = []
+        stored = self._stored_reports([key for key in records if isinstance(key, str)])
+        replaced = []
+        for key, record in records.items():
+            text = _encode_json(record)
+            content_hash = hashlib.sha1(text.encode('utf-8')).hexdigest()
+            existing = stored.get(key)
+            if existing is None:
+                event_id = self._allocate_id()
+                self.inserted += 1
+            elif existing[1] == content_hash:
+                self.unchanged += 1
+                if self.extraction_id is not None:
+                    self.members.append((self.extraction_id, existing[0]))
+                continue
+            else:
+                event_id = existing[0]
+                replaced.append(event_id)
+                self.updated += 1
+            if self.extraction_id is not None:
+                self.members.append((self.extraction_id, event_id))
+            get = record.get
+            self.events.append((
+                event_id, get('report_number'), get('event_type'), get('event_location'),
+                get('date_received'), get('date_of_event'), get('report_date'),
+                get('date_facility_aware'), get('date_added'), get('date_changed'),
+                get('report_to_fda'), get('adverse_event_flag'), get('product_problem_flag'),
+                get('report_source_code'), get('health_professional'), get('number_devices_in_event'),
+                get('number_patients_in_event'), get('noe_summarized'), get('manufacturer_name'),
+                get('manufacturer_address_1'), get('manufacturer_address_2'), get('manufacturer_city'),
+                get('manufacturer_state'), get('manufacturer_zip_code'), get('manufacturer_country'),
+                get('manufacturer_postal_code'), _json_list(get('type_of_report', [])),
+                _json_list(get('remedial_action', [])), encode_payload(text), get('mdr_report_key'),
+                content_hash,
             ))
-            
-            event_id = cursor.lastrowid
-            
-            # Insert device records
-            devices = record.get('device', [])
-            for device in devices:
+            for device in get('device', []):
                 openfda = device.get('openfda', {})
-                conn.execute('''
-                    INSERT INTO devices (
-                        event_id, device_sequence_number, brand_name, generic_name,
-                        manufacturer_d_name, model_number, catalog_number, lot_number,
-                        device_operator, device_availability, device_report_product_code,
-                        device_name, medical_specialty_description, regulation_number,
-                        device_class, implant_flag, raw_device_json
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    event_id,
-                    device.get('device_sequence_number'),
-                    device.get('brand_name'),
-                    device.get('generic_name'),
-                    device.get('manufacturer_d_name'),
-                    device.get('model_number'),
-                    device.get('catalog_number'),
-                    device.get('lot_number'),
-                    device.get('device_operator'),
-                    device.get('device_availability'),
-                    device.get('device_report_product_code'),
-                    openfda.get('device_name'),
-                    openfda.get('medical_specialty_description'),
-                    openfda.get('regulation_number'),
-                    openfda.get('device_class'),
-                    device.get('implant_flag'),
-                    json.dumps(device)
+                self.devices.append((
+                    event_id, device.get('device_sequence_number'), device.get('brand_name'),
+                    device.get('generic_name'), device.get('manufacturer_d_name'), device.get('model_number'),
+                    device.get('catalog_number'), device.get('lot_number'), device.get('device_operator'),
+                    device.get('device_availability'), device.get('device_report_product_code'),
+                    openfda.get('device_name'), openfda.get('medical_specialty_description'),
+                    openfda.get('regulation_number'), openfda.get('device_class'),
+                    device.get('implant_flag'), encode_payload(_encode_json(device)),
                 ))
-            
-            # Insert patient records
-            patients = record.get('patient', [])
-            for patient in patients:
-                conn.execute('''
-                    INSERT INTO patients (
-                        event_id, patient_sequence_number, patient_age, patient_sex,
-                        patient_weight, patient_ethnicity, patient_race,
-                        sequence_number_outcome, sequence_number_treatment, raw_patient_json
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    event_id,
-                    patient.get('patient_sequence_number'),
-                    patient.get('patient_age'),
-                    patient.get('patient_sex'),
-                    patient.get('patient_weight'),
-                    patient.get('patient_ethnicity'),
-                    patient.get('patient_race'),
-                    json.dumps(patient.get('sequence_number_outcome', [])),
-                    json.dumps(patient.get('sequence_number_treatment', [])),
-                    json.dumps(patient)
+            for patient in get('patient', []):
+                self.patients.append((
+                    event_id, patient.get('patient_sequence_number'), patient.get('patient_age'),
+                    patient.get('patient_sex'), patient.get('patient_weight'), patient.get('patient_ethnicity'),
+                    patient.get('patient_race'), _json_list(patient.get('sequence_number_outcome', [])),
+                    _json_list(patient.get('sequence_number_treatment', [])), encode_payload(_encode_json(patient)),
                 ))
-            
-            # Insert MDR text records
-            mdr_texts = record.get('mdr_text', [])
-            for mdr_text in mdr_texts:
-                conn.execute('''
-                    INSERT INTO mdr_texts (
-                        event_id, text_type_code, patient_sequence_number, text, mdr_text_key
-                    ) VALUES (?, ?, ?, ?, ?)
-                ''', (
-                    event_id,
-                    mdr_text.get('text_type_code'),
-                    mdr_text.get('patient_sequence_number'),
-                    mdr_text.get('text'),
-                    mdr_text.get('mdr_text_key', '')
+            for mdr_text in get('mdr_text', []):
+                self.texts.append((
+                    event_id, mdr_text.get('text_type_code'), mdr_text.get('patient_sequence_number'),
+                    mdr_text.get('text'), mdr_text.get('mdr_text_key', ''),
                 ))
-        
+            self.flat.append((event_id, _flat_event_row(record)))
+            for table, row in _multi_value_rows(event_id, record):
+                self.values[table].append(row)
+        for start in range(0, len(replaced), 500):
+            chunk = replaced[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            for table in EVENT_CHILD_TABLES:
+                self.conn.execute(f'DELETE FROM {table} WHERE event_id IN ({placeholders})', chunk)
+
+    def flush(self):
+        """Write every buffered record (without committing)."""
+        if self.pending:
+            self._buffer_rows()
+        for rows, sql in self.statements:
+            if rows:
+                self.conn.executemany(sql, rows)
+                rows.clear()
+        if self.flat:
+            write_flat_events(self.conn, self.flat)
+            self.flat.clear()
+
+    def discard(self):
+        """Drop buffered rows, e.g. before rolling back; ids are re-read on next use."""
+        self.pending = []
+        for rows, _ in self.statements:
+            rows.clear()
+        self.flat.clear()
+        self.next_id = None
+
+@contextmanager
+def bulk_load_settings(conn):
+    """Tune a connection for a large load, restoring its settings afterwards.
+
+    Switches the database to WAL (which persists, and stays crash-safe with
+    the default synchronous=FULL) and, for the duration of the load only,
+    uses synchronous=NORMAL, a 64 MB page cache and in-memory temp storage.
+    """
+    saved = {name: conn.execute(f'PRAGMA {name}').fetchone()[0]
+             for name in ('synchronous', 'cache_size', 'temp_store')}
+    try:
+        conn.execute('PRAGMA journal_mode=WAL')
+    except sqlite3.OperationalError:
+        pass  # Inside a transaction or on a read-only file: keep the current journal
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA cache_size=-65536')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    try:
+        yield conn
+    finally:
+        try:
+            for name, value in saved.items():
+                conn.execute(f'PRAGMA {name}={value}')
+        except sqlite3.OperationalError:
+            pass  # A load that failed mid-transaction; the connection is discarded anyway
+
+def _insert_event_records(conn, data, log_progress=False, extraction_id=None):
+    """Upsert API records (and their devices, patients and MDR texts) without committing."""
+    writer = BulkWriter(conn, extraction_id=extraction_id)
+    total_records = len(data)
+    for start in range(0, total_records, writer.batch_size):
+        writer.add(data[start:start + writer.batch_size])
+        writer.flush()
+        if log_progress:
+            log_extraction_message(f"Processed {min(start + writer.batch_size, total_records):,}/{total_records:,} records...")
+
+def _stream_cursors_to_db(extraction_id, cursors, key_to_use, limit, workers, max_records=None,
+                          seen_keys=None, job=None, last_updated=None):
+    """Run extraction cursors on a producer thread and write pages on this one.
+
+    Pages travel to the writer through a bounded queue (PIPELINE_QUEUE_PAGES
+    pages), so network and disk work overlap while memory stays flat. Each
+    page's rows are committed together with its cursor checkpoint, so an
+    interrupted run can resume exactly where the database left off. The
+    shared writer connection is only taken for each of those commits, so
+    jobs on other datasets write in between. Reports
+    are upserted on mdr_report_key and listed as the extraction's. The
+    extraction only becomes its dataset's current run, replacing the
+    previous one (see _activate_extraction), once the first page arrives. A job's progress
+    counters are updated as pages are written, and setting its cancel event stops the run at the last
+    checkpoint, leaving it resumable. last_updated keys the response cache
+    (see _run_cursors). Returns the number of records written.
+    """
+    pages = Queue(maxsize=2 * PIPELINE_QUEUE_PAGES)
+    stop = threading.Event()
+    outcome = {}
+
+    def enqueue(item):
+        while True:
+            if stop.is_set():
+                raise RuntimeError("Database writer stopped; aborting extraction")
+            try:
+                pages.put(item, timeout=0.5)
+                return
+            except Full:
+                continue
+
+    def produce():
+        try:
+            outcome['fetched'] = _run_cursors(
+                cursors, key_to_use, limit, min(workers, len(cursors)),
+                lambda results: enqueue(('page', results)),
+                on_checkpoint=lambda position, next_url, page_number, rows: enqueue(
+                    ('checkpoint', position, next_url, page_number, rows)),
+                max_records=max_records, seen_keys=seen_keys, last_updated=last_updated)
+        except Exception as e:
+            outcome['error'] = e
+        finally:
+            while True:
+                try:
+                    pages.put(None, timeout=0.5)
+                    break
+                except Full:
+                    if stop.is_set():
+                        break
+
+    producer = threading.Thread(target=produce, name='maude-fetch-producer', daemon=True)
+    producer.start()
+
+    written = committed = 0
+    cancelled = False
+    buffered = []
+    stored = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+    if job is not None:
+        job.extraction_id = extraction_id
+
+    def commit(checkpoint=None):
+        with db_writer() as conn, bulk_load_settings(conn):
+            if buffered and committed == 0:
+                log_extraction_message("Starting database save operation...")
+                _activate_extraction(conn, extraction_id)
+            # A fresh writer per commit, as other jobs may have taken event ids in between
+            writer = BulkWriter(conn, extraction_id=extraction_id)
+            for page in buffered:
+                writer.add(page)
+            writer.flush()
+            if checkpoint is not None:
+                position, next_url, page_number, rows = checkpoint
+                conn.execute('''
+                    UPDATE extraction_cursors
+                    SET next_url = ?, page_count = ?, rows_written = rows_written + ?, status = ?
+                    WHERE id = ?
+                ''', (next_url, page_number, rows, 'done' if next_url is None else 'pending',
+                      cursors[position]['id']))
+                conn.execute('''
+                    UPDATE extractions SET rows_written = rows_written + ?, updated_at = ? WHERE id = ?
+                ''', (rows, datetime.now().isoformat(timespec='seconds'), extraction_id))
+            conn.commit()
+        for name in stored:
+            stored[name] += getattr(writer, name)
+        buffered.clear()
+
+    try:
+        while True:
+            item = pages.get()
+            if item is None:
+                break
+            if job is not None and job.cancel.is_set():
+                # Drop pages received since the last checkpoint so the cursor state stays exact
+                buffered.clear()
+                written = committed
+                cancelled = True
+                log_extraction_message(f"Extraction cancelled after {written:,} records")
+                break
+            if item[0] == 'page':
+                buffered.append(item[1])
+                written += len(item[1])
+                print(f"Saved {written:,} records to database")
+            else:
+                commit(item[1:])
+                committed = written
+                if job is not None:
+                    job.records_written = written
+        if buffered:
+            commit()
+            committed = written
+        if stored['updated'] or stored['unchanged']:
+            log_extraction_message(f"Stored reports: {stored['inserted']:,} new, {stored['updated']:,} updated, "
+                                   f"{stored['unchanged']:,} unchanged")
+    finally:
+        stop.set()
+        producer.join()
+        _finish_extraction(extraction_id, max_records, failed=cancelled or 'error' in outcome)
+        with db_writer() as conn:
+            create_managed_indexes(conn)
+            conn.commit()
+
+    if 'error' in outcome and not cancelled:
+        raise outcome['error']
+    if written:
+        log_extraction_message(f"Database save completed successfully! ({written:,} records)")
+    return written
+
+def _finish_extraction(extraction_id, max_records, failed=False):
+    """Mark an extraction completed, or interrupted if cursors are left to walk."""
+    with db_writer() as conn:
+        extraction = conn.execute('SELECT * FROM extractions WHERE id = ?', (extraction_id,)).fetchone()
+        if extraction is None:
+            return
+        pending = conn.execute('''
+            SELECT COUNT(*) FROM extraction_cursors WHERE extraction_id = ? AND status != 'done'
+        ''', (extraction_id,)).fetchone()[0]
+        limit_reached = bool(max_records) and extraction['rows_written'] >= max_records
+        if extraction['rows_written'] == 0 and not failed and extraction['status'] == 'running':
+            # Nothing was written: drop the ledger entry and keep the previous dataset current
+            conn.execute('DELETE FROM extraction_cursors WHERE extraction_id = ?', (extraction_id,))
+            conn.execute('DELETE FROM extraction_reports WHERE extraction_id = ?', (extraction_id,))
+            conn.execute('DELETE FROM extractions WHERE id = ?', (extraction_id,))
+        else:
+            status = 'completed' if (pending == 0 or limit_reached) and not failed else 'interrupted'
+            conn.execute('UPDATE extractions SET status = ?, updated_at = ? WHERE id = ?',
+                         (status, datetime.now().isoformat(timespec='seconds'), extraction_id))
+            _update_dataset_stats(conn, extraction_id)
+            if status == 'interrupted':
+                log_extraction_message(f"Extraction #{extraction_id} stopped early after {extraction['rows_written']:,} records; it can be resumed later")
         conn.commit()
-        log_extraction_message("Database save completed successfully!")
 
+def stream_API_data_to_db(base_query, max_records=None, api_key=None, workers=None, job=None, dataset=None):
+    """Fetch records and write them to the database page by page.
+
+    Records the query and its cursors in the extractions tables and
+    checkpoints every page (see _stream_cursors_to_db), so a run cut off by
+    an API failure or a crash can be continued with resume_extraction().
+    The results replace those of the named dataset (DEFAULT_DATASET when
+    None). `job` is the ExtractionJob running this call, if any.
+    Returns the number of records written.
+    """
+    key_to_use = api_key or FDA_API_KEY
+    limit = 1000 if key_to_use else 500
+    workers = FETCH_WORKERS if workers is None else workers
+    cache_before = response_cache.snapshot()
+    total_count, last_updated = _probe_total_count(base_query, key_to_use)
+    if job is not None:
+        job.total_count = min(total_count, max_records) if max_records else total_count
+    cursors = _plan_cursors(base_query, total_count, key_to_use, max_records, workers)
+
+    with db_writer() as conn:
+        extraction_id = _create_extraction(conn, dataset or DEFAULT_DATASET, base_query, max_records, total_count)
+        for position, spec in enumerate(cursors):
+            spec['id'] = conn.execute('''
+                INSERT INTO extraction_cursors (extraction_id, position, query, expected_count, status)
+                VALUES (?, ?, ?, ?, 'pending')
+            ''', (extraction_id, position, spec['query'], spec['count'])).lastrowid
+        conn.commit()
+
+    written = _stream_cursors_to_db(extraction_id, cursors, key_to_use, limit, workers,
+                                    max_records=max_records, job=job, last_updated=last_updated)
+    _log_extraction_summary(written, total_count, max_records, cache_before)
+    return written
+
+def resume_extraction(api_key=None, workers=None, quiet=False, job=None):
+    """Continue the most recent interrupted extraction from its checkpoints.
+
+    Returns the number of records written by this run (0 if there was
+    nothing to resume).
+    """
+    key_to_use = api_key or FDA_API_KEY
+    workers = FETCH_WORKERS if workers is None else workers
+    with db_writer() as conn:
+        extraction = get_resumable_extraction(conn)
+        if extraction is None:
+            if not quiet:
+                log_extraction_message("No interrupted extraction to resume")
+            return 0
+        rows = conn.execute('''
+            SELECT * FROM extraction_cursors
+            WHERE extraction_id = ? AND status != 'done'
+            ORDER BY position
+        ''', (extraction['id'],)).fetchall()
+        # A refresh updates stored reports, so only full extractions skip the
+        # reports they already matched
+        seen_keys = None if extraction['mode'] == 'refresh' else {row[0] for row in conn.execute('''
+            SELECT e.mdr_report_key FROM extraction_reports r JOIN events e ON e.id = r.event_id
+            WHERE r.extraction_id = ? AND e.mdr_report_key IS NOT NULL
+        ''', (extraction['id'],))}
+        conn.execute("UPDATE extractions SET status = 'running' WHERE id = ?", (extraction['id'],))
+        conn.commit()
+
+    cursors = []
+    for row in rows:
+        spec = {'id': row['id'], 'query': row['query'], 'count': row['expected_count'],
+                'next_url': row['next_url'], 'page_count': row['page_count'], 'rows_written': row['rows_written']}
+        bounds = _parse_date_range(row['query'])
+        if len(rows) > 1 and bounds:
+            spec['lo'], spec['hi'] = bounds
+        cursors.append(spec)
+
+    log_extraction_message(f"Resuming extraction #{extraction['id']}: {extraction['rows_written']:,} records already saved, "
+                           f"{len(cursors)} cursor(s) left to walk...")
+    print(f"Resuming extraction #{extraction['id']} with {len(cursors)} cursor(s)")
+    limit = 1000 if key_to_use else 500
+    max_records = extraction['max_records']
+    remaining = max(max_records - extraction['rows_written'], 0) if max_records else None
+    if job is not None:
+        job.total_count = max(min(extraction['total_count'] or 0, max_records or float('inf')) - extraction['rows_written'], 0)
+    if not cursors or remaining == 0:
+        _finish_extraction(extraction['id'], max_records)
+        return 0
+
+    cache_before = response_cache.snapshot()
+    written = _stream_cursors_to_db(extraction['id'], cursors, key_to_use, limit, workers,
+                                    max_records=remaining, seen_keys=seen_keys, job=job)
+    _log_extraction_summary(extraction['rows_written'] + written, extraction['total_count'] or 0, max_records,
+                            cache_before)
+    return written
+
+def _with_delta_window(base_query, since, until):
+    """Restrict a search query to reports received or changed between two dates."""
+    window = f'(date_received:[{since}+TO+{until}]+OR+date_changed:[{since}+TO+{until}])'
+    prefix, _, search = base_query.partition('search=')
+    if search in ('', '*'):
+        return f'{prefix}search={window}'
+    return f'{prefix}search={search}+AND+{window}'
+
+def refresh_extraction(api_key=None, workers=None, job=None, dataset=None):
+    """Pull only reports added or changed since a stored dataset was fetched.
+
+    Re-runs the query of the dataset's current extraction over the window
+    from the newest date_received/date_changed it holds up to today, and
+    upserts the results by mdr_report_key instead of replacing the dataset;
+    the refresh's report list starts as a copy of the refreshed run's.
+    `dataset` is a dataset name (the one with the most recent results when
+    None). Returns the number of records written.
+    """
+    if resume_extraction(api_key=api_key, workers=workers, quiet=True, job=job):
+        log_extraction_message("Finished the interrupted extraction before refreshing")
+    if job is not None and job.cancel.is_set():
+        return 0
+    with get_results_connection(dataset) as conn:
+        target = get_dataset(conn, dataset)
+        latest = target and conn.execute('''
+            SELECT * FROM extractions WHERE id = ? AND base_query IS NOT NULL
+        ''', (target['extraction_id'],)).fetchone()
+        since = conn.execute('''
+            SELECT MAX(latest) FROM (
+                SELECT MAX(date_received) AS latest FROM result_events
+                UNION ALL SELECT MAX(date_changed) FROM result_events
+            )
+        ''').fetchone()[0]
+    if not latest or not since:
+        log_extraction_message("No stored dataset to refresh; run a search first")
+        return 0
+
+    until = datetime.now().strftime('%Y%m%d')
+    base_query = latest['base_query']
+    delta_query = _with_delta_window(base_query, since, until)
+    log_extraction_message(f"Refreshing stored dataset with reports received or changed since {since}...")
+    print(f"Refreshing dataset from {since} to {until}")
+
+    key_to_use = api_key or FDA_API_KEY
+    limit = 1000 if key_to_use else 500
+    workers = FETCH_WORKERS if workers is None else workers
+    cache_before = response_cache.snapshot()
+    total_count, last_updated = _probe_total_count(delta_query, key_to_use)
+    if job is not None:
+        job.total_count, job.records_written = total_count, 0
+    cursors = _plan_cursors(delta_query, total_count, key_to_use, None, workers)
+
+    with db_writer() as conn:
+        extraction_id = _create_extraction(conn, target['name'], base_query, total_count=total_count, mode='refresh')
+        conn.execute('''
+            INSERT INTO extraction_reports (extraction_id, event_id)
+            SELECT ?, event_id FROM extraction_reports WHERE extraction_id = ?
+        ''', (extraction_id, latest['id']))
+        for position, spec in enumerate(cursors):
+            spec['id'] = conn.execute('''
+                INSERT INTO extraction_cursors (extraction_id, position, query, expected_count, status)
+                VALUES (?, ?, ?, ?, 'pending')
+            ''', (extraction_id, position, spec['query'], spec['count'])).lastrowid
+        conn.commit()
+
+    written = _stream_cursors_to_db(extraction_id, cursors, key_to_use, limit, workers, job=job,
+                                    last_updated=last_updated)
+    _log_extraction_summary(written, total_count, None, cache_before)
+    return written
+
+_JSON_WHITESPACE = re.compile(r'\s*')
+
+def iter_bulk_results(stream, chunk_size=1 << 20):
+    """Yield the records of an openFDA bulk JSON file one at a time.
+
+    Walks the top-level object incrementally: small members such as `meta`
+    are decoded whole, while each element of the `results` array is decoded
+    as soon as it is complete, so memory use stays around chunk_size no
+    matter how large the file is. `stream` is a text stream.
+    """
+    decoder = json.JSONDecoder()
+    state = {'buffer': '', 'pos': 0, 'eof': False}
+
+    def fill():
+        chunk = stream.read(chunk_size)
+        state['buffer'] = state['buffer'][state['pos']:] + chunk
+        state['pos'] = 0
+        state['eof'] = not chunk
+
+    def peek():
+        # Skip whitespace and return the next character ('' at end of file)
+        while True:
+            state['pos'] = _JSON_WHITESPACE.match(state['buffer'], state['pos']).end()
+            if state['pos'] < len(state['buffer']) or state['eof']:
+                return state['buffer'][state['pos']:state['pos'] + 1]
+            fill()
+
+    def expect(char):
+        if peek() != char:
+            raise ValueError(f"Malformed bulk file: expected {char!r} at offset {state['pos']}")
+        state['pos'] += 1
+
+    def decode_value():
+        peek()
+        while True:
+            try:
+                value, state['pos'] = decoder.raw_decode(state['buffer'], state['pos'])
+                return value
+            except json.JSONDecodeError:
+                if state['eof']:
+                    raise
+                fill()
+
+    expect('{')
+    if peek() == '}':
+        return
+    while True:
+        key = decode_value()
+        expect(':')
+        if key == 'results' and peek() == '[':
+            state['pos'] += 1
+            if peek() == ']':
+                state['pos'] += 1
+            else:
+                while True:
+                    yield decode_value()
+                    separator = peek()
+                    state['pos'] += 1
+                    if separator == ']':
+                        break
+                    if separator != ',':
+                        raise ValueError(f"Malformed bulk file: unexpected {separator!r} in results")
+        else:
+            decode_value()
+        separator = peek()
+        state['pos'] += 1
+        if separator == '}':
+            return
+        if separator != ',':
+            raise ValueError(f"Malformed bulk file: unexpected {separator!r} after {key!r}")
+
+def _bulk_record_filter(product_code='', brand_name='', device_generic_name='',
+                        start_date='', end_date='', manufacturer=''):
+    """Build a predicate applying the search form filters to bulk records.
+
+    Mirrors build_search_query: comma-separated values are alternatives,
+    different fields must all match. Product codes and manufacturers match
+    as prefixes, brand names as phrases and generic names by their words
+    (so FDA's "word2, word1" naming variants match too), all case-insensitive.
+    """
+    def terms(value):
+        return [term.strip().lower() for term in value.split(',') if term.strip()]
+
+    lower_bound = start_date.replace('-', '') if start_date else '00010101'
+    upper_bound = end_date.replace('-', '') if end_date else '99991231'
+    product_codes = terms(product_code)
+    brand_names = terms(brand_name)
+    generic_names = [set(re.findall(r'\w+', name)) for name in terms(device_generic_name)]
+    manufacturers = [re.compile(r'\b' + re.escape(name)) for name in terms(manufacturer)]
+
+    def device_values(record, field):
+        return [str(device.get(field) or '').lower() for device in record.get('device', [])]
+
+    def matches(record):
+        if (start_date or end_date) and not lower_bound <= (record.get('date_received') or '') <= upper_bound:
+            return False
+        if product_codes and not any(code.startswith(prefix) for code in device_values(record, 'device_report_product_code')
+                                     for prefix in product_codes):
+            return False
+        if brand_names and not any(name in brand for brand in device_values(record, 'brand_name') for name in brand_names):
+            return False
+        if generic_names and not any(words <= set(re.findall(r'\w+', generic))
+                                     for generic in device_values(record, 'generic_name') for words in generic_names):
+            return False
+        if manufacturers and not any(pattern.search(name) for name in device_values(record, 'manufacturer_d_name')
+                                     for pattern in manufacturers):
+            return False
+        return True
+
+    return matches
+
+def _finish_bulk_extraction(conn, extraction_id, written):
+    """Mark a bulk load's extraction completed with its counts and rebuild the indexes."""
+    if extraction_id is not None:
+        conn.execute('''
+            UPDATE extractions SET total_count = ?, rows_written = ?, status = 'completed', updated_at = ?
+            WHERE id = ?
+        ''', (written, written, datetime.now().isoformat(timespec='seconds'), extraction_id))
+        _update_dataset_stats(conn, extraction_id)
+    create_managed_indexes(conn)
+    conn.commit()
+
+def ingest_bulk_files(directory, max_records=None, job=None, dataset=None, **filters):
+    """Load openFDA device-event bulk zips from a local directory into the database.
+
+    Reads every `*.json.zip` in `directory` (the openFDA
+    `device-event-NNNN-of-NNNN.json.zip` downloads), stream-parsing each
+    member with iter_bulk_results, and keeps the records matching `filters`
+    (the build_search_query fields). Records go through the same tables as
+    save_comprehensive_data, replacing the named dataset (DEFAULT_DATASET
+    when None) once the first match is found, and are de-duplicated on
+    mdr_report_key across files. The load is recorded as a 'bulk'
+    extraction of the equivalent API query, so refresh_extraction() can top
+    it up from the API later.
+    Returns the number of records written.
+    """
+    paths = sorted(glob.glob(os.path.join(directory, '*.json.zip')))
+    if not paths:
+        log_extraction_message(f"No openFDA bulk files (*.json.zip) found in {directory}")
+        return 0
+    matches = _bulk_record_filter(**filters)
+    log_extraction_message(f"Ingesting {len(paths)} openFDA bulk file(s) from {directory}...")
+
+    seen_keys = set()
+    written = scanned = 0
+    batch = []
+    extraction_id = None
+
+    def flush():
+        # The shared writer is only held per batch, so jobs on other datasets write in between
+        nonlocal written, extraction_id
+        if not batch:
+            return
+        with db_writer() as conn, bulk_load_settings(conn):
+            if written == 0:
+                log_extraction_message("Starting database save operation...")
+                extraction_id = _create_extraction(conn, dataset or DEFAULT_DATASET, build_search_query(**filters),
+                                                   max_records, mode='bulk')
+                _activate_extraction(conn, extraction_id)
+            writer = BulkWriter(conn, extraction_id=extraction_id)
+            writer.add(batch)
+            writer.flush()
+            conn.commit()
+        written += len(batch)
+        batch.clear()
+        if job is not None:
+            job.records_written = written
+
+    def finish():
+        with db_writer() as conn:
+            _finish_bulk_extraction(conn, extraction_id, written)
+
+    for path in paths:
+        file_written = written + len(batch)
+        with zipfile.ZipFile(path) as archive:
+            for member in archive.namelist():
+                if not member.endswith('.json'):
+                    continue
+                with archive.open(member) as raw:
+                    for record in iter_bulk_results(io.TextIOWrapper(raw, encoding='utf-8')):
+                        scanned += 1
+                        if not matches(record):
+                            continue
+                        report_key = record.get('mdr_report_key')
+                        if report_key:
+                            if report_key in seen_keys:
+                                continue
+                            seen_keys.add(report_key)
+                        batch.append(record)
+                        if len(batch) >= WRITE_BATCH_SIZE:
+                            flush()
+                            if job is not None and job.cancel.is_set():
+                                log_extraction_message(f"Bulk ingestion cancelled after {written:,} records")
+                                finish()
+                                return written
+                        if max_records and written + len(batch) >= max_records:
+                            break
+                if max_records and written + len(batch) >= max_records:
+                    break
+        log_extraction_message(f"{os.path.basename(path)}: kept {written + len(batch) - file_written:,} records "
+                               f"({scanned:,} scanned so far)")
+        if max_records and written + len(batch) >= max_records:
+            log_extraction_message(f"Reached max_records limit ({max_records:,})")
+            break
+    flush()
+    finish()
+    log_extraction_message(f"Bulk ingestion completed. Saved {written:,} of {scanned:,} records scanned")
+    return written
+
+class ExtractionJob:
+    """An extraction, resume or refresh submitted to the background job pool.
+
+    Progress counters are updated by the streaming pipeline as pages are
+    written; setting `cancel` stops the run after the current page, leaving
+    the extraction resumable.
+    """
+
+    def __init__(self, kind, params):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = params
+        self.state = 'queued'
+        self.cancel = threading.Event()
+        self.extraction_id = None
+        self.total_count = None
+        self.records_written = 0
+        self.error = None
+        self.created_at = datetime.now().isoformat(timespec='seconds')
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.state in ('completed', 'failed', 'cancelled')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'dataset': self.params.get('dataset'),
+            'state': self.state,
+            'cancel_requested': self.cancel.is_set(),
+            'extraction_id': self.extraction_id,
+            'total_count': self.total_count,
+            'records_written': self.records_written,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+_job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='maude-job')
+# Jobs on the same dataset take turns; queued jobs wait on their datasets'
+# locks without holding up the HTTP request. Jobs on different datasets run
+# together, sharing the database writer batch by batch.
+_dataset_locks = {}
+_dataset_locks_lock = threading.Lock()
+
+def _dataset_lock(name):
+    """Return the lock held by jobs writing, and requests dropping, the named dataset."""
+    with _dataset_locks_lock:
+        return _dataset_locks.setdefault(name or DEFAULT_DATASET, threading.Lock())
+
+def _job_datasets(job):
+    """Names of the datasets a job will write, in locking order.
+
+    Resumes (and the resume a refresh starts with) write the dataset of the
+    interrupted extraction; refreshes without a dataset write the one with
+    the most recent results.
+    """
+    names = set()
+    if job.kind in ('extract', 'ingest'):
+        names.add(job.params.get('dataset') or DEFAULT_DATASET)
+    else:
+        with db_reader() as conn:
+            resumable = get_resumable_extraction(conn)
+            if resumable is not None:
+                row = conn.execute('SELECT name FROM datasets WHERE id = ?', (resumable['dataset_id'],)).fetchone()
+                names.add(row['name'] if row else DEFAULT_DATASET)
+            if job.kind == 'refresh':
+                target = get_dataset(conn, job.params.get('dataset'))
+                names.add(target['name'] if target else job.params.get('dataset') or DEFAULT_DATASET)
+    return sorted(names) or [DEFAULT_DATASET]
+
+def submit_job(kind, **params):
+    """Queue an 'extract', 'resume', 'refresh' or 'ingest' job and return it immediately."""
+    if kind not in ('extract', 'resume', 'refresh', 'ingest'):
+        raise ValueError(f"Unknown job kind {kind!r}")
+    job = ExtractionJob(kind, params)
+    with _jobs_lock:
+        _jobs[job.id] = job
+        # Forget the oldest finished jobs beyond MAX_FINISHED_JOBS
+        finished = [old for old in _jobs.values() if old.finished]
+        for old in finished[:max(len(finished) - MAX_FINISHED_JOBS, 0)]:
+            del _jobs[old.id]
+    _job_executor.submit(_run_job, job)
+    return job
+
+def get_job(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+def list_jobs():
+    with _jobs_lock:
+        return sorted(_jobs.values(), key=lambda job: job.created_at, reverse=True)
+
+def _run_job(job):
+    with ExitStack() as locks:
+        for name in _job_datasets(job):
+            locks.enter_context(_dataset_lock(name))
+        if job.cancel.is_set():
+            job.state = 'cancelled'
+            job.finished_at = datetime.now().isoformat(timespec='seconds')
+            return
+        job.state = 'running'
+        job.started_at = datetime.now().isoformat(timespec='seconds')
+        try:
+            if job.kind == 'extract':
+                written = stream_API_data_to_db(job.params['base_query'], job.params.get('max_records'),
+                                                api_key=job.params.get('api_key'), job=job,
+                                                dataset=job.params.get('dataset'))
+            elif job.kind == 'resume':
+                written = resume_extraction(api_key=job.params.get('api_key'), job=job)
+            elif job.kind == 'ingest':
+                written = ingest_bulk_files(job=job, **job.params)
+            else:
+                written = refresh_extraction(api_key=job.params.get('api_key'), job=job,
+                                             dataset=job.params.get('dataset'))
+            job.records_written = written
+            if job.cancel.is_set():
+                job.state = 'cancelled'
+            elif job.kind in ('extract', 'ingest') and not written:
+                job.state = 'failed'
+                job.error = (f"No results retrieved from FDA API. Found {job.total_count or 0:,} records in the "
+                             "database but failed to download them. Check your terminal console for detailed error logs.")
+            else:
+                job.state = 'completed'
+        except Exception as e:
+            print(f"Exception in {job.kind} job {job.id}: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            job.state = 'failed'
+            job.error = str(e)
+        finally:
+            job.finished_at = datetime.now().isoformat(timespec='seconds')
+
+# Excel-safe text in one str.translate pass: control characters
+# (0x00-0x1F, 0x7F-0x9F, tab and newlines included) and invalid XML characters
+# are dropped, smart quotes and dashes become ASCII and the ellipsis three dots
+SANITIZE_TABLE = str.maketrans({
+    **{code: None for code in [*range(0x00, 0x20), *range(0x7f, 0xa0)]},
+    '\u201c': '"', '\u201d': '"', '\u2018': "'", '\u2019': "'",
+    '\u2013': '-', '\u2014': '-',  # en-dash, em-dash
+    '\u2026': '...',  # ellipsis
+})
+# Longer text is cut here and ends in '...' (Excel's cell limit is 32,767 characters)
+SANITIZE_MAX_LENGTH = 32000
+
+def sanitize_text(text):
+    if not isinstance(text, str):
+        return text
+    text = text.translate(SANITIZE_TABLE)
+    # Limit string length to prevent Excel issues (Excel has cell size limits)
+    if len(text) > SANITIZE_MAX_LENGTH:
+        text = text[:SANITIZE_MAX_LENGTH] + "..."
+    return text
+
+def sanitize_series(series):
+    """sanitize_text applied to a whole column; values that are not text are left as they are."""
+    import pandas as pd
+    import numpy as np
+    if series.dtype != object or series.empty:
+        return series
+    values = series.to_numpy(copy=True)
+    is_text = np.fromiter((isinstance(value, str) for value in values), dtype=bool, count=len(values))
+    if not is_text.any():
+        return series
+    texts = pd.Series(values[is_text], dtype=object).str.translate(SANITIZE_TABLE)
+    too_long = (texts.str.len() > SANITIZE_MAX_LENGTH).to_numpy()
+    if too_long.any():
+        texts[too_long] = texts[too_long].str.slice(stop=SANITIZE_MAX_LENGTH) + '...'
+    values[is_text] = texts.to_numpy()
+    return pd.Series(values, index=series.index, name=series.name)
+
+def sanitize_df(df):
+    for col in df.columns:
+        if df[col].dtype == object:
+            df[col] = sanitize_series(df[col])
+    return df
+
+
+
+# Column-level value transforms for the Excel export. Columns hold few
+# distinct values (dates, one-letter codes), so a ValueTransform converts
+# each distinct text value once, in a vectorized batch, and remembers it for
+# the rest of the export.
+
+class ValueTransform:
+    """Apply a batch conversion of distinct text values to columns, memoizing the results.
+
+    `convert` takes an object array of distinct strings not seen before and
+    returns their converted values in the same order. Cells that are not
+    text are left as they are.
+    """
+
+    def __init__(self, convert):
+        self.convert = convert
+        self.cache = {}
+
+    def __call__(self, series):
+        import pandas as pd
+        import numpy as np
+        if series.dtype != object or series.empty:
+            return series
+        values = series.to_numpy(copy=True)
+        is_text = np.fromiter((isinstance(value, str) for value in values), dtype=bool, count=len(values))
+        if not is_text.any():
+            return series
+        codes, uniques = pd.factorize(values[is_text])
+        new = [value for value in uniques if value not in self.cache]
+        if new:
+            self.cache.update(zip(new, self.convert(np.array(new, dtype=object))))
+        values[is_text] = np.array([self.cache[value] for value in uniques], dtype=object)[codes]
+        return pd.Series(values, index=series.index, name=series.name)
+
+# Flattened columns holding YYYYMMDD dates (a base name, or one with a _N suffix)
+EXPORT_DATE_FIELDS = [
+    'date_of_event', 'date_report', 'date_received', 'date_manufacturer_received',
+    'device_date_received', 'device_expiration_date_of_device', 'patient_date_received',
+    'device_date_of_manufacturer', 'device.date_received', 'device.expiration_date_of_device',
+    'device.date_returned_to_manufacturer', 'device.date_removed_flag', 'mdr_text.date_report',
+    'date_facility_aware', 'report_date', 'date_report_to_fda', 'date_report_to_manufacturer'
+]
+
+def is_export_date_column(column):
+    return any(column == base or column.startswith(base + '_') for base in EXPORT_DATE_FIELDS)
+
+def format_export_dates(values):
+    """Reformat YYYYMMDD strings as MM/DD/YYYY; anything else, invalid dates included, is kept."""
+    import pandas as pd
+    texts = pd.Series(values, dtype=object)
+    dated = texts.str.match(r'^\d{8}$')
+    result = texts.copy()
+    if not dated.any():
+        return result.to_numpy()
+    parsed = pd.to_datetime(texts[dated], format='%Y%m%d', errors='coerce')
+    result[parsed.index] = parsed.dt.strftime('%m/%d/%Y')
+    for index in parsed.index[parsed.isna()]:
+        # Outside pandas' timestamp range, or not a date at all
+        try:
+            result[index] = datetime.strptime(texts[index], '%Y%m%d').strftime('%m/%d/%Y')
+        except ValueError:
+            result[index] = texts[index]
+    return result.to_numpy()
+
+# FDA codes translated to human-readable text for user-friendly display
+
+# Patient Outcome Codes (based on actual data analysis)
+OUTCOME_CODES = {
+    'R': 'Required Intervention',
+    'O': 'Other',
+    'H': 'Hospitalization',
+    'D': 'Death',
+    'L': 'Life Threatening',
+    'I': 'Injury',
+    'M': 'Malfunction',
+    'N': 'No Information',
+    'U': 'Unknown',
+    'S': 'Disability'
+}
+
+# Device Evaluated by Manufacturer Codes (based on actual data)
+DEVICE_EVALUATED_CODES = {
+    'R': 'Returned to Manufacturer',
+    'Y': 'Yes',
+    'N': 'No',
+    'I': 'Invalid/Incomplete',
+    '*': 'Not Available'
+}
+
+# Reporter Occupation Codes (based on actual data)
+OCCUPATION_CODES = {
+    '501': 'Administrator/Supervisor',
+    '003': 'Non-Healthcare Professional',
+    '117': 'Nurse Practitioner',
+    '2': 'Nurse',
+    'PHYSICIAN': 'Physician',
+    'NURSE': 'Nurse',
+    'OTHER': 'Other',
+    'OTHER HEALTH CARE PROFESSIONAL': 'Other Health Care Professional',
+    'RISK MANAGER': 'Risk Manager',
+    'PATIENT': 'Patient',
+    'ATTORNEY': 'Attorney',
+    'PATIENT FAMILY MEMBER OR FRIEND': 'Patient Family Member or Friend',
+    'UNKNOWN': 'Unknown'
+}
+
+# Previous Use Codes (based on actual data)
+PREVIOUS_USE_CODES = {
+    'I': 'Invalid/Incomplete',
+    'N': 'No',
+    'U': 'Unknown',
+    '*': 'Not Available'
+}
+
+# Report to FDA Codes (based on actual data)
+REPORT_TO_FDA_CODES = {
+    'Y': 'Yes',
+    'N': 'No',
+    'I': 'Invalid/Incomplete',
+    '*': 'Not Available'
+}
+
+# Health Professional Codes (based on actual data)
+HEALTH_PROF_CODES = {
+    'Y': 'Yes',
+    'N': 'No',
+    'I': 'Invalid/Incomplete',
+    '*': 'Not Available'
+}
+
+# Single Use Flag (based on actual data)
+SINGLE_USE_CODES = {
+    'Y': 'Yes',
+    'N': 'No',
+    'I': 'Invalid/Incomplete',
+    '*': 'Not Available'
+}
+
+# Reprocessed Flag (based on actual data)
+REPROCESSED_CODES = {
+    'N': 'No',
+    'I': 'Invalid/Incomplete'
+}
+
+# Adverse Event Flag (based on actual data)
+ADVERSE_EVENT_CODES = {
+    'Y': 'Yes',
+    'N': 'No'
+}
+
+# Product Problem Flag (based on actual data)
+PRODUCT_PROBLEM_CODES = {
+    'Y': 'Yes',
+    'N': 'No',
+    '*': 'Not Available'
+}
+
+# Device Operator Codes (based on actual data)
+DEVICE_OPERATOR_CODES = {
+    'I': 'No Information',
+    '0': 'Other',
+    'HEALTH PROFESSIONAL': 'Health Professional',
+    'LAY USER/PATIENT': 'Lay User/Patient',
+    'INVALID DATA': 'Invalid Data',
+    'PHYSICIAN': 'Physician',
+    'OTHER': 'Other'
+}
+
+# Event Location Codes (based on actual data)
+EVENT_LOCATION_CODES = {
+    'Y': 'Yes',
+    'N': 'No',
+    'I': 'Invalid/Incomplete',
+    '*': 'Not Available'
+}
+
+# Manufacturer Link Flag Codes (based on actual data)
+MANUFACTURER_LINK_FLAG_CODES = {
+    'Y': 'Yes',
+    'N': 'No',
+    'I': 'Invalid/Incomplete',
+    '*': 'Not Available'
+}
+
+# Which codes a humanized Events column holds: the first rule whose name is
+# part of the column name applies
+FDA_CODE_COLUMNS = [
+    ('Device Evaluated By Manufacturer', DEVICE_EVALUATED_CODES),
+    ('Reporter Occupation Code', OCCUPATION_CODES),
+    ('Previous Use Code', PREVIOUS_USE_CODES),
+    ('Report To FDA', REPORT_TO_FDA_CODES),
+    ('Health Professional', HEALTH_PROF_CODES),
+    ('Single Use Flag', SINGLE_USE_CODES),
+    ('Reprocessed And Reused Flag', REPROCESSED_CODES),
+    ('Adverse Event Flag', ADVERSE_EVENT_CODES),
+    ('Product Problem Flag', PRODUCT_PROBLEM_CODES),
+    ('Device Operator', DEVICE_OPERATOR_CODES),
+    ('Event Location', EVENT_LOCATION_CODES),
+    ('Manufacturer Link Flag', MANUFACTURER_LINK_FLAG_CODES),
+]
+
+def fda_code_mapping(column):
+    """The FDA code mapping for a humanized Events column, or None.
+
+    Patient Outcome columns (OUTCOME_CODES) hold ';'-separated codes.
+    """
+    if 'Patient Outcome' in column:
+        return OUTCOME_CODES
+    for name, mapping in FDA_CODE_COLUMNS:
+        if name in column:
+            return mapping
+    return None
+
+def translate_outcome_codes(values):
+    """Translate every code of ';'-separated Patient Outcome values, joining them with '; '."""
+    import pandas as pd
+    texts = pd.Series(values, dtype=object)
+    codes = texts.str.split(';').explode().str.strip()
+    # One lookup per distinct code
+    translated = codes.astype('category').map(lambda code: OUTCOME_CODES.get(code, code)).astype(object)
+    return translated.groupby(level=0).agg('; '.join).reindex(texts.index).to_numpy()
+
+def fda_code_transform(mapping):
+    """A ValueTransform translating codes through `mapping` (OUTCOME_CODES splits values first)."""
+    if mapping is OUTCOME_CODES:
+        return ValueTransform(translate_outcome_codes)
+    return ValueTransform(lambda values: [mapping.get(value, value) for value in values])
+
+# Fields flattened by extract_event_fields for the Events sheets, the summary
+# export and /analytics, and stored that way in events_flat at ingest
+FLAT_EVENT_FIELDS = [
+    'adverse_event_flag', 'product_problems', 'product_problem_flag', 'date_of_event', 'date_report', 'date_received',
+    'device_date_of_manufacturer', 'event_type', 'number_devices_in_event', 'number_patients_in_event', 'previous_use_code',
+    'remedial_action', 'removal_correction_number', 'report_number', 'single_use_flag', 'report_source_code',
+    'health_professional', 'reporter_occupation_code', 'initial_report_to_fda', 'reprocessed_and_reused_flag',
+    'device.device_event_key', 'device.date_received', 'device.brand_name',
+    'device.generic_name', 'device.device_report_product_code',
+    'device.model_number', 'device.catalog_number', 'device.lot_number', 'device.other_id_number',
+    'device.expiration_date_of_device', 'device.device_availability',
+    'device.device_evaluated_by_manufacturer', 'device.device_operator',
+    'device.implant_flag', 'device.date_removed_flag', 'device.manufacturer_d_name',
+    'device.manufacturer_d_country', 'device.device_class', 'device.device_name', 'device.fei_number',
+    'device.medical_specialty_description', 'device.registration_number',
+    'patient.date_received', 'patient.patient_age',
+    'patient.patient_sex', 'patient.patient_weight', 'patient.patient_ethnicity', 'patient.patient_race',
+    'patient.patient_problems', 'patient.sequence_number_outcome', 'patient.sequence_number_treatment',
+    'mdr_text.date_report', 'mdr_text.mdr_text_key', 'mdr_text.patient_sequence_number', 'mdr_text.text',
+    'mdr_text.text_type_code', 'type_of_report', 'date_facility_aware', 'report_date', 'report_to_fda',
+    'date_report_to_fda', 'report_to_manufacturer', 'date_report_to_manufacturer', 'event_location',
+    'manufacturer_name', 'manufacturer_address_1', 'manufacturer_address_2',
+    'manufacturer_city', 'manufacturer_country', 'manufacturer_gl_name',
+    'manufacturer_gl_country', 'date_manufacturer_received',
+    'source_type', 'event_key', 'mdr_report_key', 'device name', 'fei_number',
+    'medical_specialty_description', 'registration_number', 'regulation_number'
+]
+
+# Fields _iter_event_fields flattens at the top level, and as device_<name> /
+# patient_<name> per device and patient
+FLAT_TOP_FIELDS = {field for field in FLAT_EVENT_FIELDS
+                   if '.' not in field and not field.startswith(('device', 'patient', 'mdr_text'))}
+FLAT_ITEM_FIELDS = {field.replace('.', '_', 1) for field in FLAT_EVENT_FIELDS
+                    if field.startswith(('device.', 'patient.'))}
+
+# Layout of the Excel export's Events sheet. Its columns are grouped by
+# EVENTS_SHEET_FIELDS (flattened names), headed by EXPORT_COLUMN_NAMES and
+# the headers in EVENTS_SHEET_ORDER, with their numbered slots, come first.
+EVENTS_SHEET_FIELDS = [
+    'event_id', 'report_number', 'mdr_report_key', 'maude_report_link',
+    'date_of_event', 'date_report', 'date_received', 'date_manufacturer_received',
+    'device_date_received', 'device_expiration_date_of_device', 'patient_date_received',
+    'device_generic_name', 'device_brand_name', 'device_manufacturer_d_name',
+    'device_device_report_product_code', 'device_model_number', 'device_lot_number',
+    'device_device_availability', 'device_device_evaluated_by_manufacturer', 'device_manufacturer_d_country',
+    'single_use_flag', 'reprocessed_and_reused_flag', 'device_device_operator', 'report_source_code',
+    'health_professional', 'reporter_occupation_code', 'source_type',
+    'patient_patient_age', 'patient_patient_sex', 'patient_patient_weight', 'patient_patient_ethnicity', 'patient_patient_race',
+    'event_type', 'adverse_event_flag', 'patient_patient_problems', 'patient_sequence_number_outcome', 'patient_sequence_number_treatment',
+    'product_problem_flag', 'product_problems'
+]
+EVENTS_SHEET_FIELD_RANK = {field: k for k, field in reversed(list(enumerate(EVENTS_SHEET_FIELDS)))}
+EXPORT_COLUMN_NAMES = {
+    'event_id': 'Event ID',
+    'report_number': 'Report Number',
+    'mdr_report_key': 'MDR Report Key',
+    'maude_report_link': 'MAUDE Report Link',
+    'date_of_event': 'Event Date',
+    'date_report': 'Report Date',
+    'date_received': 'Date Received',
+    'date_manufacturer_received': 'Date Manufacturer Received',
+    'device_date_received': 'Device Date Received',
+    'device_expiration_date_of_device': 'Device Expiration Date',
+    'patient_date_received': 'Patient Date Received',
+    'device_generic_name': 'Product Class',
+    'device_brand_name': 'Brand Name',
+    'device_manufacturer_d_name': 'Manufacturer',
+    'device_device_report_product_code': 'Product Code',
+    'device_model_number': 'Model Number',
+    'device_catalog_number': 'Catalog Number',
+    'device_lot_number': 'Lot Number',
+    'device_device_availability': 'Device Availability',
+    'device_device_evaluated_by_manufacturer': 'Device Evaluated By Manufacturer',
+    'device_manufacturer_d_country': 'Manufacturer Country',
+    'single_use_flag': 'Single Use Flag',
+    'reprocessed_and_reused_flag': 'Reprocessed And Reused Flag',
+    'device_device_operator': 'Device Operator',
+    'report_source_code': 'Report Source Code',
+    'health_professional': 'Health Professional',
+    'reporter_occupation_code': 'Reporter Occupation Code',
+    'source_type': 'Source Type',
+    'patient_patient_age': 'Patient Age',
+    'patient_patient_sex': 'Patient Sex',
+    'patient_patient_weight': 'Patient Weight',
+    'patient_patient_ethnicity': 'Patient Ethnicity',
+    'patient_patient_race': 'Patient Race',
+    'event_type': 'Event Type',
+    'adverse_event_flag': 'Adverse Event Flag',
+    'patient_patient_problems': 'Patient Problem',
+    'patient_sequence_number_outcome': 'Patient Outcome',
+    'patient_sequence_number_treatment': 'Patient Treatment',
+    'product_problem_flag': 'Product Problem Flag',
+    'product_problems': 'Device Problem',
+    'date_report_to_fda': 'Date Report To FDA',
+    'date_report_to_manufacturer': 'Date Report To Manufacturer',
+    # MDR Text specific mappings
+    'Description_of_Event_or_Problem': 'Description of Event or Problem',
+    'Additional_Manufacturer_Narrative': 'Additional Manufacturer Narrative'
+}
+EVENTS_SHEET_ORDER = [
+    'Event ID', 'Report Number', 'MDR Report Key', 'MAUDE Report Link', 'Event Date', 'Report Date', 'Date Received',
+    'Date Report To FDA', 'Date Report To Manufacturer', 'Date Manufacturer Received', 'Device Date Received', 'Device Expiration Date', 'Patient Date Received',
+    'Product Class', 'Brand Name', 'Product Code', 'Model Number', 'Manufacturer', 'Manufacturer Country', 'Lot Number', 'Catalog Number', 'Device Availability', 'Device Evaluated By Manufacturer', 'Single Use Flag', 'Reprocessed And Reused Flag', 'Device Operator', 'Report Source Code', 'Health Professional', 'Reporter Occupation Code', 'Source Type', 'Patient Age', 'Patient Sex', 'Patient Weight', 'Patient Ethnicity', 'Patient Race', 'Event Type',
+    'Adverse Event Flag', 'Product Problem Flag', 'Device Problem', 'Patient Problem', 'Patient Outcome', 'Patient Treatment'
+]
+EVENTS_SHEET_RANK = {name: k for k, name in enumerate(EVENTS_SHEET_ORDER)}
+# Events columns kept even when they are blank
+EVENTS_ESSENTIAL_COLUMNS = ('event_id', 'id', 'report_number')
+
+def _flat_position(section, item=0, field=0, element=0):
+    # Sort key of a flattened column: section (top-level fields, devices,
+    # patients, the MAUDE link), device/patient number, place in the field
+    # list, array element
+    return ((section * 10000 + item) * 1000 + field) * 10000 + element
+
+FLAT_ERROR_POSITION = _flat_position(5)
+
+def _iter_event_fields(event, field_list):
+    """Yield extract_event_fields' (column, position, value) triples in column order.
+
+    position orders a column among every event's columns the same way the
+    columns of any one event are ordered.
+    """
+    # First, handle top-level fields and arrays
+    for f, field in enumerate(field_list):
+        if '.' not in field and not field.startswith('device') and not field.startswith('patient') and not field.startswith('mdr_text'):
+            value = event.get(field, '')
+            if isinstance(value, list):
+                yield field, _flat_position(1, 0, f), ''
+                for i, v in enumerate(value):
+                    yield f'{field}_{i+1}', _flat_position(1, 0, f, i + 1), v
+            else:
+                yield field, _flat_position(1, 0, f), value
+    # Then device and patient fields, numbered per device/patient
+    devices = event.get('device', [])
+    for section, name, items in ((2, 'device', devices), (3, 'patient', event.get('patient', []))):
+        for i, item in enumerate(items):
+            for f, field in enumerate(field_list):
+                if field.startswith(name + '.'):
+                    subfield = field.split('.', 1)[1]
+                    value = item.get(subfield, '')
+                    if isinstance(value, list):
+                        yield f'{name}_{subfield}_{i+1}', _flat_position(section, i + 1, f), ''
+                        for j, v in enumerate(value):
+                            yield f'{name}_{subfield}_{i+1}_{j+1}', _flat_position(section, i + 1, f, j + 1), v
+                    else:
+                        yield f'{name}_{subfield}_{i+1}', _flat_position(section, i + 1, f), value
+    # mdr_text fields are not flattened (narratives have their own sheet)
+    # MAUDE report link, with the first device's product code
+    pc = ''
+    if devices and isinstance(devices, list):
+        pc = devices[0].get('device_report_product_code', '')
+    yield 'maude_report_link', _flat_position(4), maude_report_link(event.get('mdr_report_key', ''), pc)
+
+def maude_report_link(mdr_report_key, product_code=''):
+    """URL of a report's page on the FDA MAUDE site ('' without a report key)."""
+    if not mdr_report_key:
+        return ''
+    if product_code:
+        return f"https://www.accessdata.fda.gov/scripts/cdrh/cfdocs/cfmaude/detail.cfm?mdrfoi__id={mdr_report_key}&pc={product_code}"
+    return f"https://www.accessdata.fda.gov/scripts/cdrh/cfdocs/cfmaude/detail.cfm?mdrfoi__id={mdr_report_key}"
+
+def extract_event_fields(event, field_list, event_id=None):
+    """
+    Extracts the specified fields from the event JSON, handling arrays and nested fields.
+    For array fields, splits into _1, _2, ... columns, placed after the main field.
+    For nested fields (device.*, patient.*, mdr_text.*), pivots as needed.
+    """
+    result = {}
+    if event_id is not None:
+        result['event_id'] = event_id
+    for column, _, value in _iter_event_fields(event, field_list):
+        result[column] = value
+    return result
+
+# Materialized projection of the flattened events: events_flat holds one row
+# per event and one column per flattened key, added the first time a key is
+# stored and registered with its position in events_flat_columns, and the
+# MULTI_VALUE_TABLES hold the multi-valued fields long-form. Every events_flat
+# row is stamped with FLAT_SCHEMA_VERSION; bump it whenever the flattening
+# changes so init_db drops the projection and rebuilds it from raw_json.
+FLAT_SCHEMA_VERSION = 2
+# SQLite allows 2000 columns per table; keys beyond this many go to the
+# row's flat_overflow JSON instead
+FLAT_MAX_COLUMNS = 1500
+
+def _quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def _create_flat_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS events_flat (
+            event_id INTEGER PRIMARY KEY,
+            flat_version INTEGER,
+            flat_overflow TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS events_flat_columns (
+            name TEXT PRIMARY KEY,
+            position INTEGER
+        ) WITHOUT ROWID
+    ''')
+
+def _reset_flat_events(conn):
+    """Drop the projection (with every column events_flat grew) and start an empty one."""
+    conn.execute('DROP TABLE IF EXISTS events_flat')
+    conn.execute('DROP TABLE IF EXISTS events_flat_columns')
+    for table in MULTI_VALUE_TABLES:
+        conn.execute(f'DELETE FROM {table}')
+    _create_flat_tables(conn)
+
+def _ensure_flat_events(conn):
+    """Create the projection, discarding one stamped with another schema version."""
+    _create_flat_tables(conn)
+    if conn.execute('SELECT 1 FROM events_flat WHERE flat_version IS NOT ? LIMIT 1', (FLAT_SCHEMA_VERSION,)).fetchone():
+        log_extraction_message("Flattened events are from an older version; rebuilding them...")
+        _reset_flat_events(conn)
+
+def _flat_event_row(event):
+    """The (column, position, value) triples stored for one event."""
+    try:
+        return list(_iter_event_fields(event, FLAT_EVENT_FIELDS))
+    except Exception as e:
+        return [('error', FLAT_ERROR_POSITION, str(e))]
+
+def _multi_value_rows(event_id, event):
+    """Yield (table, row) for every value of the event's multi-valued fields.
+
+    Positions count from 1, as in the flattened _1.._N columns; a field
+    holding a single value instead of a list is stored as its only value.
+    """
+    def values(value):
+        if value is None:
+            return []
+        return [_encode_json(v) if isinstance(v, (dict, list)) else v
+                for v in (value if isinstance(value, list) else [value])]
+    for table, field in MULTI_VALUE_TABLES.items():
+        if field.startswith('patient.'):
+            subfield = field.split('.', 1)[1]
+            for p, patient in enumerate(event.get('patient') or [], 1):
+                for i, value in enumerate(values(patient.get(subfield)), 1):
+                    yield table, (event_id, p, i, value)
+        else:
+            for i, value in enumerate(values(event.get(field)), 1):
+                yield table, (event_id, i, value)
+
+def _multi_value_insert_sql(table):
+    columns = 'event_id, patient_position, position, value' if MULTI_VALUE_TABLES[table].startswith('patient.') \
+        else 'event_id, position, value'
+    return f"INSERT OR REPLACE INTO {table} ({columns}) VALUES ({', '.join('?' * len(columns.split(', ')))})"
+
+def write_flat_events(conn, rows):
+    """Upsert flattened events, given as (event_id, triples from _flat_event_row).
+
+    Events with the same set of columns are written with one executemany.
+    """
+    known = dict(conn.execute('SELECT name, position FROM events_flat_columns').fetchall())
+    shapes = {}
+    for event_id, fields in rows:
+        values, overflow = {}, {}
+        for column, position, value in fields:
+            if value is not None and not isinstance(value, (str, int, float)):
+                value = _encode_json(value)
+            if column not in known and len(known) < FLAT_MAX_COLUMNS:
+                conn.execute(f'ALTER TABLE events_flat ADD COLUMN {_quote_identifier(column)}')
+                conn.execute('INSERT INTO events_flat_columns (name, position) VALUES (?, ?)', (column, position))
+                known[column] = position
+            if column in known:
+                values[column] = value
+            elif column in overflow:
+                overflow[column][1] = value
+            else:
+                overflow[column] = [position, value]
+        shape = tuple(values)
+        shapes.setdefault(shape, []).append(
+            (event_id, FLAT_SCHEMA_VERSION, _encode_json(overflow) if overflow else None, *values.values()))
+    for shape, params in shapes.items():
+        columns = ''.join(', ' + _quote_identifier(column) for column in shape)
+        conn.executemany(f'INSERT OR REPLACE INTO events_flat (event_id, flat_version, flat_overflow{columns}) '
+                         f'VALUES ({", ".join("?" * (3 + len(shape)))})', params)
+
+def _flatten_payloads(payloads):
+    """Decode and flatten (id, raw_json) rows.
+
+    Returns the (event_id, triples) rows write_flat_events takes and the
+    multi-valued fields' rows per MULTI_VALUE_TABLES table.
+    """
+    rows, values = [], {table: [] for table in MULTI_VALUE_TABLES}
+    for event_id, raw_json in payloads:
+        try:
+            event = load_payload(raw_json)
+        except Exception as e:
+            rows.append((event_id, [('error', FLAT_ERROR_POSITION, str(e))]))
+            continue
+        rows.append((event_id, _flat_event_row(event)))
+        try:
+            multi = list(_multi_value_rows(event_id, event))
+        except Exception:
+            multi = []  # Malformed patients; nothing countable
+        for table, row in multi:
+            values[table].append(row)
+    return rows, values
+
+def _flatten_event_range(path, low, high):
+    # Process pool worker: _flatten_payloads for the stored events with ids
+    # low..high, read on a connection of its own
+    conn = sqlite3.connect(f'file:{quote(os.path.abspath(path))}?mode=ro', uri=True, timeout=DB_BUSY_TIMEOUT)
+    try:
+        return _flatten_payloads(conn.execute(
+            'SELECT id, raw_json FROM events WHERE id BETWEEN ? AND ? AND raw_json IS NOT NULL ORDER BY id',
+            (low, high)))
+    finally:
+        conn.close()
+
+def _only_batch(batch, future):
+    # A worker flattens every event in its id range; keep the batch's own
+    wanted = set(batch)
+    rows, values = future.result()
+    return ([row for row in rows if row[0] in wanted],
+            {table: [row for row in table_rows if row[0] in wanted] for table, table_rows in values.items()})
+
+def _iter_flattened_batches(conn, batches, workers):
+    """Yield _flatten_payloads' output for each batch of event ids, in order.
+
+    With more than one batch and worker, the batches are flattened in a
+    process pool whose workers read their id range from the database file
+    themselves; at most two batches per worker are pending at a time.
+    Workers only see committed events, so callers flatten events committed
+    before the rebuild; the database is in WAL (see ConnectionPool), so
+    this connection's writes meanwhile do not block their reads.
+    """
+    path = conn.execute('PRAGMA database_list').fetchone()[2]
+    if workers <= 1 or len(batches) <= 1 or not path:
+        for batch in batches:
+            placeholders = ','.join('?' * len(batch))
+            yield _flatten_payloads(conn.execute(f'SELECT id, raw_json FROM events WHERE id IN ({placeholders})', batch))
+        return
+    context = multiprocessing.get_context('spawn')  # Safe beside the app's threads, and the default when frozen
+    with ProcessPoolExecutor(min(workers, len(batches)), mp_context=context) as pool:
+        pending = []
+        for batch in batches:
+            pending.append((batch, pool.submit(_flatten_event_range, path, batch[0], batch[-1])))
+            if len(pending) >= 2 * workers:
+                yield _only_batch(*pending.pop(0))
+        for batch, future in pending:
+            yield _only_batch(batch, future)
+
+def rebuild_flat_events(conn, batch_size=None, workers=None):
+    """Flatten every stored event that has no events_flat row, multi-valued fields included.
+
+    Events are decoded and flattened by FLATTEN_WORKERS processes (see
+    _iter_flattened_batches) and written here in id order, so the
+    projection is the one a single process would build. Returns how many
+    events were flattened.
+    """
+    batch_size = batch_size or WRITE_BATCH_SIZE
+    workers = FLATTEN_WORKERS if workers is None else workers
+    missing = [row[0] for row in conn.execute('''
+        SELECT id FROM events WHERE raw_json IS NOT NULL AND id NOT IN (SELECT event_id FROM events_flat) ORDER BY id
+    ''')]
+    if missing:
+        log_extraction_message(f"Flattening {len(missing):,} stored events...")
+    batches = [missing[start:start + batch_size] for start in range(0, len(missing), batch_size)]
+    for batch, (rows, values) in zip(batches, _iter_flattened_batches(conn, batches, workers)):
+        placeholders = ','.join('?' * len(batch))
+        for table in MULTI_VALUE_TABLES:
+            conn.execute(f'DELETE FROM {table} WHERE event_id IN ({placeholders})', batch)
+        write_flat_events(conn, rows)
+        for table, table_rows in values.items():
+            conn.executemany(_multi_value_insert_sql(table), table_rows)
+    return len(missing)
+
+def iter_flat_event_chunks(conn, positions=None, skip_errors=False, chunk_size=None):
+    """Yield the dataset's flattened events (result_events_flat) a chunk at a time.
 
+    Events come in id order as dicts of their non-null columns, event_id
+    first, from one statement, so memory holds one chunk of
+    EXPORT_CHUNK_SIZE events. Columns read from a row's flat_overflow are
+    added to `positions` (the events_flat_columns positions).
+    """
+    chunk_size = chunk_size or EXPORT_CHUNK_SIZE
+    positions = {} if positions is None else positions
+    registered = {row[0] for row in conn.execute('SELECT name FROM events_flat_columns')}
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(events_flat)') if row[1] in registered]
+    where = 'WHERE error IS NULL' if skip_errors and 'error' in columns else ''
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    cursor.execute(f"SELECT event_id, flat_overflow{''.join(', ' + _quote_identifier(c) for c in columns)} "
+                   f"FROM result_events_flat {where} ORDER BY event_id")
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        chunk = []
+        for row in rows:
+            event = {'event_id': row[0]}
+            event.update((column, value) for column, value in zip(columns, row[2:]) if value is not None)
+            if row[1]:
+                for column, (position, value) in json.loads(row[1]).items():
+                    positions.setdefault(column, position)
+                    if value is not None:
+                        event[column] = value
+            chunk.append(event)
+        yield chunk
 
-def sanitize_text(text):
-    if not isinstance(text, str):
-        return text
-    # Remove all ASCII control characters except tab, newline, carriage return
-    text = re.sub(r'[\x00-\x08\x0b\x0c\x0e-\x1f]', '', text)
-    # Remove invalid XML characters (0x00-0x08, 0x0B, 0x0C, 0x0E-0x1F, 0x7F-0x9F)
-    text = re.sub(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\x9f]', '', text)
-    # Replace problematic Unicode quotes with standard quotes
-    text = text.replace('\u201c', '"').replace('\u201d', '"').replace('\u2018', "'").replace('\u2019', "'")
-    # Replace other problematic Unicode characters
-    text = text.replace('\u2013', '-').replace('\u2014', '-')  # en-dash, em-dash
-    text = text.replace('\u2022', '•')  # bullet point
-    text = text.replace('\u2026', '...')  # ellipsis
-    # Remove any remaining control characters
-    text = re.sub(r'[\x00-\x1f\x7f-\x9f]', '', text)
-    # Limit string length to prevent Excel issues (Excel has cell size limits)
-    if len(text) > 32000:  # Excel cell limit is 32,767 characters
-        text = text[:32000] + "..."
-    return text
+def scan_flat_columns(conn, skip_errors=False, chunk_size=None):
+    """Work out the layout of the dataset's flattened-events frame, without building it.
 
-def sanitize_df(df):
-    for col in df.columns:
-        if df[col].dtype == object:
-            df[col] = df[col].apply(sanitize_text)
-    return df
+    The frame has one row per event in id order and a column per flattened
+    field holding a value: a column first set by an earlier event comes
+    first, and columns first set by the same event follow their flattening
+    position (events_flat_columns). One streaming pass over the flattened
+    events returns a dict with 'rows' (the event count), 'columns' (the
+    frame's columns, in that order), 'dtypes' (the dtype pandas would infer
+    for each: int64, float64 for numbers with gaps, else object), 'counts'
+    (each column's non-null values) and 'filled' (the columns holding a
+    value that is not blank once sanitized for Excel).
+    """
+    positions = dict(conn.execute('SELECT name, position FROM events_flat_columns').fetchall())
+    stored = set(positions)
+    first, counts, kinds, filled = {}, {}, {}, set()
+    rows = 0
+    for chunk in iter_flat_event_chunks(conn, positions, skip_errors, chunk_size):
+        for event in chunk:
+            for column, value in event.items():
+                if column not in first:
+                    first[column], counts[column], kinds[column] = rows, 0, set()
+                counts[column] += 1
+                kinds[column].add(type(value))
+                if column not in filled and str(sanitize_text(value)).strip() != '':
+                    filled.add(column)
+            rows += 1
+    dtypes = {}
+    for column, seen in kinds.items():
+        if column != 'event_id' and column not in stored:
+            dtypes[column] = object  # Set one cell at a time from flat_overflow
+        elif seen == {int} and counts[column] == rows:
+            dtypes[column] = 'int64'
+        elif seen <= {int, float}:
+            dtypes[column] = 'float64'
+        else:
+            dtypes[column] = object
+    columns = sorted(first, key=lambda column: (first[column], positions.get(column, -1)))
+    return {'rows': rows, 'columns': columns, 'dtypes': dtypes, 'counts': counts, 'filled': filled}
 
+def iter_flat_event_frames(conn, scan, skip_errors=False, chunk_size=None):
+    """Yield the flattened-events frame in chunks of rows, given its scan_flat_columns() scan.
 
+    Every chunk has all of the scan's columns with their dtypes, so chunks
+    hold the values the whole frame would.
+    """
+    import pandas as pd
+    import numpy as np
+    columns = scan['columns']
+    numeric = {column: dtype for column, dtype in scan['dtypes'].items() if dtype is not object}
+    for chunk in iter_flat_event_chunks(conn, None, skip_errors, chunk_size):
+        frame = pd.DataFrame([[event.get(column) for column in columns] for event in chunk],
+                             columns=columns, dtype=object)
+        yield frame.astype(numeric).fillna(np.nan)
 
-def extract_event_fields(event, field_list, event_id=None):
+def split_flat_column(column):
+    """The flattened field a column holds and the column's slot numbers.
+
+    Columns are named as _iter_event_fields names them: a top-level field
+    (slots ()), element n of a top-level list (field_n, slots (n,)), the
+    field of device/patient n (device_<name>_n, slots (n,)) and element m
+    of that list (device_<name>_n_m, slots (n, m)). Other columns, like
+    event_id and maude_report_link, are fields of their own.
     """
-    Extracts the specified fields from the event JSON, handling arrays and nested fields.
-    For array fields, splits into _1, _2, ... columns, placed after the main field.
-    For nested fields (device.*, patient.*, mdr_text.*), pivots as needed.
+    if column in FLAT_TOP_FIELDS:
+        return column, ()
+    head, _, last = column.rpartition('_')
+    if last.isdigit():
+        if head in FLAT_TOP_FIELDS or head in FLAT_ITEM_FIELDS:
+            return head, (int(last),)
+        field, _, item = head.rpartition('_')
+        if item.isdigit() and field in FLAT_ITEM_FIELDS:
+            return field, (int(item), int(last))
+    return column, ()
+
+def flat_field_columns(columns):
+    """{field: its columns in the given order} for flattened columns (see split_flat_column)."""
+    fields = {}
+    for column in columns:
+        fields.setdefault(split_flat_column(column)[0], []).append(column)
+    return fields
+
+def iter_flat_field_values(conn, scan, fields, skip_errors=False, chunk_size=None):
+    """Yield every event's values of some flattened fields, given the scan_flat_columns() scan.
+
+    For each event, in id order, yields {field: values} with the field's
+    non-null values in the scan's column order and with its dtypes (see
+    flat_field_columns). Tallies over them match tallies
+    over the frame's columns, without building the frame.
     """
-    result = {}
-    if event_id is not None:
-        result['event_id'] = event_id
-    # First, handle top-level fields and arrays
-    for field in field_list:
-        if '.' not in field and not field.startswith('device') and not field.startswith('patient') and not field.startswith('mdr_text'):
-            value = event.get(field, '')
-            if isinstance(value, list):
-                result[field] = ''
-                for i, v in enumerate(value):
-                    result[f'{field}_{i+1}'] = v
+    columns = flat_field_columns(scan['columns'])
+    wanted = {field: [(column, float if scan['dtypes'][column] == 'float64' else None)
+                      for column in columns.get(field, [])] for field in fields}
+    for chunk in iter_flat_event_chunks(conn, None, skip_errors, chunk_size):
+        for event in chunk:
+            yield {field: [convert(event[column]) if convert else event[column]
+                           for column, convert in field_columns if column in event]
+                   for field, field_columns in wanted.items()}
+
+def humanize_export_column(col):
+    """The Excel header of a flattened or MDR text column ('device_brand_name_2' -> 'Brand Name 2')."""
+    if not isinstance(col, str):
+        return col
+    if col in EXPORT_COLUMN_NAMES:
+        return EXPORT_COLUMN_NAMES[col]
+    # Handle array fields with numbers
+    if '_' in col and col[-1].isdigit():
+        base_field = col.rsplit('_', 1)[0]
+        number = col.rsplit('_', 1)[1]
+        if base_field in EXPORT_COLUMN_NAMES:
+            return f"{EXPORT_COLUMN_NAMES[base_field]} {number}"
+        # Handle special cases for nested array fields - clean up the naming
+        elif base_field.endswith('_1') and base_field[:-2] in EXPORT_COLUMN_NAMES:
+            base_base_field = base_field[:-2]
+            # Clean up nested array naming (e.g., "Patient Patient Problems 1 1" -> "Patient Problem 1")
+            if base_base_field == 'patient_patient_problems':
+                return f"Patient Problem {number}"
+            elif base_base_field == 'patient_sequence_number_outcome':
+                return f"Patient Outcome {number}"
+            elif base_base_field == 'patient_sequence_number_treatment':
+                return f"Patient Treatment {number}"
             else:
-                result[field] = value
-    # Handle device fields
-    devices = event.get('device', [])
-    for i, device in enumerate(devices):
-        for field in field_list:
-            if field.startswith('device.'):
-                subfield = field.split('.', 1)[1]
-                value = device.get(subfield, '')
-                if isinstance(value, list):
-                    result[f'device_{subfield}_{i+1}'] = ''
-                    for j, v in enumerate(value):
-                        result[f'device_{subfield}_{i+1}_{j+1}'] = v
-                else:
-                    result[f'device_{subfield}_{i+1}'] = value
-    # Handle patient fields
-    patients = event.get('patient', [])
-    for i, patient in enumerate(patients):
-        for field in field_list:
-            if field.startswith('patient.'):
-                subfield = field.split('.', 1)[1]
-                value = patient.get(subfield, '')
-                if isinstance(value, list):
-                    result[f'patient_{subfield}_{i+1}'] = ''
-                    for j, v in enumerate(value):
-                        result[f'patient_{subfield}_{i+1}_{j+1}'] = v
-                else:
-                    result[f'patient_{subfield}_{i+1}'] = value
-    # Handle mdr_text fields (not in Events sheet, but for completeness)
-    # MAUDE report link
-    mdr_report_key = event.get('mdr_report_key', '')
-    maude_link = ''
-    if mdr_report_key:
-        # Try to get first device's product code
-        pc = ''
-        if devices and isinstance(devices, list):
-            pc = devices[0].get('device_report_product_code', '')
-        if pc:
-            maude_link = f"https://www.accessdata.fda.gov/scripts/cdrh/cfdocs/cfmaude/detail.cfm?mdrfoi__id={mdr_report_key}&pc={pc}"
-        else:
-            maude_link = f"https://www.accessdata.fda.gov/scripts/cdrh/cfdocs/cfmaude/detail.cfm?mdrfoi__id={mdr_report_key}"
-    result['maude_report_link'] = maude_link
-    return result
+                return f"{EXPORT_COLUMN_NAMES[base_base_field]} {number}"
+        # Handle MDR text numbered columns
+        elif base_field in ['Description_of_Event_or_Problem', 'Additional_Manufacturer_Narrative']:
+            if base_field == 'Description_of_Event_or_Problem':
+                return f"Description of Event or Problem {number}"
+            elif base_field == 'Additional_Manufacturer_Narrative':
+                return f"Additional Manufacturer Narrative {number}"
+    return col.replace('_', ' ').replace('.', ' ').title()
+
+def _events_sheet_priority(name):
+    # Sort key of an EVENTS_SHEET_ORDER name and its numbered slots (1-49)
+    # "Name i" and "Name i j", or None for any other name
+    def slot(token):
+        return token.isdigit() and str(int(token)) == token and 1 <= int(token) < 50
+    if name in EVENTS_SHEET_RANK:
+        return (EVENTS_SHEET_RANK[name], 0)
+    head, _, last = name.rpartition(' ')
+    if not slot(last):
+        return None
+    if head in EVENTS_SHEET_RANK:
+        return (EVENTS_SHEET_RANK[head], 1, int(last))
+    base, _, first = head.rpartition(' ')
+    if slot(first) and base in EVENTS_SHEET_RANK:
+        return (EVENTS_SHEET_RANK[base], 2, int(first), int(last))
+    return None
+
+def plan_export_layout(scan, field_list=None):
+    """Lay out the Excel export's columns from a scan_flat_columns() scan, in one pass over them.
+
+    Returns a dict with:
+    - 'raw': every column for Raw_Events. event_id comes first, then each
+      field of field_list (FLAT_EVENT_FIELDS) followed by its list
+      elements, with maude_report_link after mdr_report_key, then the
+      rest in scan order.
+    - 'events': (column, header) pairs for the Events sheet. Blank
+      columns are left out, except EVENTS_ESSENTIAL_COLUMNS. The
+      EVENTS_SHEET_ORDER headers and their numbered slots come first,
+      then the rest grouped by EVENTS_SHEET_FIELDS.
+    - 'blank': the columns left out of the Events sheet.
+    - 'slots': the highest list element or device/patient number of
+      each field.
+    """
+    field_list = field_list or FLAT_EVENT_FIELDS
+    columns = scan['columns']
+    elements, slots = {}, {}
+    for column in columns:
+        field, numbers = split_flat_column(column)
+        if numbers:
+            slots[field] = max(slots.get(field, 0), numbers[0])
+            if len(numbers) == 1:
+                elements[(field, numbers[0])] = column
+
+    # Build ordered columns: event_id, then for each field, its array columns immediately after
+    present = set(columns)
+    raw = ['event_id']
+    for field in field_list:
+        if field in present:
+            raw.append(field)
+        # Add array columns immediately after
+        if field in FLAT_TOP_FIELDS:
+            for i in range(1, slots.get(field, 0) + 1):
+                if (field, i) not in elements:
+                    break
+                raw.append(elements[(field, i)])
+        # Insert maude_report_link after mdr_report_key
+        if field == 'mdr_report_key' and 'maude_report_link' in present:
+            raw.append('maude_report_link')
+    # Add maude_report_link at the end if not already added
+    if 'maude_report_link' in present and 'maude_report_link' not in raw:
+        raw.append('maude_report_link')
+    # Add any extra columns
+    placed = set(raw)
+    raw.extend(column for column in columns if column not in placed)
+
+    # Events columns: grouped by the first EVENTS_SHEET_FIELDS entry they
+    # are or extend ('date_report' takes 'date_report_to_fda'), the rest after
+    def group(column):
+        ranks = [EVENTS_SHEET_FIELD_RANK.get(column)] + [
+            EVENTS_SHEET_FIELD_RANK.get(column[:k]) for k, char in enumerate(column) if char == '_']
+        return min((rank for rank in ranks if rank is not None), default=len(EVENTS_SHEET_FIELDS))
+    grouped = sorted(range(len(raw)), key=lambda k: (group(raw[k]), k))
+    blank = [raw[k] for k in grouped if raw[k] not in EVENTS_ESSENTIAL_COLUMNS and raw[k] not in scan['filled']]
+    left_out = set(blank)
+    kept = [raw[k] for k in grouped if raw[k] not in left_out]
+
+    # Priority headers first, then others; a header shared by several
+    # columns takes all of them along
+    same_name = {}
+    for column in kept:
+        same_name.setdefault(humanize_export_column(column), []).append(column)
+    keys = {name: _events_sheet_priority(name) for name in same_name}
+    first = sorted((name for name in same_name if keys[name] is not None), key=keys.get)
+    order = first + [name for name in same_name if keys[name] is None]
+    events = [(column, name) for name in order for column in same_name[name]]
+    return {'raw': raw, 'events': events, 'blank': blank, 'slots': slots}
 
-def export_to_excel(include_raw_events=True):
+def export_to_excel(include_raw_events=True, dataset=None):
     import pandas as pd
     import json
     import os
@@ -671,239 +3980,7 @@ def export_to_excel(include_raw_events=True):
     fields_path = os.path.join(BASE_DIR, 'fields.xlsx')
     
     log_export_message("Starting Excel export process...")
-    # Main fields and array fields for the Main Fields sheet
-    main_fields = [
-        'event_id', 'report_number', 'mdr_report_key', 'maude_report_link',
-        'date_of_event', 'date_report', 'date_received', 'date_manufacturer_received',
-        'device_date_received', 'device_expiration_date_of_device', 'patient_date_received',
-        'device_generic_name', 'device_brand_name', 'device_manufacturer_d_name',
-        'device_device_report_product_code', 'device_model_number', 'device_lot_number',
-        'device_device_availability', 'device_device_evaluated_by_manufacturer', 'device_manufacturer_d_country',
-        'single_use_flag', 'reprocessed_and_reused_flag', 'device_device_operator', 'report_source_code',
-        'health_professional', 'reporter_occupation_code', 'source_type',
-        'patient_patient_age', 'patient_patient_sex', 'patient_patient_weight', 'patient_patient_ethnicity', 'patient_patient_race',
-        'event_type', 'adverse_event_flag', 'patient_patient_problems', 'patient_sequence_number_outcome', 'patient_sequence_number_treatment',
-        'product_problem_flag', 'product_problems'
-    ]
-    array_fields = [
-        'product_problems', 'patient_patient_problems', 'patient_sequence_number_outcome', 'patient_sequence_number_treatment'
-    ]
-    
-    # Use the user-provided field list (excluding distributor and manufacturer contact fields for performance)
-    field_list = [
-        'adverse_event_flag', 'product_problems', 'product_problem_flag', 'date_of_event', 'date_report', 'date_received',
-        'device_date_of_manufacturer', 'event_type', 'number_devices_in_event', 'number_patients_in_event', 'previous_use_code',
-        'remedial_action', 'removal_correction_number', 'report_number', 'single_use_flag', 'report_source_code',
-        'health_professional', 'reporter_occupation_code', 'initial_report_to_fda', 'reprocessed_and_reused_flag',
-        'device.device_event_key', 'device.date_received', 'device.brand_name',
-        'device.generic_name', 'device.device_report_product_code',
-        'device.model_number', 'device.catalog_number', 'device.lot_number', 'device.other_id_number',
-        'device.expiration_date_of_device', 'device.device_availability',
-        'device.device_evaluated_by_manufacturer', 'device.device_operator',
-        'device.implant_flag', 'device.date_removed_flag', 'device.manufacturer_d_name',
-        'device.manufacturer_d_country', 'device.device_class', 'device.device_name', 'device.fei_number', 'device.medical_specialty_description', 'device.registration_number', 'patient.date_received', 'patient.patient_age',
-        'patient.patient_sex', 'patient.patient_weight', 'patient.patient_ethnicity', 'patient.patient_race',
-        'patient.patient_problems', 'patient.sequence_number_outcome', 'patient.sequence_number_treatment',
-        'mdr_text.date_report', 'mdr_text.mdr_text_key', 'mdr_text.patient_sequence_number', 'mdr_text.text',
-        'mdr_text.text_type_code', 'type_of_report', 'date_facility_aware', 'report_date', 'report_to_fda',
-        'date_report_to_fda', 'report_to_manufacturer', 'date_report_to_manufacturer', 'event_location', 'manufacturer_name', 'manufacturer_address_1', 'manufacturer_address_2',
-        'manufacturer_city', 'manufacturer_country', 'manufacturer_gl_name',
-        'manufacturer_gl_country', 'date_manufacturer_received',
-        'source_type', 'event_key', 'mdr_report_key', 'device name', 'fei_number',
-        'medical_specialty_description', 'registration_number', 'regulation_number'
-    ]
-    # List of array fields to handle placement
-    array_fields = [
-        'product_problems', 'remedial_action', 'previous_use_code', 'removal_correction_number', 'single_use_flag',
-        'report_source_code', 'reporter_occupation_code', 'initial_report_to_fda', 'reprocessed_and_reused_flag',
-        'patient.patient_problems', 'patient.sequence_number_outcome', 'patient.sequence_number_treatment'
-    ]
-    def format_all_date_columns(df):
-        import re
-        from datetime import datetime
-        date_pattern = re.compile(r'^\d{8}$')
-        date_base_names = [
-            'date_of_event', 'date_report', 'date_received', 'date_manufacturer_received',
-            'device_date_received', 'device_expiration_date_of_device', 'patient_date_received',
-            'device_date_of_manufacturer', 'device.date_received', 'device.expiration_date_of_device',
-            'device.date_returned_to_manufacturer', 'device.date_removed_flag', 'mdr_text.date_report',
-            'date_facility_aware', 'report_date', 'date_report_to_fda', 'date_report_to_manufacturer'
-        ]
-        date_cols_to_format = [col for col in df.columns if any(col == base or col.startswith(base + '_') for base in date_base_names)]
-        for col in date_cols_to_format:
-            df[col] = df[col].apply(
-                lambda x: datetime.strptime(str(x), '%Y%m%d').strftime('%m/%d/%Y') if isinstance(x, str) and date_pattern.match(x) else x
-            )
-        return df
-
-    def translate_fda_codes(df):
-        """Translate FDA codes to human-readable text for user-friendly display"""
-        
-        # Patient Outcome Codes (based on actual data analysis)
-        outcome_mapping = {
-            'R': 'Required Intervention',
-            'O': 'Other',
-            'H': 'Hospitalization',
-            'D': 'Death',
-            'L': 'Life Threatening',
-            'I': 'Injury',
-            'M': 'Malfunction',
-            'N': 'No Information',
-            'U': 'Unknown',
-            'S': 'Disability'
-        }
-        
-        # Device Evaluated by Manufacturer Codes (based on actual data)
-        device_evaluated_mapping = {
-            'R': 'Returned to Manufacturer',
-            'Y': 'Yes',
-            'N': 'No',
-            'I': 'Invalid/Incomplete',
-            '*': 'Not Available'
-        }
-        
-        # Reporter Occupation Codes (based on actual data)
-        occupation_mapping = {
-            '501': 'Administrator/Supervisor',
-            '003': 'Non-Healthcare Professional',
-            '117': 'Nurse Practitioner',
-            '2': 'Nurse',
-            'PHYSICIAN': 'Physician',
-            'NURSE': 'Nurse',
-            'OTHER': 'Other',
-            'OTHER HEALTH CARE PROFESSIONAL': 'Other Health Care Professional',
-            'RISK MANAGER': 'Risk Manager',
-            'PATIENT': 'Patient',
-            'ATTORNEY': 'Attorney',
-            'PATIENT FAMILY MEMBER OR FRIEND': 'Patient Family Member or Friend',
-            'UNKNOWN': 'Unknown'
-        }
-        
-        # Previous Use Codes (based on actual data)
-        previous_use_mapping = {
-            'I': 'Invalid/Incomplete',
-            'N': 'No',
-            'U': 'Unknown',
-            '*': 'Not Available'
-        }
-        
-        # Report to FDA Codes (based on actual data)
-        report_to_fda_mapping = {
-            'Y': 'Yes',
-            'N': 'No',
-            'I': 'Invalid/Incomplete',
-            '*': 'Not Available'
-        }
-        
-        # Health Professional Codes (based on actual data)
-        health_prof_mapping = {
-            'Y': 'Yes',
-            'N': 'No',
-            'I': 'Invalid/Incomplete',
-            '*': 'Not Available'
-        }
-        
-        # Single Use Flag (based on actual data)
-        single_use_mapping = {
-            'Y': 'Yes',
-            'N': 'No',
-            'I': 'Invalid/Incomplete',
-            '*': 'Not Available'
-        }
-        
-        # Reprocessed Flag (based on actual data)
-        reprocessed_mapping = {
-            'N': 'No',
-            'I': 'Invalid/Incomplete'
-        }
-        
-        # Adverse Event Flag (based on actual data)
-        adverse_event_mapping = {
-            'Y': 'Yes',
-            'N': 'No'
-        }
-        
-        # Product Problem Flag (based on actual data)
-        product_problem_mapping = {
-            'Y': 'Yes',
-            'N': 'No',
-            '*': 'Not Available'
-        }
-        
-        # Device Operator Codes (based on actual data)
-        device_operator_mapping = {
-            'I': 'No Information',
-            '0': 'Other',
-            'HEALTH PROFESSIONAL': 'Health Professional',
-            'LAY USER/PATIENT': 'Lay User/Patient',
-            'INVALID DATA': 'Invalid Data',
-            'PHYSICIAN': 'Physician',
-            'OTHER': 'Other'
-        }
-        
-        # Event Location Codes (based on actual data)
-        event_location_mapping = {
-            'Y': 'Yes',
-            'N': 'No',
-            'I': 'Invalid/Incomplete',
-            '*': 'Not Available'
-        }
-        
-        # Manufacturer Link Flag Codes (based on actual data)
-        manufacturer_link_flag_mapping = {
-            'Y': 'Yes',
-            'N': 'No',
-            'I': 'Invalid/Incomplete',
-            '*': 'Not Available'
-        }
-        
-        # Apply translations to relevant columns
-        for col in df.columns:
-            if 'Patient Outcome' in col:
-                # Handle semicolon-separated codes for Patient Outcome
-                def translate_outcome_codes(value):
-                    if pd.isna(value) or value == '':
-                        return value
-                    if isinstance(value, str):
-                        # Split by semicolon and translate each code
-                        codes = [code.strip() for code in value.split(';')]
-                        translated_codes = []
-                        for code in codes:
-                            if code in outcome_mapping:
-                                translated_codes.append(outcome_mapping[code])
-                            else:
-                                translated_codes.append(code)  # Keep original if not in mapping
-                        return '; '.join(translated_codes)
-                    return value
-                df[col] = df[col].apply(translate_outcome_codes)
-            elif 'Device Evaluated By Manufacturer' in col:
-                df[col] = df[col].map(device_evaluated_mapping).fillna(df[col])
-            elif 'Reporter Occupation Code' in col:
-                df[col] = df[col].map(occupation_mapping).fillna(df[col])
-            elif 'Previous Use Code' in col:
-                df[col] = df[col].map(previous_use_mapping).fillna(df[col])
-            elif 'Report To FDA' in col:
-                df[col] = df[col].map(report_to_fda_mapping).fillna(df[col])
-            elif 'Health Professional' in col:
-                df[col] = df[col].map(health_prof_mapping).fillna(df[col])
-            elif 'Single Use Flag' in col:
-                df[col] = df[col].map(single_use_mapping).fillna(df[col])
-            elif 'Reprocessed And Reused Flag' in col:
-                df[col] = df[col].map(reprocessed_mapping).fillna(df[col])
-            elif 'Adverse Event Flag' in col:
-                df[col] = df[col].map(adverse_event_mapping).fillna(df[col])
-            elif 'Product Problem Flag' in col:
-                df[col] = df[col].map(product_problem_mapping).fillna(df[col])
-            elif 'Device Operator' in col:
-                df[col] = df[col].map(device_operator_mapping).fillna(df[col])
-            elif 'Event Location' in col:
-                df[col] = df[col].map(event_location_mapping).fillna(df[col])
-            elif 'Manufacturer Link Flag' in col:
-                df[col] = df[col].map(manufacturer_link_flag_mapping).fillna(df[col])
-        
-        return df
-
-    with get_db_connection() as conn:
+    with get_results_connection(dataset) as conn:
         timestamp = datetime.now().strftime("%Y-%m-%d_%H%M")
         import tempfile
         temp_dir = tempfile.gettempdir()
@@ -914,9 +3991,9 @@ def export_to_excel(include_raw_events=True):
             from openpyxl.styles import Font, PatternFill, Alignment
             from openpyxl.cell import WriteOnlyCell
             import numpy as np
-            
+
             wb = openpyxl.Workbook(write_only=True)
-            
+
             # Using if True to maintain indentation block without rewriting 400 lines
             if True:
                 import re
@@ -925,290 +4002,21 @@ def export_to_excel(include_raw_events=True):
                         return None
                     match = re.search(r'\d+(\.\d+)?', str(val))
                     return float(match.group()) if match else None
-                
 
-                
-                # 1. EVENTS - Extract only user-specified fields, event_id as first column (OPTIMIZED)
-                total_events = conn.execute("SELECT COUNT(*) as count FROM events").fetchone()['count']
-                log_export_message(f"Processing {total_events:,} events for export...")
-                
-                import gc
-                cursor = conn.cursor()
-                cursor.execute('SELECT id, raw_json FROM events ORDER BY id')
-                
-                all_events_data = []
-                chunk_size = 5000
-                while True:
-                    rows = cursor.fetchmany(chunk_size)
-                    if not rows:
-                        break
-                    for row in rows:
-                        if row['raw_json']:
-                            try:
-                                event = json.loads(row['raw_json'])
-                                extracted = extract_event_fields(event, field_list, event_id=row['id'])
-                                all_events_data.append(extracted)
-                            except Exception as e:
-                                all_events_data.append({'event_id': row['id'], 'error': str(e)})
-                    gc.collect()
-                
-                if not all_events_data:
-                    raise Exception('No data to export. Please run a search and try again.')
-                
-                if all_events_data:
-                    log_export_message(f"Creating Events DataFrame with {len(all_events_data):,} records...")
-                    events_flat_df = pd.DataFrame(all_events_data)
-                    log_export_message("Sanitizing data for Excel compatibility...")
-                    events_flat_df = sanitize_df(events_flat_df)
-                    log_export_message("Formatting date columns...")
-                    events_flat_df = format_all_date_columns(events_flat_df)
-                    # Build ordered columns: event_id, then for each field, its array columns immediately after
-                    ordered_cols = ['event_id']
-                    for field in field_list:
-                        if field in events_flat_df.columns:
-                            ordered_cols.append(field)
-                        # Add array columns immediately after
-                        i = 1
-                        while f'{field}_{i}' in events_flat_df.columns:
-                            ordered_cols.append(f'{field}_{i}')
-                            i += 1
-                        # Insert maude_report_link after mdr_report_key
-                        if field == 'mdr_report_key' and 'maude_report_link' in events_flat_df.columns:
-                            ordered_cols.append('maude_report_link')
-                    # Add maude_report_link at the end if not already added
-                    if 'maude_report_link' in events_flat_df.columns and 'maude_report_link' not in ordered_cols:
-                        ordered_cols.append('maude_report_link')
-                    # Add any extra columns
-                    extra_cols = [col for col in events_flat_df.columns if col not in ordered_cols]
-                    events_flat_df = events_flat_df[ordered_cols + extra_cols]
-                    
-                    # Only write Raw_Events sheet if requested
-                    if include_raw_events:
-                        log_export_message("Writing Raw_Events sheet to Excel...")
-                        print("Writing Raw_Events sheet to Excel...")
-                        ws_raw = wb.create_sheet('Raw_Events')
-                        import numpy as np
-                        events_flat_df_clean = events_flat_df.replace({np.nan: ''})
-                        ws_raw.append(list(events_flat_df_clean.columns))
-                        for row in events_flat_df_clean.itertuples(index=False, name=None):
-                            ws_raw.append(row)
-                        del events_flat_df_clean
-                        import gc
-                        gc.collect()
-                
-                # --- ALWAYS CREATE EVENTS SHEET (moved outside conditional block) ---
-                # --- Restore main_fields_df construction ---
-                main_fields_cols = []
-                for field in main_fields:
-                    # Find all columns in events_flat_df that start with this field name (robust: any suffix)
-                    matching_cols = [col for col in events_flat_df.columns if col == field or col.startswith(field + '_')]
-                    main_fields_cols.extend(matching_cols)
-                # Add any extra columns not in main_fields_cols
-                extra_cols = [col for col in events_flat_df.columns if col not in main_fields_cols]
-                main_fields_df = events_flat_df[main_fields_cols + extra_cols]
-                main_fields_df = format_all_date_columns(main_fields_df)
-                
-                # Remove completely blank columns (no data except header)
-                # BUT NEVER remove essential columns like event_id
-                essential_columns = ['event_id', 'id', 'report_number']
-                blank_cols = []
-                for col in main_fields_df.columns:
-                    # Never remove essential columns
-                    if col in essential_columns:
-                        continue
-                    
-                    # Check if the column has any non-blank data (excluding header)
-                    has_data = False
-                    for val in main_fields_df[col]:
-                        # Check for actual data (not NaN, None, empty string, or whitespace)
-                        if pd.notna(val) and val is not None and str(val).strip() != '':
-                            has_data = True
-                            break
-                    if not has_data:
-                        blank_cols.append(col)
-                
-                # Remove columns with no data
-                if blank_cols:
-                    print(f"Removing {len(blank_cols)} blank columns from Custom_Events: {blank_cols}")
-                    main_fields_df = main_fields_df.drop(columns=blank_cols)
-                
-                # Enhanced humanize function for professional column naming
-                def enhanced_humanize(col):
-                    if not isinstance(col, str):
-                        return col
-                    field_mapping = {
-                        'event_id': 'Event ID',
-                        'report_number': 'Report Number',
-                        'mdr_report_key': 'MDR Report Key',
-                        'maude_report_link': 'MAUDE Report Link',
-                        'date_of_event': 'Event Date',
-                        'date_report': 'Report Date',
-                        'date_received': 'Date Received',
-                        'date_manufacturer_received': 'Date Manufacturer Received',
-                        'device_date_received': 'Device Date Received',
-                        'device_expiration_date_of_device': 'Device Expiration Date',
-                        'patient_date_received': 'Patient Date Received',
-                        'device_generic_name': 'Product Class',
-                        'device_brand_name': 'Brand Name',
-                        'device_manufacturer_d_name': 'Manufacturer',
-                        'device_device_report_product_code': 'Product Code',
-                        'device_model_number': 'Model Number',
-                        'device_catalog_number': 'Catalog Number',
-                        'device_lot_number': 'Lot Number',
-                        'device_device_availability': 'Device Availability',
-                        'device_device_evaluated_by_manufacturer': 'Device Evaluated By Manufacturer',
-                        'device_manufacturer_d_country': 'Manufacturer Country',
-                        'single_use_flag': 'Single Use Flag',
-                        'reprocessed_and_reused_flag': 'Reprocessed And Reused Flag',
-                        'device_device_operator': 'Device Operator',
-                        'report_source_code': 'Report Source Code',
-                        'health_professional': 'Health Professional',
-                        'reporter_occupation_code': 'Reporter Occupation Code',
-                        'source_type': 'Source Type',
-                        'patient_patient_age': 'Patient Age',
-                        'patient_patient_sex': 'Patient Sex',
-                        'patient_patient_weight': 'Patient Weight',
-                        'patient_patient_ethnicity': 'Patient Ethnicity',
-                        'patient_patient_race': 'Patient Race',
-                        'event_type': 'Event Type',
-                        'adverse_event_flag': 'Adverse Event Flag',
-                        'patient_patient_problems': 'Patient Problem',
-                        'patient_sequence_number_outcome': 'Patient Outcome',
-                        'patient_sequence_number_treatment': 'Patient Treatment',
-                        'product_problem_flag': 'Product Problem Flag',
-                        'product_problems': 'Device Problem',
-                        'date_report_to_fda': 'Date Report To FDA',
-                        'date_report_to_manufacturer': 'Date Report To Manufacturer',
-                        # MDR Text specific mappings
-                        'Description_of_Event_or_Problem': 'Description of Event or Problem',
-                        'Additional_Manufacturer_Narrative': 'Additional Manufacturer Narrative'
-                    }
-                    if col in field_mapping:
-                        return field_mapping[col]
-                    # Handle array fields with numbers
-                    if '_' in col and col[-1].isdigit():
-                        base_field = col.rsplit('_', 1)[0]
-                        number = col.rsplit('_', 1)[1]
-                        if base_field in field_mapping:
-                            return f"{field_mapping[base_field]} {number}"
-                        # Handle special cases for nested array fields - clean up the naming
-                        elif base_field.endswith('_1') and base_field[:-2] in field_mapping:
-                            base_base_field = base_field[:-2]
-                            # Clean up nested array naming (e.g., "Patient Patient Problems 1 1" -> "Patient Problem 1")
-                            if base_base_field == 'patient_patient_problems':
-                                return f"Patient Problem {number}"
-                            elif base_base_field == 'patient_sequence_number_outcome':
-                                return f"Patient Outcome {number}"
-                            elif base_base_field == 'patient_sequence_number_treatment':
-                                return f"Patient Treatment {number}"
-                            else:
-                                return f"{field_mapping[base_base_field]} {number}"
-                        # Handle MDR text numbered columns
-                        elif base_field in ['Description_of_Event_or_Problem', 'Additional_Manufacturer_Narrative']:
-                            if base_field == 'Description_of_Event_or_Problem':
-                                return f"Description of Event or Problem {number}"
-                            elif base_field == 'Additional_Manufacturer_Narrative':
-                                return f"Additional Manufacturer Narrative {number}"
-                    return col.replace('_', ' ').replace('.', ' ').title()
-                
-                # Apply enhanced column naming
-                main_fields_df.columns = [enhanced_humanize(c) for c in main_fields_df.columns]
-                
-                # Intelligent column reordering for Custom_Events sheet
-                # Define base priority order (without array numbers)
-                base_priority_order = [
-                    'Event ID', 'Report Number', 'MDR Report Key', 'MAUDE Report Link', 'Event Date', 'Report Date', 'Date Received',
-                    'Date Report To FDA', 'Date Report To Manufacturer', 'Date Manufacturer Received', 'Device Date Received', 'Device Expiration Date', 'Patient Date Received',
-                    'Product Class', 'Brand Name', 'Product Code', 'Model Number', 'Manufacturer', 'Manufacturer Country', 'Lot Number', 'Catalog Number', 'Device Availability', 'Device Evaluated By Manufacturer', 'Single Use Flag', 'Reprocessed And Reused Flag', 'Device Operator', 'Report Source Code', 'Health Professional', 'Reporter Occupation Code', 'Source Type', 'Patient Age', 'Patient Sex', 'Patient Weight', 'Patient Ethnicity', 'Patient Race', 'Event Type',
-                    'Adverse Event Flag', 'Product Problem Flag', 'Device Problem', 'Patient Problem', 'Patient Outcome', 'Patient Treatment'
-                ]
-                
-                # Build complete priority columns maintaining original position order
-                priority_columns = []
-                for base_field in base_priority_order:
-                    # Add the base field first (if it exists in the dataframe)
-                    if base_field in main_fields_df.columns:
-                        priority_columns.append(base_field)
-                    
-                    # Add all numbered variations of this field in sequence
-                    for i in range(1, 50):  # Support up to 49 array elements
-                        numbered_field = f"{base_field} {i}"
-                        if numbered_field in main_fields_df.columns:
-                            priority_columns.append(numbered_field)
-                    
-                    # Handle nested array fields (e.g., "Patient Problems 1 1", "Patient Problems 1 2", etc.)
-                    # These come from nested structures like patient.patient_problems
-                    for i in range(1, 50):  # First level array
-                        for j in range(1, 50):  # Second level array
-                            nested_field = f"{base_field} {i} {j}"
-                            if nested_field in main_fields_df.columns:
-                                priority_columns.append(nested_field)
-                    
-                    # Continue to next base field (arrays maintain their position in sequence)
-                
-                # Reorder columns: priority columns first, then others
-                available_priority_cols = [col for col in priority_columns if col in main_fields_df.columns]
-                other_cols = [col for col in main_fields_df.columns if col not in available_priority_cols]
-                reordered_cols = available_priority_cols + other_cols
-                
-                # Apply reordering
-                main_fields_df = main_fields_df[reordered_cols]
-                
-                # FDA Code Analysis removed for cleaner output
-                
-                # Apply FDA code translation for user-friendly display
-                main_fields_df = translate_fda_codes(main_fields_df)
-                
-                # INTEGRATE MDR TEXTS INTO EVENTS SHEET
-                log_export_message("Integrating MDR texts into Events sheet...")
-                
-                # Get MDR texts data and organize into an efficient lookup dictionary
-                mdr_texts_query = 'SELECT event_id, text_type_code, text FROM mdr_texts ORDER BY event_id, text_type_code'
-                mdr_texts_dict = {}
-                cursor = conn.cursor()
-                cursor.execute(mdr_texts_query)
-                for row in cursor.fetchall():
-                    eid = row['event_id']
-                    if eid not in mdr_texts_dict:
-                        mdr_texts_dict[eid] = []
-                    mdr_texts_dict[eid].append(row)
-                
-                # Create MDR text columns for each event
-                mdr_text_columns = {}
-                
-                # Get all unique event IDs from the main events DataFrame
-                # Try different possible column names for event ID
-                event_id_col = None
-                for col_name in ['event_id', 'id', 'Event ID', 'ID']:
-                    if col_name in main_fields_df.columns:
-                        event_id_col = col_name
-                        break
-                
-                if event_id_col is None:
-                    raise Exception("No event ID column found in main_fields_df")
-                
-                all_event_ids = main_fields_df[event_id_col].unique()
-                
-                for event_id in all_event_ids:
-                    # Get all MDR texts for this event from our lightning-fast dictionary
-                    event_mdr_texts = mdr_texts_dict.get(event_id, [])
-                    if not event_mdr_texts:
-                        continue
-                    
-                    # Initialize text columns for this event
+                def mdr_text_row(texts):
+                    """An event's MDR text columns, from its (text_type_code, text) rows."""
                     event_mdr_data = {}
-                    
+
                     # Track count of each text type for numbering
                     text_counts = {}
-                    
-                    for mdr_row in event_mdr_texts:
-                        text_type = mdr_row['text_type_code']
-                        text_content = sanitize_text(mdr_row['text'])  # Sanitize to prevent Excel cell size limits
+
+                    for text_type, text in texts:
+                        text_content = sanitize_text(text)  # Sanitize to prevent Excel cell size limits
                         # Convert to normal case (not all caps) for better readability
                         if text_content and text_content.isupper():
                             # Only convert if text is all uppercase, preserve mixed case
                             text_content = text_content.capitalize()
-                        
+
                         if text_type == 'Description of Event or Problem':
                             if text_counts.get('Description_of_Event_or_Problem', 0) == 0:
                                 # First occurrence - use the main column
@@ -1218,7 +4026,7 @@ def export_to_excel(include_raw_events=True):
                                 col_name = f'Description_of_Event_or_Problem_{text_counts["Description_of_Event_or_Problem"] + 1}'
                                 event_mdr_data[col_name] = text_content
                             text_counts['Description_of_Event_or_Problem'] = text_counts.get('Description_of_Event_or_Problem', 0) + 1
-                            
+
                         elif text_type == 'Additional Manufacturer Narrative':
                             if text_counts.get('Additional_Manufacturer_Narrative', 0) == 0:
                                 # First occurrence - use the main column
@@ -1228,7 +4036,7 @@ def export_to_excel(include_raw_events=True):
                                 col_name = f'Additional_Manufacturer_Narrative_{text_counts["Additional_Manufacturer_Narrative"] + 1}'
                                 event_mdr_data[col_name] = text_content
                             text_counts['Additional_Manufacturer_Narrative'] = text_counts.get('Additional_Manufacturer_Narrative', 0) + 1
-                            
+
                         else:
                             # Handle any other text types by adding them as additional columns
                             clean_text_type = text_type.replace(' ', '_').replace('-', '_').replace('(', '').replace(')', '')
@@ -1240,100 +4048,113 @@ def export_to_excel(include_raw_events=True):
                                 text_counts[clean_text_type] += 1
                                 col_name = f'{clean_text_type}_{text_counts[clean_text_type]}'
                                 event_mdr_data[col_name] = text_content
-                    
-                    mdr_text_columns[event_id] = event_mdr_data
-                
-                # Cleanup MDR texts dictionary as it's no longer needed
-                del mdr_texts_dict
-                gc.collect()
-                
-                # Get all unique MDR text column names across all events
+                    return event_mdr_data
+
+                def iter_mdr_texts(query, params=()):
+                    # (event_id, [(text_type_code, text), ...]) per event, from rows ordered by event_id
+                    cursor = conn.cursor()
+                    cursor.row_factory = None
+                    event_id, texts = None, []
+                    for eid, text_type, text in cursor.execute(query, params):
+                        if eid != event_id and texts:
+                            yield event_id, texts
+                            texts = []
+                        event_id = eid
+                        texts.append((text_type, text))
+                    if texts:
+                        yield event_id, texts
+
+                # 1. EVENTS - user-specified fields, flattened at ingest, event_id as first column.
+                # The sheets' columns are planned first from one pass over the
+                # flattened events and the MDR text types, then the rows are
+                # streamed through sanitizing, formatting and translation into
+                # the write-only sheets EXPORT_CHUNK_SIZE events at a time.
+                total_events = conn.execute("SELECT COUNT(*) as count FROM result_events").fetchone()['count']
+                log_export_message(f"Processing {total_events:,} events for export...")
+
+                import gc
+                # Both passes read the same snapshot, whatever is written meanwhile
+                conn.execute('BEGIN')
+                log_export_message("Planning export columns...")
+                scan = scan_flat_columns(conn)
+
+                if not scan['rows']:
+                    raise Exception('No data to export. Please run a search and try again.')
+
+                log_export_message(f"Found {len(scan['columns']):,} columns across {scan['rows']:,} records...")
+                layout = plan_export_layout(scan)
+                raw_columns = layout['raw']
+
+                # Remove completely blank columns (no data except header)
+                if layout['blank']:
+                    print(f"Removing {len(layout['blank'])} blank columns from Custom_Events: {layout['blank']}")
+                raw_index = {col: k for k, col in enumerate(raw_columns)}
+                event_positions = [raw_index[col] for col, _ in layout['events']]
+                event_names = [name for _, name in layout['events']]
+
+                # FDA Code Analysis removed for cleaner output
+
+                # MDR texts are integrated into the Events sheet as one column per text (numbered per type)
+                log_export_message("Planning MDR text columns for the Events sheet...")
                 all_mdr_columns = set()
-                for event_data in mdr_text_columns.values():
-                    all_mdr_columns.update(event_data.keys())
-                
+                for _, texts in iter_mdr_texts('''
+                    SELECT event_id, text_type_code, NULL FROM result_mdr_texts
+                    WHERE event_id IN (SELECT event_id FROM result_events_flat) ORDER BY event_id
+                '''):
+                    all_mdr_columns.update(mdr_text_row(texts))
+
                 # Sort MDR columns for consistent ordering with Description columns first
                 mdr_column_list = []
-                
+
                 # First, add all "Description of Event or Problem" columns (main + numbered)
                 desc_cols = [col for col in all_mdr_columns if col.startswith('Description_of_Event_or_Problem')]
-                desc_cols.sort(key=lambda x: (x != 'Description_of_Event_or_Problem', 
+                desc_cols.sort(key=lambda x: (x != 'Description_of_Event_or_Problem',
                                             int(x.split('_')[-1]) if x.split('_')[-1].isdigit() else 0))
                 mdr_column_list.extend(desc_cols)
-                
+
                 # Then, add all "Additional Manufacturer Narrative" columns (main + numbered)
                 narrative_cols = [col for col in all_mdr_columns if col.startswith('Additional_Manufacturer_Narrative')]
-                narrative_cols.sort(key=lambda x: (x != 'Additional_Manufacturer_Narrative', 
+                narrative_cols.sort(key=lambda x: (x != 'Additional_Manufacturer_Narrative',
                                                  int(x.split('_')[-1]) if x.split('_')[-1].isdigit() else 0))
                 mdr_column_list.extend(narrative_cols)
-                
+
                 # Finally, add any other MDR text type columns
                 other_mdr_cols = [col for col in all_mdr_columns if col not in mdr_column_list]
                 other_mdr_cols.sort()
                 mdr_column_list.extend(other_mdr_cols)
-                
-                # Vectorized merge of MDR texts into main DataFrame
-                # Convert our parsed dictionary into a DataFrame directly
-                if mdr_text_columns:
-                    mdr_df = pd.DataFrame.from_dict(mdr_text_columns, orient='index')
-                    
-                    # Keep only the columns we successfully ordered
-                    available_cols = [col for col in mdr_column_list if col in mdr_df.columns]
-                    mdr_df = mdr_df[available_cols]
-                    
-                    # Fast vectorized left join on event_id
-                    main_fields_df = main_fields_df.merge(
-                        mdr_df,
-                        how='left',
-                        left_on=event_id_col,
-                        right_index=True
-                    )
-                    
-                    # Clean up NaNs created by the merge
-                    for col in available_cols:
-                        main_fields_df[col] = main_fields_df[col].fillna('')
-                else:
-                    # Fallback if there are no MDR texts at all
-                    for col in mdr_column_list:
-                        main_fields_df[col] = ''
-                
-                # Apply enhanced column naming for MDR text columns
-                column_mapping = {}
-                for col in main_fields_df.columns:
-                    if col in mdr_column_list:
-                        column_mapping[col] = enhanced_humanize(col)
-                
-                main_fields_df = main_fields_df.rename(columns=column_mapping)
-                
-                log_export_message(f"Writing Events sheet to Excel with integrated MDR texts ({len(main_fields_df):,} rows)...")
-                
+
+                # Only write Raw_Events sheet if requested
+                if include_raw_events:
+                    ws_raw = wb.create_sheet('Raw_Events')
+                    ws_raw.append(raw_columns)
+
                 ws_events = wb.create_sheet('Events')
-                main_fields_df_clean = main_fields_df.replace({np.nan: ''})
-                
+                header_names = event_names + [humanize_export_column(col) for col in mdr_column_list]
+
                 # Formatting objects
                 header_fill = PatternFill(start_color='1072BA', end_color='1072BA', fill_type='solid')
                 header_font = Font(bold=True, name='Calibri', size=12, color='FFFFFF')
                 header_align = Alignment(horizontal='center', vertical='center')
-                
+
                 # Write formatted header using WriteOnlyCell
                 header_row = []
-                for col_name in main_fields_df_clean.columns:
+                for col_name in header_names:
                     cell = WriteOnlyCell(ws_events, value=col_name)
                     cell.font = header_font
                     cell.fill = header_fill
                     cell.alignment = header_align
                     header_row.append(cell)
                 ws_events.append(header_row)
-                
+
                 # Freeze pane and configure dimensions for stream
                 ws_events.freeze_panes = 'B2'
                 ws_events.sheet_properties.tabColor = '1072BA'
-                
+
                 # Set column dimensions
-                for col_idx, col_name in enumerate(main_fields_df_clean.columns, start=1):
+                for col_idx, col_name in enumerate(header_names, start=1):
                     col_letter = openpyxl.utils.get_column_letter(col_idx)
                     col_name_lower = str(col_name).lower()
-                    
+
                     if any(w in col_name_lower for w in ['date', 'received']):
                         ws_events.column_dimensions[col_letter].width = 14
                     elif any(w in col_name_lower for w in ['link', 'url']):
@@ -1348,19 +4169,54 @@ def export_to_excel(include_raw_events=True):
                         ws_events.column_dimensions[col_letter].width = 16
                     else:
                         ws_events.column_dimensions[col_letter].width = 22
-                
-                # Very fast vectorized row streaming
-                for row in main_fields_df_clean.itertuples(index=False, name=None):
-                    ws_events.append(row)
-                
-                # Free huge memory variables
-                del main_fields_df
-                del main_fields_df_clean
-                if 'events_flat_df' in locals():
-                    del events_flat_df
-                import gc
+
+                log_export_message(f"Writing {'Raw_Events and ' if include_raw_events else ''}Events sheets to Excel "
+                                   f"with integrated MDR texts ({scan['rows']:,} rows)...")
+                print("Writing Events sheets to Excel...")
+                mdr_texts_query = '''
+                    SELECT event_id, text_type_code, text FROM result_mdr_texts
+                    WHERE event_id BETWEEN ? AND ? ORDER BY event_id, text_type_code
+                '''
+                # Dates are formatted once for both sheets and codes translated
+                # for the Events sheet, each distinct value converted once per export
+                format_dates = ValueTransform(format_export_dates)
+                date_columns = [col for col in raw_columns if is_export_date_column(col)]
+                code_transforms = {}
+                translations = []
+                for k, col in enumerate(event_names):
+                    mapping = fda_code_mapping(col)
+                    if mapping is not None:
+                        if id(mapping) not in code_transforms:
+                            code_transforms[id(mapping)] = fda_code_transform(mapping)
+                        translations.append((k, code_transforms[id(mapping)]))
+
+                written = 0
+                for events_flat_df in iter_flat_event_frames(conn, scan):
+                    events_flat_df = sanitize_df(events_flat_df)[raw_columns]
+                    for col in date_columns:
+                        events_flat_df[col] = format_dates(events_flat_df[col])
+                    if include_raw_events:
+                        for row in events_flat_df.replace({np.nan: ''}).itertuples(index=False, name=None):
+                            ws_raw.append(row)
+
+                    main_fields_df = events_flat_df.iloc[:, event_positions].set_axis(event_names, axis=1)
+                    # Apply FDA code translation for user-friendly display
+                    for k, translate in translations:
+                        main_fields_df.isetitem(k, translate(main_fields_df.iloc[:, k]))
+
+                    event_ids = events_flat_df['event_id'].tolist()
+                    mdr_text_columns = {event_id: mdr_text_row(texts) for event_id, texts
+                                        in iter_mdr_texts(mdr_texts_query, (event_ids[0], event_ids[-1]))}
+                    for event_id, row in zip(event_ids, main_fields_df.replace({np.nan: ''}).itertuples(index=False, name=None)):
+                        event_mdr_data = mdr_text_columns.get(event_id, {})
+                        ws_events.append(row + tuple('' if event_mdr_data.get(col) is None else event_mdr_data[col]
+                                                     for col in mdr_column_list))
+                    written += len(event_ids)
+                    log_export_message(f"Wrote {written:,} of {scan['rows']:,} records...")
+                    # Free this chunk before reading the next
+                    del events_flat_df, main_fields_df, mdr_text_columns
                 gc.collect()
-                
+
                 # Add Fields Reference sheet (fields.xlsx)
                 if os.path.exists(fields_path):
                     ws_fields = wb.create_sheet('Fields Reference')
@@ -1377,19 +4233,11 @@ def export_to_excel(include_raw_events=True):
             print(f"Error in export: {str(e)}")
             raise e
         
-        # Memory cleanup after all processing is complete
-        if 'events_flat_df' in locals():
-            del events_flat_df
-        if 'main_fields_df' in locals():
-            del main_fields_df
-        import gc
-        gc.collect()
-        
         log_export_message(f"Export completed: {filename}")
         print(f"Export completed: {filename}")
         return filename
 
-def export_summary_only():
+def export_summary_only(dataset=None):
     """
     Export only the Summary Statistics sheet as a lightweight Excel file.
     Much faster than the full optimized export — skips the massive Events sheet entirely.
@@ -1398,94 +4246,46 @@ def export_summary_only():
     import json
     import os
     import re
-    import gc
     from datetime import datetime
     
     log_export_message("Starting Summary Statistics export...")
     
-    # Field list for flattening events (same as export_to_excel)
-    field_list = [
-        'adverse_event_flag', 'product_problems', 'product_problem_flag', 'date_of_event', 'date_report', 'date_received',
-        'device_date_of_manufacturer', 'event_type', 'number_devices_in_event', 'number_patients_in_event', 'previous_use_code',
-        'remedial_action', 'removal_correction_number', 'report_number', 'single_use_flag', 'report_source_code',
-        'health_professional', 'reporter_occupation_code', 'initial_report_to_fda', 'reprocessed_and_reused_flag',
-        'device.device_event_key', 'device.date_received', 'device.brand_name',
-        'device.generic_name', 'device.device_report_product_code',
-        'device.model_number', 'device.catalog_number', 'device.lot_number', 'device.other_id_number',
-        'device.expiration_date_of_device', 'device.device_availability',
-        'device.device_evaluated_by_manufacturer', 'device.device_operator',
-        'device.implant_flag', 'device.date_removed_flag', 'device.manufacturer_d_name',
-        'device.manufacturer_d_country', 'device.device_class', 'device.device_name', 'device.fei_number',
-        'device.medical_specialty_description', 'device.registration_number',
-        'patient.date_received', 'patient.patient_age',
-        'patient.patient_sex', 'patient.patient_weight', 'patient.patient_ethnicity', 'patient.patient_race',
-        'patient.patient_problems', 'patient.sequence_number_outcome', 'patient.sequence_number_treatment',
-        'mdr_text.date_report', 'mdr_text.mdr_text_key', 'mdr_text.patient_sequence_number', 'mdr_text.text',
-        'mdr_text.text_type_code', 'type_of_report', 'date_facility_aware', 'report_date', 'report_to_fda',
-        'date_report_to_fda', 'report_to_manufacturer', 'date_report_to_manufacturer', 'event_location',
-        'manufacturer_name', 'manufacturer_address_1', 'manufacturer_address_2',
-        'manufacturer_city', 'manufacturer_country', 'manufacturer_gl_name',
-        'manufacturer_gl_country', 'date_manufacturer_received',
-        'source_type', 'event_key', 'mdr_report_key', 'device name', 'fei_number',
-        'medical_specialty_description', 'registration_number', 'regulation_number'
-    ]
-
     def extract_numeric(val):
         if pd.isnull(val):
             return None
         match = re.search(r'\d+(\.\d+)?', str(val))
         return float(match.group()) if match else None
 
-    def enhanced_humanize(col):
-        if not isinstance(col, str):
-            return col
-        field_mapping = {
-            'event_id': 'Event ID', 'report_number': 'Report Number',
-            'event_type': 'Event Type', 'report_source_code': 'Report Source Code',
-            'source_type': 'Source Type', 'reporter_occupation_code': 'Reporter Occupation Code',
-            'device_device_report_product_code': 'Product Code', 'device_model_number': 'Model Number',
-            'device_manufacturer_d_name': 'Manufacturer', 'device_manufacturer_d_country': 'Manufacturer Country',
-            'device_brand_name': 'Brand Name', 'device_generic_name': 'Product Class',
-            'patient_patient_problems': 'Patient Problem', 'product_problems': 'Device Problem',
-        }
-        if col in field_mapping:
-            return field_mapping[col]
-        return col.replace('_', ' ').replace('.', ' ').title()
-
-    with get_db_connection() as conn:
+    with get_results_connection(dataset) as conn:
         timestamp = datetime.now().strftime("%Y-%m-%d_%H%M")
         import tempfile
         temp_dir = tempfile.gettempdir()
         filename = os.path.join(temp_dir, f'MAUDEMetrics_Summary_{timestamp}.xlsx')
 
-        # Load and flatten events
+        # Load the events flattened at ingest
         log_export_message("Loading events for summary statistics...")
-        events_df = pd.read_sql_query('SELECT id, raw_json FROM events ORDER BY id', conn)
-        total_events = len(events_df)
+        total_events = conn.execute('SELECT COUNT(*) FROM result_events').fetchone()[0]
         if total_events == 0:
             raise Exception('No data to export. Please run a search first.')
 
-        log_export_message(f"Flattening {total_events:,} events...")
-        all_events_data = []
-        for _, row in events_df.iterrows():
-            if row['raw_json']:
-                try:
-                    event = json.loads(row['raw_json'])
-                    extracted = extract_event_fields(event, field_list, event_id=row['id'])
-                    all_events_data.append(extracted)
-                except Exception:
-                    pass
-
-        del events_df
-        gc.collect()
-
-        if not all_events_data:
+        # One streaming pass over the fields tallied below, sanitized for Excel
+        scan = scan_flat_columns(conn, skip_errors=True)
+        if not scan['rows']:
             raise Exception('No data to export. Please run a search first.')
-
-        events_flat_df = pd.DataFrame(all_events_data)
-        del all_events_data
-        gc.collect()
-        events_flat_df = sanitize_df(events_flat_df)
+        fields = flat_field_columns(scan['columns'])
+        event_fields = [
+            ('event_type', 'Event Type'), ('report_source_code', 'Report Source Code'),
+            ('source_type', 'Source Type'), ('reporter_occupation_code', 'Reporter Occupation Code'),
+            ('device_device_report_product_code', 'Product Code'), ('device_model_number', 'Model Number'),
+            ('device_manufacturer_d_name', 'Manufacturer'), ('device_manufacturer_d_country', 'Manufacturer Country'),
+            ('device_brand_name', 'Brand Name'), ('device_generic_name', 'Product Class')
+        ]
+        tallied = ['patient_patient_age', 'patient_patient_weight', 'patient_patient_sex',
+                   'patient_patient_ethnicity', 'patient_patient_race'] + [field for field, _ in event_fields]
+        values = {field: [] for field in tallied}
+        for event in iter_flat_field_values(conn, scan, tallied, skip_errors=True):
+            for field, field_values in event.items():
+                values[field].extend(sanitize_text(value) for value in field_values)
 
         log_export_message("Calculating summary statistics...")
 
@@ -1493,24 +4293,21 @@ def export_summary_only():
         summary_blocks = []
 
         # 1. Total Reports
-        summary_blocks.append(pd.DataFrame({'Summary': ['Total Reports'], 'Value': [len(events_flat_df)]}))
+        summary_blocks.append(pd.DataFrame({'Summary': ['Total Reports'], 'Value': [scan['rows']]}))
         summary_blocks.append(pd.DataFrame({'': ['']}))
 
         # 2. Patient Demographics
         demo_table = []
-        age_cols = [c for c in events_flat_df.columns if c.startswith('patient_patient_age')]
-        if age_cols:
-            ages = pd.Series([extract_numeric(v) for v in events_flat_df[age_cols].values.flatten()]).dropna()
+        if 'patient_patient_age' in fields:
+            ages = pd.Series([extract_numeric(v) for v in values['patient_patient_age']], dtype=float).dropna()
             age_val = f"{int(ages.median())} ({int(ages.min())}-{int(ages.max())})" if not ages.empty else "N/A"
             demo_table.append(["Age (years) median (range)", age_val, "", ""])
-        weight_cols = [c for c in events_flat_df.columns if c.startswith('patient_patient_weight')]
-        if weight_cols:
-            weights = pd.Series([extract_numeric(v) for v in events_flat_df[weight_cols].values.flatten()]).dropna()
+        if 'patient_patient_weight' in fields:
+            weights = pd.Series([extract_numeric(v) for v in values['patient_patient_weight']], dtype=float).dropna()
             weight_val = f"{weights.median():.1f} ({weights.min():.1f}-{weights.max():.1f})" if not weights.empty else "N/A"
             demo_table.append(["Weight median (range)", weight_val, "", ""])
         for label, prefix in [("Sex", "patient_patient_sex"), ("Ethnicity", "patient_patient_ethnicity"), ("Race", "patient_patient_race")]:
-            cols = [c for c in events_flat_df.columns if c.startswith(prefix)]
-            vals = pd.Series(events_flat_df[cols].values.flatten()).dropna()
+            vals = pd.Series(values[prefix], dtype=object)
             vals = vals[vals.astype(str).str.strip() != '']
             if not vals.empty:
                 first = True
@@ -1526,16 +4323,8 @@ def export_summary_only():
             summary_blocks.append(pd.DataFrame({'': ['']}))
 
         # 3. Event/Product Characteristics
-        event_fields = [
-            ('event_type', 'Event Type'), ('report_source_code', 'Report Source Code'),
-            ('source_type', 'Source Type'), ('reporter_occupation_code', 'Reporter Occupation Code'),
-            ('device_device_report_product_code', 'Product Code'), ('device_model_number', 'Model Number'),
-            ('device_manufacturer_d_name', 'Manufacturer'), ('device_manufacturer_d_country', 'Manufacturer Country'),
-            ('device_brand_name', 'Brand Name'), ('device_generic_name', 'Product Class')
-        ]
         for field, label in event_fields:
-            cols = [c for c in events_flat_df.columns if c.startswith(field)]
-            vals = pd.Series(events_flat_df[cols].values.flatten()).dropna()
+            vals = pd.Series(values[field], dtype=object)
             vals = vals[vals.astype(str).str.strip() != '']
             if not vals.empty:
                 counts = vals.value_counts()
@@ -1546,37 +4335,22 @@ def export_summary_only():
                 summary_blocks.append(event_df)
         summary_blocks.append(pd.DataFrame({'': ['']}))
 
-        # 4. Device Problem Table
-        prod_cols = [c for c in events_flat_df.columns if c.startswith('product_problems')]
-        prod_vals = pd.Series(events_flat_df[prod_cols].values.flatten()).dropna()
-        prod_vals = prod_vals[prod_vals.astype(str).str.strip() != '']
-        prod_counts = prod_vals.value_counts()
-        if not prod_counts.empty:
-            prod_df = pd.DataFrame({'Device Problem': prod_counts.index, 'Frequency': prod_counts.values})
-            prod_df['Percentage'] = prod_df['Frequency'].apply(lambda v: f"{100*v/len(prod_vals):.1f}%" if len(prod_vals) else '0%')
-            summary_blocks.append(prod_df)
-            summary_blocks.append(pd.DataFrame({'': ['']}))
-
-        # 5. Patient Problem Table
-        pprob_cols = [c for c in events_flat_df.columns if c.startswith('patient_patient_problems')]
-        pprob_vals = pd.Series(events_flat_df[pprob_cols].values.flatten()).dropna()
-        pprob_vals = pprob_vals[pprob_vals.astype(str).str.strip() != '']
-        pprob_counts = pprob_vals.value_counts()
-        if not pprob_counts.empty:
-            pprob_df = pd.DataFrame({'Patient Problem': pprob_counts.index, 'Frequency': pprob_counts.values})
-            pprob_df['Percentage'] = pprob_df['Frequency'].apply(lambda v: f"{100*v/len(pprob_vals):.1f}%" if len(pprob_vals) else '0%')
-            summary_blocks.append(pprob_df)
-            summary_blocks.append(pd.DataFrame({'': ['']}))
+        # 4. Device Problem Table and 5. Patient Problem Table, counted in the database
+        for table, label in [('event_product_problems', 'Device Problem'), ('patient_problems', 'Patient Problem')]:
+            counts = pd.DataFrame(count_values(conn, table), columns=[label, 'Frequency'])
+            if not counts.empty:
+                total = counts['Frequency'].sum()
+                counts['Percentage'] = counts['Frequency'].apply(lambda v: f"{100*v/total:.1f}%")
+                summary_blocks.append(counts)
+                summary_blocks.append(pd.DataFrame({'': ['']}))
 
-        # Free the big DataFrame
-        del events_flat_df
-        gc.collect()
+        del values
 
         # 6. Events Missing Patient Data
         missing_patients = pd.read_sql_query('''
             SELECT e.id as event_id, e.report_number
-            FROM events e
-            LEFT JOIN patients p ON e.id = p.event_id
+            FROM result_events e
+            LEFT JOIN result_patients p ON e.id = p.event_id
             WHERE p.id IS NULL
         ''', conn)
         if not missing_patients.empty:
@@ -1592,7 +4366,7 @@ def export_summary_only():
                 startrow = 0
                 table_starts = []
                 for block in summary_blocks:
-                    block.columns = [enhanced_humanize(c) for c in block.columns]
+                    block.columns = [humanize_export_column(c) for c in block.columns]
                     table_starts.append(startrow)
                     block.to_excel(writer, sheet_name='Summary', index=False, startrow=startrow, header=True)
                     startrow += len(block) + 2
@@ -1711,7 +4485,7 @@ def export_summary_only():
         print(f"Summary export completed: {filename}")
         return filename
 
-def export_raw_events_only():
+def export_raw_events_only(dataset=None):
     """
     Export raw data in original API structure - 5 separate CSV files in a ZIP archive.
     Maintains the original JSON structure without any flattening or processing.
@@ -1732,12 +4506,12 @@ def export_raw_events_only():
     base_filename = os.path.join(temp_dir, f'MAUDEMetrics_RawData_{timestamp}')
     zip_filename = f'{base_filename}.zip'
     
-    with get_db_connection() as conn:
+    with get_results_connection(dataset) as conn:
         # Get total counts for progress tracking
-        total_events = conn.execute('SELECT COUNT(*) as count FROM events').fetchone()['count']
-        total_devices = conn.execute('SELECT COUNT(*) as count FROM devices').fetchone()['count']
-        total_patients = conn.execute('SELECT COUNT(*) as count FROM patients').fetchone()['count']
-        total_mdr_texts = conn.execute('SELECT COUNT(*) as count FROM mdr_texts').fetchone()['count']
+        total_events = conn.execute('SELECT COUNT(*) as count FROM result_events').fetchone()['count']
+        total_devices = conn.execute('SELECT COUNT(*) as count FROM result_devices').fetchone()['count']
+        total_patients = conn.execute('SELECT COUNT(*) as count FROM result_patients').fetchone()['count']
+        total_mdr_texts = conn.execute('SELECT COUNT(*) as count FROM result_mdr_texts').fetchone()['count']
         
         if total_events == 0:
             raise Exception("No data found in database. Please run a search first.")
@@ -1751,7 +4525,7 @@ def export_raw_events_only():
             # 1. Export Events table (main event data)
             log_export_message("Exporting Events table...")
             print("Exporting Events table...")
-            events_df = pd.read_sql_query('SELECT * FROM events ORDER BY id', conn)
+            events_df = _decode_payload_columns(pd.read_sql_query('SELECT * FROM result_events ORDER BY id', conn), ['raw_json'])
             
             # Write to temporary CSV and add to ZIP
             events_csv = f'{base_filename}_Events.csv'
@@ -1763,7 +4537,8 @@ def export_raw_events_only():
             # 2. Export Devices table
             log_export_message("Exporting Devices table...")
             print("Exporting Devices table...")
-            devices_df = pd.read_sql_query('SELECT * FROM devices ORDER BY event_id, id', conn)
+            devices_df = _decode_payload_columns(pd.read_sql_query('SELECT * FROM result_devices ORDER BY event_id, id', conn),
+                                                 ['raw_device_json'])
             
             devices_csv = f'{base_filename}_Devices.csv'
             devices_df.to_csv(devices_csv, index=False, encoding='utf-8')
@@ -1774,7 +4549,8 @@ def export_raw_events_only():
             # 3. Export Patients table
             log_export_message("Exporting Patients table...")
             print("Exporting Patients table...")
-            patients_df = pd.read_sql_query('SELECT * FROM patients ORDER BY event_id, id', conn)
+            patients_df = _decode_payload_columns(pd.read_sql_query('SELECT * FROM result_patients ORDER BY event_id, id', conn),
+                                                  ['raw_patient_json'])
             
             patients_csv = f'{base_filename}_Patients.csv'
             patients_df.to_csv(patients_csv, index=False, encoding='utf-8')
@@ -1785,7 +4561,7 @@ def export_raw_events_only():
             # 4. Export MDR Texts table
             log_export_message("Exporting MDR Texts table...")
             print("Exporting MDR Texts table...")
-            mdr_texts_df = pd.read_sql_query('SELECT * FROM mdr_texts ORDER BY event_id, id', conn)
+            mdr_texts_df = pd.read_sql_query('SELECT * FROM result_mdr_texts ORDER BY event_id, id', conn)
             
             mdr_texts_csv = f'{base_filename}_MDRTexts.csv'
             mdr_texts_df.to_csv(mdr_texts_csv, index=False, encoding='utf-8')
@@ -1796,7 +4572,8 @@ def export_raw_events_only():
             # 5. Export Raw JSON data (original API responses)
             log_export_message("Exporting Raw JSON data...")
             print("Exporting Raw JSON data...")
-            raw_json_df = pd.read_sql_query('SELECT id, report_number, raw_json FROM events WHERE raw_json IS NOT NULL ORDER BY id', conn)
+            raw_json_df = _decode_payload_columns(pd.read_sql_query(
+                'SELECT id, report_number, raw_json FROM result_events WHERE raw_json IS NOT NULL ORDER BY id', conn), ['raw_json'])
             
             raw_json_csv = f'{base_filename}_RawJSON.csv'
             raw_json_df.to_csv(raw_json_csv, index=False, encoding='utf-8')
@@ -1951,9 +4728,10 @@ def build_search_query(product_code='', brand_name='', device_generic_name='',
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
-    with get_db_connection() as conn:
-        total_events = conn.execute('SELECT COUNT(*) as count FROM events').fetchone()['count']
+    with get_results_connection() as conn:
+        total_events = conn.execute('SELECT COUNT(*) as count FROM result_events').fetchone()['count']
         is_fresh_start = (total_events == 0)
+        resumable_extraction = get_resumable_extraction(conn)
     if request.method == 'POST':
         product_code = request.form.get('product_code', '')
         brand_name = request.form.get('brand_name', '')
@@ -1963,6 +4741,7 @@ def index():
         max_records = request.form.get('max_records', '')
         manufacturer = request.form.get('manufacturer', '')
         api_key_input = request.form.get('api_key', '').strip()
+        dataset = request.form.get('dataset', '').strip() or DEFAULT_DATASET
 
         base_query = build_search_query(
             product_code=product_code, brand_name=brand_name,
@@ -1980,7 +4759,7 @@ def index():
         # Fetch the first page to get the total count
         preview_query = _api_url(base_query, api_key=api_key_input, limit=1)
         try:
-            preview_response = requests.get(preview_query, timeout=30)
+            preview_response = rate_limited_get(preview_query, timeout=30)
             total_count = 0
             if preview_response.status_code == 200:
                 preview_data = preview_response.json()
@@ -1994,36 +4773,56 @@ def index():
             return render_template('index.html', error=f"Network error connecting to FDA API: {str(e)}", is_fresh_start=is_fresh_start)
         
         session['total_count'] = total_count
+        session['dataset'] = dataset
         
-        try:
-            data = fetch_all_API_data(base_query, max_records_int, api_key=api_key_input)
-        except Exception as e:
-            print(f"Exception during data fetch: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            return render_template('index.html', error=f"Error during data extraction: {str(e)}", is_fresh_start=is_fresh_start)
-        
-        if data:
-            print(f"Saving {len(data)} records to database...")
-            save_comprehensive_data(data)
-            return redirect(url_for('results'))
-        else:
-            return render_template('index.html', error=f"No results retrieved from FDA API. Found {total_count:,} records in the database but failed to download them. Check your terminal console for detailed error logs.", is_fresh_start=is_fresh_start)
-    return render_template('index.html', is_fresh_start=is_fresh_start)
+        # The extraction runs as a background job; the page follows it via /api/jobs/<id>
+        job = submit_job('extract', base_query=base_query, max_records=max_records_int, api_key=api_key_input,
+                         dataset=dataset)
+        return redirect(url_for('index', job=job.id))
+    job = get_job(request.args.get('job', ''))
+    return render_template('index.html', is_fresh_start=is_fresh_start, resumable_extraction=resumable_extraction,
+                           job=job.to_dict() if job else None)
+
+@app.route('/resume', methods=['POST'])
+def resume():
+    """Continue the last interrupted extraction from its saved checkpoint."""
+    api_key_input = request.form.get('api_key', '').strip()
+    with db_reader() as conn:
+        extraction = get_resumable_extraction(conn)
+    if extraction is not None:
+        session['total_count'] = extraction['total_count']
+    job = submit_job('resume', api_key=api_key_input)
+    return redirect(url_for('index', job=job.id))
+
+@app.route('/refresh', methods=['POST'])
+def refresh():
+    """Update a stored dataset with reports added or changed since it was fetched."""
+    api_key_input = request.form.get('api_key', '').strip()
+    job = submit_job('refresh', api_key=api_key_input, dataset=request.form.get('dataset') or _requested_dataset())
+    return redirect(url_for('index', job=job.id))
+
+def _requested_dataset():
+    """Dataset picked with ?dataset= (remembered in the session), or None for the latest."""
+    if 'dataset' in request.args:
+        session['dataset'] = request.args['dataset'] or None
+    return session.get('dataset')
 
 @app.route('/results')
 def results():
-    with get_db_connection() as conn:
-        total_events = conn.execute('SELECT COUNT(*) as count FROM events').fetchone()['count']
-        total_devices = conn.execute('SELECT COUNT(*) as count FROM devices').fetchone()['count']
-        total_patients = conn.execute('SELECT COUNT(*) as count FROM patients').fetchone()['count']
+    dataset = _requested_dataset()
+    with get_results_connection(dataset) as conn:
+        datasets = list_datasets(conn)
+        current_dataset = get_dataset(conn, dataset) or get_dataset(conn)
+        total_events = conn.execute('SELECT COUNT(*) as count FROM result_events').fetchone()['count']
+        total_devices = conn.execute('SELECT COUNT(*) as count FROM result_devices').fetchone()['count']
+        total_patients = conn.execute('SELECT COUNT(*) as count FROM result_patients').fetchone()['count']
         is_fresh_start = (total_events == 0)
         # Get recent events
         recent_events = conn.execute('''
             SELECT e.report_number, e.event_type, e.date_received, d.manufacturer_d_name,
                    d.brand_name, d.generic_name
-            FROM events e
-            LEFT JOIN devices d ON e.id = d.event_id
+            FROM result_events e
+            LEFT JOIN result_devices d ON e.id = d.event_id
             ORDER BY e.date_added DESC
             LIMIT 50
         ''').fetchall()
@@ -2047,29 +4846,31 @@ def results():
                          total_patients=total_patients,
                          recent_events=formatted_events,
                          total_count=total_count,
-                         is_fresh_start=is_fresh_start)
+                         is_fresh_start=is_fresh_start,
+                         datasets=datasets,
+                         current_dataset=current_dataset['name'] if current_dataset else None)
 
 @app.route('/export')
 def export_data():
     try:
-        filename = export_to_excel(include_raw_events=False)
-        return send_file(filename, as_attachment=True, download_name=os.path.basename(filename), mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        filename, download_name = cached_export(export_to_excel, include_raw_events=False, dataset=_requested_dataset())
+        return send_file(filename, as_attachment=True, download_name=download_name, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
     except Exception as e:
         return f"Error exporting data: {str(e)}", 500
 
 @app.route('/export/raw')
 def export_raw_events():
     try:
-        filename = export_raw_events_only()
-        return send_file(filename, as_attachment=True, download_name=os.path.basename(filename), mimetype='application/zip')
+        filename, download_name = cached_export(export_raw_events_only, dataset=_requested_dataset())
+        return send_file(filename, as_attachment=True, download_name=download_name, mimetype='application/zip')
     except Exception as e:
         return f"Error exporting raw events: {str(e)}", 500
 
 @app.route('/export/summary')
 def export_summary():
     try:
-        filename = export_summary_only()
-        return send_file(filename, as_attachment=True, download_name=os.path.basename(filename), mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+        filename, download_name = cached_export(export_summary_only, dataset=_requested_dataset())
+        return send_file(filename, as_attachment=True, download_name=download_name, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
     except Exception as e:
         return f"Error exporting summary: {str(e)}", 500
 
@@ -2077,97 +4878,13 @@ def export_summary():
 def analytics():
     import pandas as pd
     import json
-    with get_db_connection() as conn:
-        total_events = conn.execute('SELECT COUNT(*) as count FROM events').fetchone()['count']
+    with get_results_connection(_requested_dataset()) as conn:
+        total_events = conn.execute('SELECT COUNT(*) as count FROM result_events').fetchone()['count']
         is_fresh_start = (total_events == 0)
-        # Load all raw_json from events
-        events_df = pd.read_sql_query('SELECT id, raw_json FROM events', conn)
-        all_events_data = []
-        # Use the same field list as export_to_excel
-        field_list = [
-            'adverse_event_flag', 'product_problems', 'product_problem_flag', 'date_of_event', 'date_report', 'date_received',
-            'device_date_of_manufacturer', 'event_type', 'number_devices_in_event', 'number_patients_in_event', 'previous_use_code',
-            'remedial_action', 'removal_correction_number', 'report_number', 'single_use_flag', 'report_source_code',
-            'health_professional', 'reporter_occupation_code', 'initial_report_to_fda', 'reprocessed_and_reused_flag',
-            'device.device_sequence_number', 'device.device_event_key', 'device.date_received', 'device.brand_name',
-            'device.generic_name', 'device.udi_di', 'device.udi_public', 'device.device_report_product_code',
-            'device.model_number', 'device.catalog_number', 'device.lot_number', 'device.other_id_number',
-            'device.expiration_date_of_device', 'device.device_age_text', 'device.device_availability',
-            'device.date_returned_to_manufacturer', 'device.device_evaluated_by_manufacturer', 'device.device_operator',
-            'device.implant_flag', 'device.date_removed_flag', 'device.manufacturer_d_name', 'device.manufacturer_d_address_1',
-            'device.manufacturer_d_address_2', 'device.manufacturer_d_city', 'device.manufacturer_d_state',
-                    'device.manufacturer_d_zip_code', 'device.manufacturer_d_zip_code_ext', 'device.manufacturer_d_postal_code',
-        'device.manufacturer_d_country', 'device.device_class', 'device.device_name', 'device.fei_number', 'device.medical_specialty_description', 'device.registration_number', 'patient.date_received', 'patient.patient_sequence_number', 'patient.patient_age',
-        'patient.patient_sex', 'patient.patient_weight', 'patient.patient_ethnicity', 'patient.patient_race',
-        'patient.patient_problems', 'patient.sequence_number_outcome', 'patient.sequence_number_treatment',
-        'mdr_text.date_report', 'mdr_text.mdr_text_key', 'mdr_text.patient_sequence_number', 'mdr_text.text',
-        'mdr_text.text_type_code', 'type_of_report', 'date_facility_aware', 'report_date', 'report_to_fda',
-        'date_report_to_fda', 'report_to_manufacturer', 'date_report_to_manufacturer', 'event_location', 'distributor_name',
-        'distributor_address_1', 'distributor_address_2', 'distributor_city', 'distributor_state', 'distributor_zip_code',
-        'distributor_zip_code_ext', 'manufacturer_name', 'manufacturer_address_1', 'manufacturer_address_2',
-        'manufacturer_city', 'manufacturer_postal_code', 'manufacturer_state', 'manufacturer_zip_code',
-        'manufacturer_zip_code_ext', 'manufacturer_country', 'manufacturer_contact_address_1',
-        'manufacturer_contact_address_2', 'manufacturer_contact_area_code', 'manufacturer_contact_city',
-        'manufacturer_contact_country', 'manufacturer_contact_exchange', 'manufacturer_contact_extension',
-        'manufacturer_contact_t_name', 'manufacturer_contact_f_name', 'manufacturer_contact_l_name',
-        'manufacturer_contact_pcity', 'manufacturer_contact_pcountry', 'manufacturer_contact_phone_number',
-        'manufacturer_contact_plocal', 'manufacturer_contact_postal_code', 'manufacturer_contact_state',
-        'manufacturer_contact_zip_code', 'manufacturer_contact_zip_ext', 'manufacturer_gl_name', 'manufacturer_gl_city',
-        'manufacturer_gl_country', 'manufacturer_gl_postal_code', 'manufacturer_gl_state', 'manufacturer_gl_address_1',
-        'manufacturer_gl_address_2', 'manufacturer_gl_zip_code', 'manufacturer_gl_zip_code_ext', 'date_manufacturer_received',
-        'source_type', 'event_key', 'mdr_report_key', 'manufacturer_link_flag', 'device name', 'fei_number',
-        'medical_specialty_description', 'registration_number', 'regulation_number'
-        ]
-        def extract_event_fields(event, field_list, event_id=None):
-            result = {}
-            if event_id is not None:
-                result['event_id'] = event_id
-            # Top-level fields
-            for field in field_list:
-                if '.' not in field and not field.startswith('device') and not field.startswith('patient') and not field.startswith('mdr_text'):
-                    value = event.get(field, '')
-                    if isinstance(value, list):
-                        result[field] = ''
-                        for i, v in enumerate(value):
-                            result[f'{field}_{i+1}'] = v
-                    else:
-                        result[field] = value
-            # Device fields
-            devices = event.get('device', [])
-            for i, device in enumerate(devices):
-                for field in field_list:
-                    if field.startswith('device.'):
-                        subfield = field.split('.', 1)[1]
-                        value = device.get(subfield, '')
-                        if isinstance(value, list):
-                            result[f'device_{subfield}_{i+1}'] = ''
-                            for j, v in enumerate(value):
-                                result[f'device_{subfield}_{i+1}_{j+1}'] = v
-                        else:
-                            result[f'device_{subfield}_{i+1}'] = value
-            # Patient fields
-            patients = event.get('patient', [])
-            for i, patient in enumerate(patients):
-                for field in field_list:
-                    if field.startswith('patient.'):
-                        subfield = field.split('.', 1)[1]
-                        value = patient.get(subfield, '')
-                        if isinstance(value, list):
-                            result[f'patient_{subfield}_{i+1}'] = ''
-                            for j, v in enumerate(value):
-                                result[f'patient_{subfield}_{i+1}_{j+1}'] = v
-                        else:
-                            result[f'patient_{subfield}_{i+1}'] = value
-            return result
-        for _, row in events_df.iterrows():
-            if row['raw_json']:
-                try:
-                    event = json.loads(row['raw_json'])
-                    extracted = extract_event_fields(event, field_list, event_id=row['id'])
-                    all_events_data.append(extracted)
-                except Exception as e:
-                    all_events_data.append({'event_id': row['id'], 'error': str(e)})
-        if not all_events_data:
+        # Events flattened at ingest, so no raw_json is parsed here; the
+        # tallied fields are read in one streaming pass
+        scan = scan_flat_columns(conn)
+        if not scan['rows']:
             # fallback: show page with no data
             return render_template('analytics.html',
                 total_reports=0,
@@ -2184,8 +4901,21 @@ def analytics():
                 product_problems_table=[],
                 patient_problems_table=[],
                 missing_patients=[])
-        df = pd.DataFrame(all_events_data)
-        total_reports = len(df)
+        total_reports = scan['rows']
+        tallied = ['patient_patient_age', 'patient_patient_weight', 'patient_patient_sex', 'patient_patient_ethnicity',
+                   'patient_patient_race', 'event_type', 'report_source_code', 'source_type', 'reporter_occupation_code',
+                   'device_device_report_product_code', 'device_model_number', 'device_manufacturer_d_name',
+                   'device_manufacturer_d_country', 'device_brand_name', 'device_generic_name']
+        values = {field: [] for field in tallied}
+        brand_eventtype_pairs = []
+        for event in iter_flat_field_values(conn, scan, tallied):
+            for field, field_values in event.items():
+                values[field].extend(field_values)
+            brands = [v for v in event['device_brand_name'] if str(v).strip()]
+            event_types = [v for v in event['event_type'] if str(v).strip()]
+            for b in brands:
+                for e in event_types:
+                    brand_eventtype_pairs.append((b, e))
         # Patient Demographics
         def extract_numeric(val):
             import re
@@ -2196,83 +4926,64 @@ def analytics():
 
         demo_table = []
         # Age
-        age_cols = [c for c in df.columns if c.startswith('patient_patient_age')]
-        ages = pd.Series([extract_numeric(v) for v in df[age_cols].values.flatten()]).dropna()
+        ages = pd.Series([extract_numeric(v) for v in values['patient_patient_age']], dtype=float).dropna()
         age_val = f"{int(ages.median())} ({int(ages.min())}-{int(ages.max())})" if not ages.empty else "N/A"
         demo_table.append({"characteristic": "Age (years) median (range)", "value": age_val, "frequency": "", "percentage": ""})
         # Weight
-        weight_cols = [c for c in df.columns if c.startswith('patient_patient_weight')]
-        weights = pd.Series([extract_numeric(v) for v in df[weight_cols].values.flatten()]).dropna()
+        weights = pd.Series([extract_numeric(v) for v in values['patient_patient_weight']], dtype=float).dropna()
         weight_val = f"{weights.median():.1f} ({weights.min():.1f}-{weights.max():.1f})" if not weights.empty else "N/A"
         demo_table.append({"characteristic": "Weight median (range)", "value": weight_val, "frequency": "", "percentage": ""})
         # Sex
-        sex_cols = [c for c in df.columns if c.startswith('patient_patient_sex')]
-        sex_vals = pd.Series(df[sex_cols].values.flatten()).dropna()
+        sex_vals = pd.Series(values['patient_patient_sex'], dtype=object)
         for i, (k, v) in enumerate(sex_vals.value_counts().items()):
             demo_table.append({
                 "characteristic": "Sex" if i == 0 else "", "value": k, "frequency": v, "percentage": f"{100*v/len(sex_vals):.1f}%"})
         # Ethnicity
-        eth_cols = [c for c in df.columns if c.startswith('patient_patient_ethnicity')]
-        eth_vals = pd.Series(df[eth_cols].values.flatten()).dropna()
+        eth_vals = pd.Series(values['patient_patient_ethnicity'], dtype=object)
         for i, (k, v) in enumerate(eth_vals.value_counts().items()):
             demo_table.append({
                 "characteristic": "Ethnicity" if i == 0 else "", "value": k, "frequency": v, "percentage": f"{100*v/len(eth_vals):.1f}%"})
         # Race
-        race_cols = [c for c in df.columns if c.startswith('patient_patient_race')]
-        race_vals = pd.Series(df[race_cols].values.flatten()).dropna()
+        race_vals = pd.Series(values['patient_patient_race'], dtype=object)
         for i, (k, v) in enumerate(race_vals.value_counts().items()):
             demo_table.append({
                 "characteristic": "Race" if i == 0 else "", "value": k, "frequency": v, "percentage": f"{100*v/len(race_vals):.1f}%"})
         patient_demographics = demo_table
         # Helper for event/product tables
-        def make_table(df, prefix, label):
-            cols = [c for c in df.columns if c.startswith(prefix)]
-            vals = pd.Series(df[cols].values.flatten()).dropna()
+        def make_table(values, prefix, label):
+            vals = pd.Series(values[prefix], dtype=object)
             total = len(vals)
             counts = vals.value_counts()
             return [{"label": k, "count": v, "percent": f"{100*v/total:.1f}%"} for k, v in counts.items()] if total > 0 else []
         # Event/Product Characteristics
-        event_type_table = make_table(df, 'event_type', 'Event Type')
-        report_source_table = make_table(df, 'report_source_code', 'Report Source')
-        source_type_table = make_table(df, 'source_type', 'Source Type')
-        occupation_table = make_table(df, 'reporter_occupation_code', 'Reporter Occupation Code')
-        product_code_table = make_table(df, 'device_device_report_product_code', 'Product Code')
-        model_number_table = make_table(df, 'device_model_number', 'Model Number')
-        manufacturer_table = make_table(df, 'device_manufacturer_d_name', 'Manufacturer')
-        manufacturer_country_table = make_table(df, 'device_manufacturer_d_country', 'Manufacturer Country')
-        brand_name_table = make_table(df, 'device_brand_name', 'Brand Name')
+        event_type_table = make_table(values, 'event_type', 'Event Type')
+        report_source_table = make_table(values, 'report_source_code', 'Report Source')
+        source_type_table = make_table(values, 'source_type', 'Source Type')
+        occupation_table = make_table(values, 'reporter_occupation_code', 'Reporter Occupation Code')
+        product_code_table = make_table(values, 'device_device_report_product_code', 'Product Code')
+        model_number_table = make_table(values, 'device_model_number', 'Model Number')
+        manufacturer_table = make_table(values, 'device_manufacturer_d_name', 'Manufacturer')
+        manufacturer_country_table = make_table(values, 'device_manufacturer_d_country', 'Manufacturer Country')
+        brand_name_table = make_table(values, 'device_brand_name', 'Brand Name')
         # Type of Device (Generic Name)
-        generic_name_table = make_table(df, 'device_generic_name', 'Product Class')
-        # Device Problem
-        prod_cols = [c for c in df.columns if c.startswith('product_problems')]
-        prod_vals = pd.Series(df[prod_cols].values.flatten()).dropna()
-        total_prod = len(prod_vals)
-        prod_counts = prod_vals.value_counts()
-        product_problems_table = [{"label": k, "count": v, "percent": f"{100*v/total_prod:.1f}%"} for k, v in prod_counts.items()] if total_prod > 0 else []
-        # Patient Problem
-        pprob_cols = [c for c in df.columns if c.startswith('patient_patient_problems')]
-        pprob_vals = pd.Series(df[pprob_cols].values.flatten()).dropna()
-        total_pprob = len(pprob_vals)
-        pprob_counts = pprob_vals.value_counts()
-        patient_problems_table = [{"label": k, "count": v, "percent": f"{100*v/total_pprob:.1f}%"} for k, v in pprob_counts.items()] if total_pprob > 0 else []
+        generic_name_table = make_table(values, 'device_generic_name', 'Product Class')
+        # Device Problem and Patient Problem, counted in the database
+        def value_table(table):
+            counts = count_values(conn, table)
+            total = sum(row['count'] for row in counts)
+            return [{"label": row['value'], "count": row['count'], "percent": f"{100*row['count']/total:.1f}%"} for row in counts]
+        product_problems_table = value_table('event_product_problems')
+        patient_problems_table = value_table('patient_problems')
         # Events missing patient data (as before)
         missing_patients = conn.execute('''
             SELECT e.id as event_id, e.report_number
-            FROM events e
-            LEFT JOIN patients p ON e.id = p.event_id
+            FROM result_events e
+            LEFT JOIN result_patients p ON e.id = p.event_id
             WHERE p.id IS NULL
         ''').fetchall()
         # --- Dynamic Chart Data Preparation ---
         # 1. Event Types per Brand Name (top 10 brands)
-        brand_cols = [c for c in df.columns if c.startswith('device_brand_name')]
-        eventtype_cols = [c for c in df.columns if c.startswith('event_type')]
-        brand_eventtype_pairs = []
-        for i in range(len(df)):
-            brands = [df.iloc[i][col] for col in brand_cols if pd.notnull(df.iloc[i][col]) and str(df.iloc[i][col]).strip()]
-            event_types = [df.iloc[i][col] for col in eventtype_cols if pd.notnull(df.iloc[i][col]) and str(df.iloc[i][col]).strip()]
-            for b in brands:
-                for e in event_types:
-                    brand_eventtype_pairs.append((b, e))
+        # (brand, event type) pairs were collected per event above
         import collections
         brand_counts = collections.Counter([b for b, _ in brand_eventtype_pairs])
         top_brands = [b for b, _ in brand_counts.most_common(10)]
@@ -2315,12 +5026,24 @@ def about():
 
 @app.route('/clear_data', methods=['POST'])
 def clear_data():
+    # Running jobs keep writing to the tables between batches
+    if any(job.state == 'running' for job in list_jobs()):
+        return "A job is writing to the database; try again once it finishes", 409
     # Clear all database tables
-    with get_db_connection() as conn:
+    with db_writer() as conn:
+        _drop_narrative_index(conn)
         conn.execute('DELETE FROM mdr_texts')
+        for table in MULTI_VALUE_TABLES:
+            conn.execute(f'DELETE FROM {table}')
         conn.execute('DELETE FROM patients')
         conn.execute('DELETE FROM devices')
         conn.execute('DELETE FROM events')
+        conn.execute('DELETE FROM extraction_cursors')
+        conn.execute('DELETE FROM extractions')
+        conn.execute('DELETE FROM extraction_reports')
+        conn.execute('DELETE FROM datasets')
+        _reset_flat_events(conn)
+        create_managed_indexes(conn, analyze=False)
         conn.commit()
     
     # Clear all message queues (logs) for real-time console reset
@@ -2365,6 +5088,149 @@ def stream_export():
     
     return Response(generate(), mimetype='text/event-stream')
 
+@app.route('/api/jobs', methods=['GET', 'POST'])
+def jobs_collection():
+    """List jobs, or submit one.
+
+    POST takes JSON with "kind" ("extract", "resume", "refresh" or "ingest";
+    default "extract"), optional "api_key" and, for extractions, the search
+    form fields plus "max_records". Ingest jobs load the bulk zips found in
+    "directory" with the same filters. Extract, ingest and refresh jobs take
+    an optional "dataset" name. Returns 202 with the queued job.
+    """
+    if request.method == 'GET':
+        return jsonify({'jobs': [job.to_dict() for job in list_jobs()]})
+    payload = request.get_json(silent=True) or request.form.to_dict()
+    kind = payload.get('kind', 'extract')
+    api_key_input = (payload.get('api_key') or '').strip()
+    dataset = (payload.get('dataset') or '').strip() or None
+    if kind in ('extract', 'ingest'):
+        filters = {field: payload.get(field, '') for field in (
+            'product_code', 'brand_name', 'device_generic_name', 'start_date', 'end_date', 'manufacturer')}
+        try:
+            max_records = int(payload['max_records']) if payload.get('max_records') else None
+        except (TypeError, ValueError):
+            return jsonify({'error': 'max_records must be an integer'}), 400
+        if kind == 'extract':
+            job = submit_job('extract', base_query=build_search_query(**filters), max_records=max_records,
+                             api_key=api_key_input, dataset=dataset or DEFAULT_DATASET)
+        elif not payload.get('directory') or not os.path.isdir(payload['directory']):
+            return jsonify({'error': 'directory must name a folder of openFDA bulk zip files'}), 400
+        else:
+            job = submit_job('ingest', directory=payload['directory'], max_records=max_records,
+                             dataset=dataset or DEFAULT_DATASET, **filters)
+    elif kind == 'refresh':
+        job = submit_job(kind, api_key=api_key_input, dataset=dataset)
+    elif kind == 'resume':
+        job = submit_job(kind, api_key=api_key_input)
+    else:
+        return jsonify({'error': f'Unknown job kind: {kind}'}), 400
+    return jsonify(job.to_dict()), 202, {'Location': url_for('job_status', job_id=job.id)}
+
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    """State and progress counters of a job."""
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Ask a queued or running job to stop; a cancelled extraction can be resumed."""
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    if job.finished:
+        return jsonify({'error': f'Job already {job.state}', 'job': job.to_dict()}), 409
+    job.cancel.set()
+    log_extraction_message("Cancellation requested; stopping after the current page...")
+    return jsonify(job.to_dict()), 202
+
+@app.route('/api/jobs/<job_id>/results')
+def job_results(job_id):
+    """Summary of the dataset produced by a completed job."""
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    if job.state != 'completed':
+        return jsonify({'error': f'Job is {job.state}', 'job': job.to_dict()}), 409
+    with get_results_connection(job.params.get('dataset')) as conn:
+        counts = {table: conn.execute(f'SELECT COUNT(*) FROM result_{table}').fetchone()[0]
+                  for table in RESULT_TABLES}
+    return jsonify({'job': job.to_dict(), 'records_written': job.records_written,
+                    'counts': counts, 'results_url': url_for('results', dataset=job.params.get('dataset'))})
+
+@app.route('/api/datasets')
+def datasets_collection():
+    """Stored datasets with their current query, status and row counts."""
+    with db_reader() as conn:
+        rows = list_datasets(conn)
+    return jsonify({'datasets': [dict(row) for row in rows]})
+
+def _drop_dataset_unless_busy(name):
+    # Jobs hold their datasets' locks for their whole run; don't wait behind one
+    lock = _dataset_lock(name)
+    if not lock.acquire(blocking=False):
+        return None
+    try:
+        return drop_dataset(name)
+    finally:
+        lock.release()
+
+@app.route('/api/datasets/<name>', methods=['DELETE'])
+def delete_dataset(name):
+    """Drop a dataset without touching the others; 409 while a job is writing."""
+    dropped = _drop_dataset_unless_busy(name)
+    if dropped is None:
+        return jsonify({'error': 'A job is writing to the database; try again once it finishes'}), 409
+    if not dropped:
+        return jsonify({'error': 'Unknown dataset'}), 404
+    return '', 204
+
+@app.route('/datasets/<name>/drop', methods=['POST'])
+def drop_dataset_form(name):
+    """Drop a dataset from the results page and show the latest remaining one."""
+    if _drop_dataset_unless_busy(name) is None:
+        return "A job is writing to the database; try again once it finishes", 409
+    if session.get('dataset') == name:
+        session['dataset'] = None
+    return redirect(url_for('results'))
+
+@app.route('/api/search/narratives')
+def narrative_search():
+    """Full-text search over a dataset's MDR narratives.
+
+    Takes q (FTS5 syntax: "phrase", prefix*, AND / OR / NOT), an optional
+    dataset (default: the latest), limit (default 20, at most 100) and
+    cursor, the next_cursor of the previous page. Returns hits best first,
+    each linked to its event and MAUDE report; next_cursor is null on the
+    last page.
+    """
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'q is required'}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    after = None
+    if request.args.get('cursor'):
+        try:
+            rank, text_id = request.args['cursor'].rsplit(':', 1)
+            after = (float(rank), int(text_id))
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+    with get_results_connection(request.args.get('dataset')) as conn:
+        if not has_narrative_index(conn):
+            return jsonify({'error': 'The narrative index is being rebuilt; try again once the load finishes'}), 503
+        try:
+            hits = search_narratives(conn, query, limit, after)
+        except sqlite3.OperationalError as e:
+            return jsonify({'error': f'Invalid search query: {e}'}), 400
+    next_cursor = f"{hits[-1]['rank']!r}:{hits[-1]['id']}" if len(hits) == limit else None
+    return jsonify({'query': query, 'results': hits, 'next_cursor': next_cursor})
+
 @app.route('/api/clear-messages')
 def clear_messages():
     """Clear message queues"""
@@ -2381,7 +5247,7 @@ def database_status():
     try:
         # Fetch the most recent report to get actual data recency
         api_url = "https://api.fda.gov/device/event.json?sort=date_received:desc&limit=1"
-        response = requests.get(api_url, timeout=10)
+        response = rate_limited_get(api_url, timeout=10)
         
         if response.status_code == 200:
             data = response.json()
@@ -2433,8 +5299,20 @@ def database_status():
 
 
 if __name__ == "__main__":
-    init_db()
+    # Process pool workers of the PyInstaller build start here
+    multiprocessing.freeze_support()
+    init_db(keep_data=args.refresh)
+    if args.ingest_dir:
+        ingest_bulk_files(args.ingest_dir)
+    if args.refresh:
+        refresh_extraction()
+    elif args.resume:
+        resume_extraction()
     print(f"Flask backend starting on {args.host}:{args.port}...", flush=True)
     # Turn off debug mode in production to avoid werkzeug reloader issues with PyInstaller
     debug_mode = not getattr(sys, 'frozen', False)
-    app.run(host=args.host, port=args.port, debug=debug_mode, use_reloader=debug_mode)
+    # The reloader serves from a second process that runs this block again,
+    # so it is left off when a startup action such as --resume was requested
+    startup_action = args.resume or args.refresh or args.ingest_dir
+    app.run(host=args.host, port=args.port, debug=debug_mode,
+            use_reloader=debug_mode and not startup_action)
@@ -0,0 +1,31 @@
+"""
+Shared fixtures for the MAUDEMetrics test modules.
+"""
+
+import os
+import tempfile
+
+import app as maude_app
+
+
+class TempDatabaseMixin:
+    """Points the app at a fresh, initialised temporary database for each test.
+
+    Mix in before the TestCase base; subclasses add their own fixtures after
+    super().setUp() and tear them down before super().tearDown().
+    """
+
+    def setUp(self):
+        super().setUp()
+        self._database = maude_app.DATABASE
+        self.test_db_fd, self.test_db_path = tempfile.mkstemp()
+        maude_app.DATABASE = self.test_db_path
+        maude_app.init_db()
+
+    def tearDown(self):
+        maude_app.DATABASE = self._database
+        os.close(self.test_db_fd)
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(self.test_db_path + suffix):
+                os.unlink(self.test_db_path + suffix)
+        super().tearDown()
@@ -0,0 +1,962 @@
+"""
+Bulk ingestion tests for MAUDEMetrics application.
+These tests load fixture openFDA device-event zip files from a temporary directory.
+"""
+
+import unittest
+import sys
+import os
+import io
+import json
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+
+# Add the parent directory to the path to import app
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as maude_app
+from app import (get_db_connection, init_db, iter_bulk_results, ingest_bulk_files, BulkWriter,
+                 bulk_load_settings, save_comprehensive_data, MANAGED_INDEXES, _clear_data_tables,
+                 encode_payload, decode_payload, extract_event_fields,
+                 get_results_connection, FLAT_EVENT_FIELDS, count_values, drop_dataset)
+from tests.helpers import TempDatabaseMixin
+
+
+def make_bulk_record(i, product_code='MAF', date_received='20200115', brand='ACME PUMP'):
+    return {
+        'mdr_report_key': str(500000 + i),
+        'report_number': f'BULK-{i}',
+        'date_received': date_received,
+        'device': [{'device_report_product_code': product_code, 'brand_name': brand,
+                    'generic_name': 'PUMP, INFUSION', 'manufacturer_d_name': 'ACME MEDICAL INC'}],
+        'patient': [{'patient_sequence_number': '1', 'sequence_number_outcome': ['Other']}],
+        'mdr_text': [{'text_type_code': 'Description of Event or Problem', 'text': f'Event "{i}" text [ok]'}],
+    }
+
+
+def write_bulk_zip(directory, name, records):
+    """Write records as an openFDA bulk zip (meta first, then results)."""
+    document = {
+        'meta': {'last_updated': '2026-10-01', 'results': {'skip': 0, 'limit': len(records), 'total': len(records)}},
+        'results': records,
+    }
+    path = os.path.join(directory, name)
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr(name[:-len('.zip')], json.dumps(document, indent=1))
+    return path
+
+
+def load_flat_events(conn, skip_errors=False):
+    """Read the dataset's flattened events (result_events_flat) into one DataFrame.
+
+    The whole-frame reference the streaming readers are checked against:
+    the frame building extract_event_fields' dicts for the events in id
+    order would, with one row per event, columns in order of first
+    appearance and missing values as NaN. With skip_errors, events that
+    could not be flattened are left out.
+    """
+    import pandas as pd
+    import numpy as np
+    positions = dict(conn.execute('SELECT name, position FROM events_flat_columns').fetchall())
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(events_flat)') if row[1] in positions]
+    where = 'WHERE error IS NULL' if skip_errors and 'error' in columns else ''
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    cursor.execute(f"SELECT event_id, flat_overflow{''.join(', ' + maude_app._quote_identifier(c) for c in columns)} "
+                   f"FROM result_events_flat {where} ORDER BY event_id")
+    df = pd.DataFrame.from_records(cursor.fetchall(), columns=['event_id', 'flat_overflow'] + columns)
+    if df.empty:
+        return pd.DataFrame()
+    for index, text in df.pop('flat_overflow').dropna().items():
+        for column, (position, value) in json.loads(text).items():
+            positions.setdefault(column, position)
+            if column not in df:
+                df[column] = None
+            df.at[index, column] = value
+    df = df.fillna(np.nan)
+    present = df.notna()
+    df = df.loc[:, present.any().values]
+    # A column first set by an earlier event comes first; within one event
+    # columns follow their flattening position
+    first = present.loc[:, df.columns].values.argmax(axis=0)
+    order = sorted(range(len(df.columns)), key=lambda k: (first[k], positions.get(df.columns[k], -1)))
+    return df.iloc[:, order]
+
+
+class TestBulkParser(unittest.TestCase):
+    """Test cases for the incremental bulk JSON parser."""
+
+    def test_matches_json_load_at_any_chunk_size(self):
+        """Records come out identical however the file is split into chunks."""
+        records = [make_bulk_record(i) for i in range(40)]
+        text = json.dumps({'meta': {'results': {'total': 40}}, 'results': records}, indent=2)
+        for chunk_size in (1, 7, 64, 1000, 1 << 20):
+            parsed = list(iter_bulk_results(io.StringIO(text), chunk_size=chunk_size))
+            self.assertEqual(parsed, records, f'chunk_size={chunk_size}')
+
+    def test_results_before_meta_and_empty_results(self):
+        """Member order does not matter and an empty array yields nothing."""
+        text = '{"results": [{"a": 1}, {"a": [2, {"b": "]}"}]}], "meta": {"x": 1}}'
+        self.assertEqual(list(iter_bulk_results(io.StringIO(text), chunk_size=5)), [{'a': 1}, {'a': [2, {'b': ']}'}]}])
+        self.assertEqual(list(iter_bulk_results(io.StringIO('{"meta": {}, "results": [ ]}'))), [])
+
+    def test_random_documents_round_trip(self):
+        """Randomly nested records survive the streaming parser."""
+        rng = random.Random(1234)
+
+        def value(depth):
+            kind = rng.randrange(6 if depth < 3 else 4)
+            if kind == 0:
+                return rng.randint(-10 ** 6, 10 ** 6)
+            if kind == 1:
+                return ''.join(rng.choice('ab ,:[]{}"\\é\n') for _ in range(rng.randrange(12)))
+            if kind == 2:
+                return rng.choice([True, False, None, 1.5])
+            if kind == 3:
+                return rng.random()
+            if kind == 4:
+                return [value(depth + 1) for _ in range(rng.randrange(4))]
+            return {f'k{n}': value(depth + 1) for n in range(rng.randrange(4))}
+
+        for _ in range(25):
+            records = [{'id': n, 'payload': value(0)} for n in range(rng.randrange(1, 15))]
+            text = json.dumps({'meta': {'results': {'total': len(records)}}, 'results': records})
+            parsed = list(iter_bulk_results(io.StringIO(text), chunk_size=rng.randrange(1, 50)))
+            self.assertEqual(parsed, records)
+
+    def test_truncated_file_raises(self):
+        """A cut-off file is reported instead of silently dropping records."""
+        text = json.dumps({'results': [make_bulk_record(1), make_bulk_record(2)]})[:-20]
+        with self.assertRaises(ValueError):
+            list(iter_bulk_results(io.StringIO(text), chunk_size=16))
+
+
+class TestBulkIngestion(TempDatabaseMixin, unittest.TestCase):
+    """Test cases for loading bulk zips into the database."""
+
+    def setUp(self):
+        super().setUp()
+        self.bulk_dir = tempfile.mkdtemp()
+        write_bulk_zip(self.bulk_dir, 'device-event-0001-of-0002.json.zip',
+                       [make_bulk_record(i, date_received=f'2020{1 + i % 12:02d}15') for i in range(60)])
+        write_bulk_zip(self.bulk_dir, 'device-event-0002-of-0002.json.zip',
+                       [make_bulk_record(i, product_code='LZG', date_received='20210310', brand='OTHER')
+                        for i in range(60, 100)] + [make_bulk_record(0)])
+
+    def tearDown(self):
+        shutil.rmtree(self.bulk_dir)
+        super().tearDown()
+
+    def query(self, sql):
+        conn = get_db_connection()
+        try:
+            return conn.execute(sql).fetchall()
+        finally:
+            conn.close()
+
+    def test_ingests_all_tables_and_deduplicates(self):
+        """Events, devices, patients and texts are written once per report."""
+        written = ingest_bulk_files(self.bulk_dir)
+        self.assertEqual(written, 100)
+        for table in ('events', 'devices', 'patients', 'mdr_texts'):
+            self.assertEqual(self.query(f'SELECT COUNT(*) FROM {table}')[0][0], 100, table)
+        extraction = self.query('SELECT mode, status, rows_written FROM extractions')[0]
+        self.assertEqual(tuple(extraction), ('bulk', 'completed', 100))
+
+    def test_filters_reuse_search_fields(self):
+        """Product code, brand and date filters select the same reports the API would."""
+        self.assertEqual(ingest_bulk_files(self.bulk_dir, product_code='lz'), 40)
+        self.assertEqual(ingest_bulk_files(self.bulk_dir, brand_name='acme pump', start_date='2020-03-01',
+                                           end_date='2020-04-30'), 10)
+        self.assertEqual(ingest_bulk_files(self.bulk_dir, device_generic_name='infusion pump',
+                                           manufacturer='acme'), 100)
+        dates = {row[0] for row in self.query('SELECT date_received FROM events')}
+        self.assertIn('20210310', dates)
+
+    def test_max_records_and_missing_files(self):
+        """max_records caps the load; an empty directory writes nothing."""
+        self.assertEqual(ingest_bulk_files(self.bulk_dir, max_records=25), 25)
+        self.assertEqual(self.query('SELECT COUNT(*) FROM events')[0][0], 25)
+        empty = tempfile.mkdtemp()
+        try:
+            self.assertEqual(ingest_bulk_files(empty), 0)
+        finally:
+            shutil.rmtree(empty)
+        self.assertEqual(self.query('SELECT COUNT(*) FROM events')[0][0], 25)
+
+    def test_jobs_on_different_datasets_run_together(self):
+        """Ingest jobs into two datasets interleave their batches instead of queueing."""
+        directories = {'a': tempfile.mkdtemp(), 'b': tempfile.mkdtemp()}
+        for offset, directory in enumerate(directories.values()):
+            write_bulk_zip(directory, 'device-event-0001-of-0001.json.zip',
+                           [make_bulk_record(1000 * (offset + 1) + i) for i in range(20)])
+        both_writing = threading.Barrier(2, timeout=10)
+        original_results, original_batch_size = maude_app.iter_bulk_results, maude_app.WRITE_BATCH_SIZE
+
+        def results_meeting_halfway(stream):
+            # Both jobs must have committed batches before either goes on
+            for i, record in enumerate(original_results(stream)):
+                if i == 10:
+                    both_writing.wait()
+                yield record
+
+        maude_app.iter_bulk_results, maude_app.WRITE_BATCH_SIZE = results_meeting_halfway, 5
+        try:
+            jobs = [maude_app.submit_job('ingest', directory=directory, dataset=name)
+                    for name, directory in directories.items()]
+            deadline = time.monotonic() + 20
+            while not all(job.finished for job in jobs) and time.monotonic() < deadline:
+                time.sleep(0.05)
+        finally:
+            maude_app.iter_bulk_results, maude_app.WRITE_BATCH_SIZE = original_results, original_batch_size
+            for directory in directories.values():
+                shutil.rmtree(directory)
+        self.assertEqual([(job.state, job.records_written) for job in jobs], [('completed', 20), ('completed', 20)])
+        counts = dict(self.query('''
+            SELECT d.name, COUNT(*) FROM datasets d JOIN extraction_reports r ON r.extraction_id = d.extraction_id
+            GROUP BY d.name
+        '''))
+        self.assertEqual(counts, {'a': 20, 'b': 20})
+        self.assertEqual(tuple(self.query('SELECT COUNT(DISTINCT id), COUNT(*) FROM events')[0]), (40, 40))
+
+
+class TestBulkWriter(TempDatabaseMixin, unittest.TestCase):
+    """Test cases for the batched executemany writer."""
+
+    def test_rows_match_record_contents(self):
+        """Events and child rows keep the stored format and point at their event."""
+        records = [make_bulk_record(i) for i in range(7)]
+        save_comprehensive_data(records)
+        conn = get_db_connection()
+        try:
+            events = conn.execute('SELECT id, report_number, raw_json, type_of_report FROM events ORDER BY id').fetchall()
+            self.assertEqual([row['id'] for row in events], list(range(1, 8)))
+            self.assertEqual(decode_payload(events[3]['raw_json']), json.dumps(records[3]))
+            self.assertEqual(events[3]['type_of_report'], '[]')
+            linked = conn.execute('''
+                SELECT e.report_number, d.brand_name, p.sequence_number_outcome, t.text
+                FROM events e JOIN devices d ON d.event_id = e.id JOIN patients p ON p.event_id = e.id
+                JOIN mdr_texts t ON t.event_id = e.id WHERE e.report_number = 'BULK-5'
+            ''').fetchone()
+            self.assertEqual(tuple(linked), ('BULK-5', 'ACME PUMP', '["Other"]', 'Event "5" text [ok]'))
+        finally:
+            conn.close()
+
+    def test_event_ids_are_never_reused(self):
+        """New ids continue after the highest id handed out, even if it was deleted."""
+        conn = get_db_connection()
+        try:
+            writer = BulkWriter(conn, batch_size=3)
+            writer.add([make_bulk_record(i) for i in range(5)])
+            writer.flush()
+            conn.execute('DELETE FROM events WHERE id = 5')
+            conn.commit()
+            writer = BulkWriter(conn)
+            writer.add([make_bulk_record(9)])
+            writer.flush()
+            conn.commit()
+            self.assertEqual(conn.execute("SELECT id FROM events WHERE report_number = 'BULK-9'").fetchone()[0], 6)
+            self.assertEqual(conn.execute('SELECT COUNT(*) FROM devices WHERE event_id = 6').fetchone()[0], 1)
+        finally:
+            conn.close()
+
+    def test_load_settings_are_restored(self):
+        """Per-load pragmas are reverted while the database stays in WAL mode."""
+        conn = get_db_connection()
+        try:
+            before = conn.execute('PRAGMA synchronous').fetchone()[0]
+            with bulk_load_settings(conn):
+                self.assertEqual(conn.execute('PRAGMA synchronous').fetchone()[0], 1)
+            self.assertEqual(conn.execute('PRAGMA synchronous').fetchone()[0], before)
+            self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+        finally:
+            conn.close()
+
+
+    def test_upsert_skips_unchanged_and_updates_in_place(self):
+        """Reports are keyed by mdr_report_key; only changed content is rewritten."""
+        conn = get_db_connection()
+        try:
+            writer = BulkWriter(conn)
+            writer.add([make_bulk_record(i) for i in range(4)])
+            writer.flush()
+            changed = make_bulk_record(2, brand='RENAMED PUMP')
+            writer = BulkWriter(conn)
+            writer.add([make_bulk_record(1), changed, make_bulk_record(4), make_bulk_record(4)])
+            writer.flush()
+            conn.commit()
+            self.assertEqual((writer.inserted, writer.updated, writer.unchanged), (1, 1, 1))
+            rows = conn.execute('SELECT id, mdr_report_key FROM events ORDER BY id').fetchall()
+            self.assertEqual([tuple(row) for row in rows], [(i + 1, str(500000 + i)) for i in range(5)])
+            brands = conn.execute('SELECT brand_name FROM devices WHERE event_id = 3').fetchall()
+            self.assertEqual([row[0] for row in brands], ['RENAMED PUMP'])
+            self.assertEqual(conn.execute('SELECT COUNT(*) FROM devices').fetchone()[0], 5)
+        finally:
+            conn.close()
+
+    def test_duplicate_report_keys_are_merged_on_upgrade(self):
+        """A database holding a report twice keeps the newest copy under the unique key index."""
+        conn = get_db_connection()
+        try:
+            conn.execute('DROP INDEX idx_events_mdr_report_key')
+            conn.execute('CREATE INDEX idx_events_mdr_report_key ON events (mdr_report_key)')
+            conn.executemany('INSERT INTO events (report_number, mdr_report_key) VALUES (?, ?)',
+                             [('OLD', '1'), ('NEW', '1'), ('OTHER', '2')])
+            conn.execute('INSERT INTO devices (event_id, brand_name) VALUES (1, ?)', ('STALE',))
+            conn.commit()
+        finally:
+            conn.close()
+        init_db(keep_data=True)
+        self.assertEqual([row[0] for row in self.query('SELECT report_number FROM events ORDER BY id')], ['NEW', 'OTHER'])
+        self.assertEqual(self.query('SELECT COUNT(*) FROM devices')[0][0], 0)
+
+    def query(self, sql):
+        conn = get_db_connection()
+        try:
+            return conn.execute(sql).fetchall()
+        finally:
+            conn.close()
+
+class TestPayloadCodec(TempDatabaseMixin, unittest.TestCase):
+    """Test cases for compressed raw JSON payload storage."""
+
+    def test_round_trip_and_legacy_text(self):
+        """Encoded payloads decode to the original text; old TEXT rows pass through."""
+        rng = random.Random(99)
+        for i in range(50):
+            record = make_bulk_record(i, brand=''.join(rng.choice('ABC é"\\{}') for _ in range(rng.randrange(30))))
+            text = json.dumps(record)
+            encoded = encode_payload(text)
+            self.assertIsInstance(encoded, bytes)
+            self.assertEqual(decode_payload(encoded), text)
+        self.assertEqual(decode_payload('{"a": 1}'), '{"a": 1}')
+        self.assertIsNone(decode_payload(None))
+        with self.assertRaises(ValueError):
+            decode_payload(b'\x7f' + encode_payload('{}')[1:])
+
+    def test_dictionary_beats_plain_zlib(self):
+        """The preset dictionary compresses a typical record well below plain zlib."""
+        text = json.dumps(make_bulk_record(7))
+        plain = len(zlib.compress(text.encode('utf-8'), 6))
+        self.assertLess(len(encode_payload(text)), plain * 0.8)
+
+    def test_stored_payloads_are_compressed(self):
+        """Events, devices and patients keep their payloads as compressed BLOBs."""
+        save_comprehensive_data([make_bulk_record(i) for i in range(3)])
+        conn = get_db_connection()
+        try:
+            row = conn.execute('''
+                SELECT typeof(e.raw_json), typeof(d.raw_device_json), typeof(p.raw_patient_json), d.raw_device_json
+                FROM events e JOIN devices d ON d.event_id = e.id JOIN patients p ON p.event_id = e.id
+                WHERE e.id = 2
+            ''').fetchone()
+        finally:
+            conn.close()
+        self.assertEqual(tuple(row)[:3], ('blob', 'blob', 'blob'))
+        self.assertEqual(json.loads(decode_payload(row[3]))['brand_name'], 'ACME PUMP')
+
+
+class TestFlatEvents(TempDatabaseMixin, unittest.TestCase):
+    """Test cases for the events_flat projection written at ingest."""
+
+    def varied_records(self):
+        rng = random.Random(16)
+        records = []
+        for i in range(80):
+            record = make_bulk_record(i, brand=rng.choice(['ACME PUMP', 'OTHER', '']))
+            record['product_problems'] = [f'Problem {n}' for n in range(rng.randrange(4))]
+            record['device'] = record['device'] * rng.randrange(3)
+            record['patient'] = [{'patient_age': str(rng.randrange(90)), 'patient_sex': rng.choice(['Male', 'Female']),
+                                  'patient_problems': ['Pain'] * rng.randrange(3)} for _ in range(rng.randrange(3))]
+            if i % 17 == 5:
+                record['event_type'] = None
+            records.append(record)
+        return records
+
+    def flattened_from_raw(self, conn):
+        import pandas as pd
+        rows = []
+        for event_id, raw_json in conn.execute('SELECT id, raw_json FROM result_events ORDER BY id'):
+            try:
+                rows.append(extract_event_fields(json.loads(decode_payload(raw_json)), FLAT_EVENT_FIELDS, event_id=event_id))
+            except Exception as e:
+                rows.append({'event_id': event_id, 'error': str(e)})
+        return pd.DataFrame(rows)
+
+    def test_projection_matches_flattening_raw_json(self):
+        """Reading events_flat gives the same frame as flattening every payload."""
+        import pandas as pd
+        save_comprehensive_data(self.varied_records())
+        with get_results_connection() as conn:
+            expected = self.flattened_from_raw(conn)
+            pd.testing.assert_frame_equal(load_flat_events(conn), expected.dropna(axis=1, how='all'))
+
+    def test_updated_reports_are_reflattened(self):
+        """An upserted report replaces its projection row."""
+        save_comprehensive_data([make_bulk_record(i) for i in range(3)])
+        changed = make_bulk_record(1, brand='RENAMED')
+        save_comprehensive_data([make_bulk_record(0), changed, make_bulk_record(2)])
+        with get_results_connection() as conn:
+            df = load_flat_events(conn)
+        self.assertEqual(list(df['device_brand_name_1']), ['ACME PUMP', 'RENAMED', 'ACME PUMP'])
+
+    def test_overflow_columns_and_stale_versions(self):
+        """Keys past the column cap are kept, and an old version stamp triggers a rebuild."""
+        import pandas as pd
+        limit = maude_app.FLAT_MAX_COLUMNS
+        maude_app.FLAT_MAX_COLUMNS = 20
+        try:
+            save_comprehensive_data(self.varied_records())
+        finally:
+            maude_app.FLAT_MAX_COLUMNS = limit
+        with get_results_connection() as conn:
+            expected = self.flattened_from_raw(conn).dropna(axis=1, how='all')
+            pd.testing.assert_frame_equal(load_flat_events(conn), expected)
+        conn = get_db_connection()
+        try:
+            self.assertEqual(conn.execute('SELECT COUNT(*) FROM events_flat_columns').fetchone()[0], 20)
+            conn.execute('UPDATE events_flat SET flat_version = 0')
+            conn.execute("UPDATE events SET raw_json = '{broken' WHERE id = 8")
+            conn.commit()
+        finally:
+            conn.close()
+        init_db(keep_data=True)
+        with get_results_connection() as conn:
+            self.assertEqual(conn.execute('SELECT COUNT(*) FROM events_flat WHERE flat_version = ?',
+                                          (maude_app.FLAT_SCHEMA_VERSION,)).fetchone()[0], 80)
+            self.assertGreater(conn.execute('SELECT COUNT(*) FROM events_flat_columns').fetchone()[0], 20)
+            expected = self.flattened_from_raw(conn).dropna(axis=1, how='all')
+            pd.testing.assert_frame_equal(load_flat_events(conn), expected)
+            self.assertIn('error', load_flat_events(conn).columns)
+            cleaned = load_flat_events(conn, skip_errors=True)
+            self.assertEqual((len(cleaned), 'error' in cleaned.columns), (79, False))
+
+    def test_parallel_rebuild_matches_serial(self):
+        """Flattening in a process pool stores what one process would, in the same order."""
+        records = self.varied_records()
+        save_comprehensive_data(records)
+        snapshots = []
+        for workers in (1, 2):
+            conn = get_db_connection()
+            try:
+                maude_app._reset_flat_events(conn)
+                conn.execute("UPDATE events SET raw_json = '{broken' WHERE id = 8")
+                conn.commit()  # Workers read committed events
+                self.assertEqual(maude_app.rebuild_flat_events(conn, batch_size=7, workers=workers), 80)
+                # Only events missing from the projection are flattened again
+                conn.execute('DELETE FROM events_flat WHERE event_id % 3 = 0')
+                self.assertEqual(maude_app.rebuild_flat_events(conn, batch_size=7, workers=workers), 26)
+                conn.commit()
+                snapshot = {'events_flat': conn.execute('SELECT * FROM events_flat ORDER BY event_id').fetchall(),
+                            'columns': conn.execute('SELECT * FROM events_flat_columns ORDER BY name').fetchall()}
+                for table in maude_app.MULTI_VALUE_TABLES:
+                    snapshot[table] = conn.execute(f'SELECT * FROM {table} ORDER BY 1, 2, 3').fetchall()
+                snapshots.append({name: [tuple(row) for row in rows] for name, rows in snapshot.items()})
+            finally:
+                conn.close()
+        self.assertEqual(snapshots[0], snapshots[1])
+        self.assertTrue(snapshots[0]['event_product_problems'])
+
+    def test_chunked_frames_match_the_whole_frame(self):
+        """Streaming the frame in chunks gives load_flat_events' columns, dtypes and values."""
+        import pandas as pd
+        records = self.varied_records()
+        for i, record in enumerate(records):
+            record['number_devices_in_event'] = [1, 2, None][i % 3]  # Numbers with gaps load as floats
+            record['number_patients_in_event'] = 1
+        limit = maude_app.FLAT_MAX_COLUMNS
+        maude_app.FLAT_MAX_COLUMNS = 20
+        try:
+            save_comprehensive_data(records)
+        finally:
+            maude_app.FLAT_MAX_COLUMNS = limit
+        with get_results_connection() as conn:
+            expected = load_flat_events(conn)
+            scan = maude_app.scan_flat_columns(conn, chunk_size=7)
+            chunks = list(maude_app.iter_flat_event_frames(conn, scan, chunk_size=7))
+        self.assertEqual((scan['rows'], len(chunks)), (80, 12))
+        self.assertEqual(scan['dtypes']['number_devices_in_event'], 'float64')
+        pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), expected)
+
+    def test_field_values_match_the_frame(self):
+        """Streamed field values are the frame's non-null values of the field's columns, row by row."""
+        records = self.varied_records()
+        for i, record in enumerate(records):
+            record['number_devices_in_event'] = [1, 2, None][i % 3]
+        save_comprehensive_data(records)
+        fields = ['patient_patient_age', 'device_brand_name', 'product_problems', 'number_devices_in_event']
+        with get_results_connection() as conn:
+            frame = load_flat_events(conn)
+            scan = maude_app.scan_flat_columns(conn)
+            streamed = list(maude_app.iter_flat_field_values(conn, scan, fields, chunk_size=7))
+        columns = maude_app.flat_field_columns(frame.columns)
+        self.assertEqual(len(streamed), len(frame))
+        for field in fields:
+            expected = frame[columns[field]].values.flatten()
+            self.assertEqual([value for event in streamed for value in event[field]],
+                             [value for value in expected if value == value])
+        self.assertIsInstance(streamed[0]['number_devices_in_event'][0], float)
+
+    def test_export_is_the_same_at_any_chunk_size(self):
+        """The Excel export streams identical sheets whatever its chunk size."""
+        import openpyxl
+        records = self.varied_records()
+        for i, record in enumerate(records):
+            record['mdr_text'] = record['mdr_text'] * (i % 3) + [
+                {'text_type_code': 'Additional Manufacturer Narrative', 'text': 'UPPER NARRATIVE'}]
+            for patient in record['patient']:
+                patient['sequence_number_outcome'] = ['H']
+        save_comprehensive_data(records)
+        chunk_size = maude_app.EXPORT_CHUNK_SIZE
+        workbooks = []
+        try:
+            for maude_app.EXPORT_CHUNK_SIZE in (1000, 3):
+                path = maude_app.export_to_excel()
+                try:
+                    workbook = openpyxl.load_workbook(path, read_only=True)
+                    workbooks.append({ws.title: list(ws.iter_rows(values_only=True)) for ws in workbook.worksheets})
+                    workbook.close()
+                finally:
+                    os.unlink(path)
+        finally:
+            maude_app.EXPORT_CHUNK_SIZE = chunk_size
+        self.assertEqual(workbooks[0], workbooks[1])
+        events = workbooks[0]['Events']
+        self.assertEqual(len(events), 81)
+        header = list(events[0])
+        self.assertIn('Description of Event or Problem 2', header)
+        self.assertEqual(events[1][header.index('Additional Manufacturer Narrative')], 'Upper narrative')
+        self.assertIn('Hospitalization', {cell for row in events[1:] for cell in row})
+
+
+    def test_columns_split_into_fields_and_slots(self):
+        """Flattened columns are grouped by the field they came from, top-level names first."""
+        split = maude_app.split_flat_column
+        self.assertEqual(split('product_problems_3'), ('product_problems', (3,)))
+        self.assertEqual(split('manufacturer_address_1'), ('manufacturer_address_1', ()))
+        self.assertEqual(split('device_brand_name_2'), ('device_brand_name', (2,)))
+        self.assertEqual(split('patient_patient_problems_2_11'), ('patient_patient_problems', (2, 11)))
+        self.assertEqual(split('maude_report_link'), ('maude_report_link', ()))
+        columns = ['event_id', 'event_type', 'date_report', 'date_report_to_fda', 'device_brand_name_1',
+                   'device_brand_name_2', 'patient_patient_age_1', 'patient_patient_age_1_1']
+        fields = maude_app.flat_field_columns(columns)
+        self.assertEqual(fields['date_report'], ['date_report'])
+        self.assertEqual(fields['device_brand_name'], ['device_brand_name_1', 'device_brand_name_2'])
+        self.assertEqual(fields['patient_patient_age'], ['patient_patient_age_1', 'patient_patient_age_1_1'])
+
+    def test_export_layout_plan(self):
+        """The Events sheet puts priority headers and their slots first and leaves blank columns out."""
+        save_comprehensive_data(self.varied_records())
+        with get_results_connection() as conn:
+            scan = maude_app.scan_flat_columns(conn)
+        layout = maude_app.plan_export_layout(scan)
+        self.assertEqual(sorted(layout['raw']), sorted(scan['columns']))
+        self.assertEqual(layout['raw'][0], 'event_id')
+        self.assertEqual(layout['raw'][layout['raw'].index('mdr_report_key') + 1], 'maude_report_link')
+        problems = layout['raw'].index('product_problems')
+        self.assertEqual(layout['raw'][problems + 1:problems + 4], [f'product_problems_{n}' for n in (1, 2, 3)])
+        self.assertEqual(layout['slots']['product_problems'], 3)
+        self.assertEqual(layout['slots']['patient_patient_problems'], 2)
+
+        columns = [column for column, _ in layout['events']]
+        names = [name for _, name in layout['events']]
+        self.assertEqual(set(columns) | set(layout['blank']), set(scan['columns']))
+        self.assertFalse(set(layout['blank']) & scan['filled'])
+        self.assertEqual(names[:3], ['Event ID', 'Report Number', 'MDR Report Key'])
+        self.assertLess(names.index('Brand Name 1'), names.index('Brand Name 2'))
+        self.assertLess(names.index('Device Problem 3'), names.index('Patient Problem 1'))
+        self.assertEqual(names[names.index('Device Problem 1'):names.index('Device Problem 1') + 3],
+                         ['Device Problem 1', 'Device Problem 2', 'Device Problem 3'])
+
+
+class TestMultiValueTables(TempDatabaseMixin, unittest.TestCase):
+    """Test cases for the long-form tables of multi-valued fields."""
+
+    def setUp(self):
+        super().setUp()
+        rng = random.Random(17)
+        self.records = []
+        for i in range(60):
+            record = make_bulk_record(i)
+            record['product_problems'] = rng.sample(['Leak', 'Break', 'Noise', ' '], rng.randrange(4))
+            record['remedial_action'] = ['Recall'] if i % 5 == 0 else []
+            record['patient'] = [{'patient_problems': rng.sample(['Pain', 'Burn', 'Fever'], rng.randrange(3)),
+                                  'sequence_number_outcome': ['H', 'O'][:rng.randrange(3)]}
+                                 for _ in range(rng.randrange(3))]
+            self.records.append(record)
+        save_comprehensive_data(self.records)
+
+    def expected_counts(self, values):
+        from collections import Counter
+        return sorted(Counter(v for v in values if v.strip()).items(), key=lambda item: (-item[1], item[0]))
+
+    def test_values_are_stored_by_position(self):
+        """Each value is one row, numbered per event and per patient."""
+        with get_results_connection() as conn:
+            rows = conn.execute('SELECT patient_position, position, value FROM result_patient_problems '
+                                'WHERE event_id = (SELECT id FROM events WHERE report_number = ?) '
+                                'ORDER BY patient_position, position', (self.records[9]['report_number'],)).fetchall()
+            self.assertEqual([tuple(row) for row in rows],
+                             [(p, i, value) for p, patient in enumerate(self.records[9]['patient'], 1)
+                              for i, value in enumerate(patient['patient_problems'], 1)])
+            self.assertEqual(conn.execute('SELECT COUNT(*) FROM result_event_remedial_actions').fetchone()[0], 12)
+
+    def test_counts_match_flattened_values(self):
+        """count_values gives the problem frequencies, blanks left out."""
+        with get_results_connection() as conn:
+            self.assertEqual([tuple(row) for row in count_values(conn, 'event_product_problems')],
+                             self.expected_counts([v for r in self.records for v in r['product_problems']]))
+            self.assertEqual([tuple(row) for row in count_values(conn, 'patient_outcomes')],
+                             self.expected_counts([v for r in self.records for p in r['patient']
+                                                   for v in p['sequence_number_outcome']]))
+
+    def test_updated_reports_replace_their_values(self):
+        """Re-saving a changed report leaves only its new values."""
+        changed = dict(self.records[0], product_problems=['Smoke'])
+        save_comprehensive_data([changed] + self.records[1:])
+        with get_results_connection() as conn:
+            values = [row[0] for row in conn.execute(
+                'SELECT value FROM result_event_product_problems WHERE event_id = 1')]
+        self.assertEqual(values, ['Smoke'])
+
+    def test_older_databases_are_backfilled(self):
+        """A projection from an older schema version is rebuilt with the value tables."""
+        conn = get_db_connection()
+        try:
+            conn.execute('DELETE FROM patient_problems')
+            conn.execute('UPDATE events_flat SET flat_version = 1')
+            conn.commit()
+        finally:
+            conn.close()
+        init_db(keep_data=True)
+        with get_results_connection() as conn:
+            self.assertEqual([tuple(row) for row in count_values(conn, 'patient_problems')],
+                             self.expected_counts([v for r in self.records for p in r['patient']
+                                                   for v in p['patient_problems']]))
+
+    def test_counts_use_value_index(self):
+        """Value counts read the value index instead of sorting the table."""
+        conn = get_db_connection()
+        try:
+            plan = ' | '.join(row['detail'] for row in conn.execute(
+                'EXPLAIN QUERY PLAN SELECT value, COUNT(*) FROM event_product_problems GROUP BY value'))
+        finally:
+            conn.close()
+        self.assertIn('idx_event_product_problems_value', plan)
+
+
+class TestNarrativeSearch(TempDatabaseMixin, unittest.TestCase):
+    """Test cases for the FTS5 narrative index and /api/search/narratives."""
+
+    def setUp(self):
+        super().setUp()
+        records = [make_bulk_record(i) for i in range(40)]
+        records[3]['mdr_text'][0]['text'] = 'The pump <b>leaked</b> fluid & the patient was burned'
+        records[4]['mdr_text'][0]['text'] = 'Leaking pump; the leak repeated, leak after leak'
+        records[5]['mdr_text'].append({'text_type_code': 'Additional Manufacturer Narrative', 'text': 'No leak found'})
+        save_comprehensive_data(records)
+        self.client = maude_app.app.test_client()
+
+    def search(self, q, **params):
+        response = self.client.get('/api/search/narratives', query_string={'q': q, **params})
+        return response.status_code, response.get_json()
+
+    def reports(self, q, **params):
+        return [hit['report_number'] for hit in self.search(q, **params)[1]['results']]
+
+    def test_phrase_prefix_and_boolean_queries(self):
+        """FTS5 query syntax is passed through and hits are ranked by BM25."""
+        self.assertEqual(self.reports('"patient was burned"'), ['BULK-3'])
+        self.assertEqual(self.reports('leak*'), ['BULK-4', 'BULK-5', 'BULK-3'])
+        self.assertEqual(self.reports('leak NOT pump'), ['BULK-5'])
+        self.assertCountEqual(self.reports('burned OR found'), ['BULK-3', 'BULK-5'])
+        self.assertEqual(self.search('"unterminated')[0], 400)
+        self.assertEqual(self.search('')[0], 400)
+
+    def test_hits_link_back_to_events(self):
+        """Hits carry their event, an escaped highlighted snippet and the MAUDE link."""
+        hit = self.search('burned')[1]['results'][0]
+        self.assertEqual((hit['event_id'], hit['mdr_report_key']), (4, '500003'))
+        self.assertEqual(hit['snippet'], 'The pump &lt;b&gt;leaked&lt;/b&gt; fluid &amp; the patient was <mark>burned</mark>')
+        self.assertTrue(hit['maude_report_link'].endswith('mdrfoi__id=500003&pc=MAF'))
+
+    def test_keyset_pagination_visits_every_hit_once(self):
+        """Following next_cursor pages through all hits in rank order."""
+        everything = self.search('text', limit=100)[1]['results']
+        seen, cursor = [], None
+        while True:
+            status, page = self.search('text', limit=7, **({'cursor': cursor} if cursor else {}))
+            self.assertEqual(status, 200)
+            seen += page['results']
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual([hit['id'] for hit in seen], [hit['id'] for hit in everything])
+        self.assertEqual(len(seen), 38)
+        self.assertEqual(self.search('text', cursor='nonsense')[0], 400)
+
+    def test_index_follows_inserts_and_deletes(self):
+        """Updated reports, new datasets and dropped datasets are reflected in the index."""
+        changed = make_bulk_record(3)
+        changed['mdr_text'][0]['text'] = 'Battery overheated'
+        save_comprehensive_data([changed], dataset='second')
+        self.assertEqual(self.reports('overheated', dataset='second'), ['BULK-3'])
+        self.assertEqual(self.reports('burned', dataset='default'), [])
+        drop_dataset('second')
+        self.assertEqual(self.reports('overheated', dataset='default'), ['BULK-3'])
+        conn = get_db_connection()
+        try:
+            # Raises if the index disagrees with mdr_texts
+            conn.execute("INSERT INTO mdr_texts_fts (mdr_texts_fts, rank) VALUES ('integrity-check', 1)")
+        finally:
+            conn.close()
+
+
+class TestConnectionPool(TempDatabaseMixin, unittest.TestCase):
+    """Test cases for the shared writer and the pooled read-only connections."""
+
+    def setUp(self):
+        super().setUp()
+        save_comprehensive_data([make_bulk_record(i) for i in range(5)])
+        self.pool = maude_app.get_connection_pool()
+
+    def tearDown(self):
+        self.pool.close()
+        super().tearDown()
+
+    def test_readers_are_read_only_with_pragmas(self):
+        """Readers open mode=ro with their own memory map and page cache."""
+        with maude_app.db_reader() as conn:
+            self.assertEqual(conn.execute('PRAGMA mmap_size').fetchone()[0], maude_app.READ_MMAP_SIZE)
+            self.assertEqual(conn.execute('PRAGMA cache_size').fetchone()[0], -maude_app.READ_CACHE_KB)
+            with self.assertRaises(sqlite3.OperationalError):
+                conn.execute('DELETE FROM events')
+        with maude_app.db_writer() as conn:
+            self.assertEqual(conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+
+    def test_readers_are_reused_without_result_views(self):
+        """A returned reader goes back to the pool with its temp views dropped."""
+        conn = get_results_connection()
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM result_events').fetchone()[0], 5)
+        conn.close()
+        conn.close()  # Closing twice must not close the pooled connection
+        with maude_app.db_reader() as again:
+            self.assertIs(again, conn)
+            self.assertEqual(again.execute("SELECT COUNT(*) FROM temp.sqlite_master").fetchone()[0], 0)
+            self.assertEqual(again.execute('SELECT COUNT(*) FROM events').fetchone()[0], 5)
+
+    def test_reads_run_during_a_write(self):
+        """Readers see the last commit while another thread holds an open write."""
+        writing, release = threading.Event(), threading.Event()
+
+        def write():
+            with maude_app.db_writer() as conn:
+                conn.execute('DELETE FROM mdr_texts')
+                writing.set()
+                release.wait(10)
+
+        thread = threading.Thread(target=write)
+        thread.start()
+        try:
+            self.assertTrue(writing.wait(10))
+            with get_results_connection() as conn:
+                self.assertEqual(conn.execute('SELECT COUNT(*) FROM result_mdr_texts').fetchone()[0], 5)
+        finally:
+            release.set()
+            thread.join()
+        with maude_app.db_reader() as conn:
+            self.assertEqual(conn.execute('SELECT COUNT(*) FROM mdr_texts').fetchone()[0], 0)
+
+    def test_writer_is_reentrant_and_serialized(self):
+        """Nested writer blocks share the connection; other threads wait their turn."""
+        order = []
+
+        def write():
+            with maude_app.db_writer():
+                order.append('other')
+
+        with maude_app.db_writer() as outer:
+            with maude_app.db_writer() as inner:
+                self.assertIs(inner, outer)
+            thread = threading.Thread(target=write)
+            thread.start()
+            thread.join(0.2)
+            order.append('first')
+        thread.join()
+        self.assertEqual(order, ['first', 'other'])
+
+    def test_writer_wait_times_out(self):
+        """A thread gives up on the writer after its timeout instead of hanging."""
+        holding, release = threading.Event(), threading.Event()
+
+        def hold():
+            with maude_app.db_writer():
+                holding.set()
+                release.wait(10)
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        try:
+            self.assertTrue(holding.wait(10))
+            with self.assertRaisesRegex(sqlite3.OperationalError, 'writer is busy'):
+                with self.pool.writer(timeout=0.1):
+                    pass
+        finally:
+            release.set()
+            thread.join()
+        with self.pool.writer(timeout=0.1) as conn:
+            self.assertEqual(conn.execute('SELECT COUNT(*) FROM events').fetchone()[0], 5)
+
+    def test_clear_data_refused_while_a_job_runs(self):
+        """/clear_data answers 409 instead of waiting behind a running job."""
+        job = maude_app.ExtractionJob('ingest', {})
+        job.state = 'running'
+        with maude_app._jobs_lock:
+            maude_app._jobs[job.id] = job
+        try:
+            self.assertEqual(maude_app.app.test_client().post('/clear_data').status_code, 409)
+            job.state = 'completed'
+            self.assertEqual(maude_app.app.test_client().post('/clear_data').status_code, 302)
+        finally:
+            with maude_app._jobs_lock:
+                del maude_app._jobs[job.id]
+        with maude_app.db_reader() as conn:
+            self.assertEqual(conn.execute('SELECT COUNT(*) FROM events').fetchone()[0], 0)
+
+
+class TestExportCache(TempDatabaseMixin, unittest.TestCase):
+    """Test cases for the export cache behind /export, /export/summary and /export/raw."""
+
+    def setUp(self):
+        super().setUp()
+        self._cache = maude_app.export_cache
+        self.cache_dir = tempfile.mkdtemp()
+        maude_app.export_cache = maude_app.ExportCache(self.cache_dir, 50 * 1024 * 1024)
+        save_comprehensive_data([make_bulk_record(i) for i in range(5)])
+        self.client = maude_app.app.test_client()
+
+    def tearDown(self):
+        maude_app.export_cache = self._cache
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        super().tearDown()
+
+    def download(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        body = response.get_data()
+        response.close()
+        return body
+
+    def test_data_version_moves_with_writes(self):
+        """Only writer blocks that change rows move the data version, and never back to an old one."""
+        pool = maude_app.get_connection_pool()
+        version = pool.data_version
+        with maude_app.db_writer() as conn:
+            conn.execute('SELECT COUNT(*) FROM events').fetchone()
+        self.assertEqual(pool.data_version, version)
+        with maude_app.db_writer() as conn:
+            conn.execute("UPDATE events SET report_number = 'CHANGED' WHERE id = 1")
+        self.assertGreater(pool.data_version, version)
+
+    def test_repeated_downloads_are_served_from_cache(self):
+        """Unchanged data is downloaded from the cache; a save or a clear builds the file again."""
+        cache = maude_app.export_cache
+        first = self.download('/export')
+        self.assertEqual(self.download('/export'), first)
+        self.download('/export/summary')
+        self.download('/export/summary')
+        self.download('/export/raw')
+        self.assertEqual(cache.counters, {'hits': 2, 'misses': 3})
+        self.assertEqual(len(os.listdir(self.cache_dir)), 3)
+
+        save_comprehensive_data([make_bulk_record(i) for i in range(7)])
+        self.download('/export')
+        self.assertEqual(cache.counters, {'hits': 2, 'misses': 4})
+        self.client.post('/clear_data')
+        self.assertEqual(self.client.get('/export').status_code, 500)
+        self.assertEqual(cache.counters, {'hits': 2, 'misses': 4})
+
+    def test_size_bound_and_orphans(self):
+        """The least recently used files are evicted beyond the cap, and old leftovers are removed."""
+        leftover = os.path.join(self.cache_dir, 'from-an-earlier-run.xlsx')
+        with open(leftover, 'wb') as f:
+            f.write(b'x' * 10)
+        cache = maude_app.ExportCache(self.cache_dir, 1)
+        maude_app.export_cache = cache
+        self.download('/export')
+        self.download('/export/summary')
+        self.assertFalse(os.path.exists(leftover))
+        # Over the cap, only the newest file is kept
+        files = os.listdir(self.cache_dir)
+        self.assertEqual(len(files), 1)
+        self.assertTrue(files[0].endswith('.xlsx') and 'Summary' in files[0])
+
+
+class TestQueryPlans(TempDatabaseMixin, unittest.TestCase):
+    """EXPLAIN QUERY PLAN checks for the managed secondary indexes."""
+
+    def setUp(self):
+        super().setUp()
+        save_comprehensive_data([make_bulk_record(i) for i in range(200)])
+        self.conn = get_db_connection()
+
+    def tearDown(self):
+        self.conn.close()
+        super().tearDown()
+
+    def plan(self, sql):
+        return ' | '.join(row['detail'] for row in self.conn.execute('EXPLAIN QUERY PLAN ' + sql))
+
+    def index_names(self):
+        return {row[0] for row in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+    def test_indexes_exist_and_are_analyzed(self):
+        """A load leaves every managed index in place with planner statistics."""
+        self.assertLessEqual(set(MANAGED_INDEXES), self.index_names())
+        analyzed = {row[0] for row in self.conn.execute('SELECT idx FROM sqlite_stat1')}
+        self.assertIn('idx_devices_event_id', analyzed)
+
+    def test_results_page_uses_indexes(self):
+        """The latest-results query walks date_added and looks devices up by event."""
+        plan = self.plan('''
+            SELECT e.report_number, d.brand_name FROM events e
+            LEFT JOIN devices d ON e.id = d.event_id
+            ORDER BY e.date_added DESC LIMIT 50
+        ''')
+        self.assertIn('idx_events_date_added', plan)
+        self.assertIn('idx_devices_event_id', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_missing_patient_anti_join_uses_index(self):
+        """The events-missing-patients query probes patients by event id."""
+        plan = self.plan('''
+            SELECT e.id, e.report_number FROM events e
+            LEFT JOIN patients p ON e.id = p.event_id WHERE p.id IS NULL
+        ''')
+        self.assertIn('idx_patients_event_id', plan)
+        self.assertNotIn('SCAN p', plan)
+
+    def test_lookups_use_indexes(self):
+        """Date, report number and narrative lookups avoid full scans."""
+        self.assertIn('idx_events_date_received', self.plan("SELECT id FROM events WHERE date_received >= '20200101'"))
+        self.assertIn('idx_events_report_number', self.plan("SELECT id FROM events WHERE report_number = 'BULK-3'"))
+        self.assertIn('idx_mdr_texts_event_id', self.plan('SELECT text FROM mdr_texts WHERE event_id = 3'))
+
+    def test_clearing_drops_indexes_until_reload(self):
+        """Clearing for a fresh load drops the indexes; the next save rebuilds them."""
+        _clear_data_tables(self.conn)
+        self.conn.commit()
+        self.assertFalse(set(MANAGED_INDEXES) & self.index_names())
+        self.assertIn('idx_events_mdr_report_key', self.index_names())
+        save_comprehensive_data([make_bulk_record(1)])
+        self.assertLessEqual(set(MANAGED_INDEXES), self.index_names())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,721 @@
+"""
+Fetch engine tests for MAUDEMetrics application.
+These tests run the extraction engine against a local fake openFDA server.
+"""
+
+import unittest
+import sys
+import os
+import re
+import json
+import gzip
+import asyncio
+import threading
+import requests
+import time
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# Add the parent directory to the path to import app
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as maude_app
+from app import (fetch_all_API_data, _plan_date_shards, _parse_date_range, _with_date_range, get_http_session,
+                 get_db_connection, init_db, stream_API_data_to_db, resume_extraction, refresh_extraction,
+                 RateLimiter, get_rate_limiter, _parse_retry_after, ResponseCache, _CachedResponse,
+                 AsyncHTTPClient, submit_job, get_results_connection, list_datasets, drop_dataset)
+from tests.helpers import TempDatabaseMixin
+
+
+def make_records(count, start='20200101'):
+    """Build `count` fake MAUDE reports, one per day from `start`."""
+    first = datetime.strptime(start, '%Y%m%d')
+    return [{
+        'mdr_report_key': str(100000 + i),
+        'report_number': f'RPT-{i}',
+        'date_received': (first + timedelta(days=i)).strftime('%Y%m%d'),
+        'device': [{'device_report_product_code': 'MAF', 'brand_name': 'TEST'}],
+    } for i in range(count)]
+
+
+class FakeOpenFDA:
+    """Minimal openFDA device/event endpoint: search, count, skip and search_after."""
+
+    def __init__(self, records):
+        self.records = records
+        self.fail_after = None
+        self.throttle_next = 0
+        self.last_updated = '2026-10-01'
+        self.requests = []
+        self.request_ports = []
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                fake.requests.append(self.path)
+                fake.request_ports.append(self.client_address[1])
+                status, body, headers = fake.handle(self.path)
+                payload = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.base = f'http://127.0.0.1:{self.server.server_address[1]}/device/event.json'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def query(self, search):
+        return f'{self.base}?search={search}'
+
+    def page_requests(self):
+        """(path, client port) of every request except limit=1 count queries."""
+        return [(path, port) for path, port in zip(self.requests, self.request_ports)
+                if 'limit=1' not in path.split('&')]
+
+    def handle(self, path):
+        if self.throttle_next:
+            self.throttle_next -= 1
+            return 429, {'error': {'code': 'OVER_RATE_LIMIT', 'message': 'Slow down'}}, {'Retry-After': '7'}
+        params = parse_qs(urlparse(path).query)
+        search = params.get('search', ['*'])[0]
+        matches = self.records
+        window = re.search(r'\(date_received:\[(\d{8}) TO (\d{8})\] OR date_changed:\[(\d{8}) TO (\d{8})\]\)', search)
+        if window:
+            lo, hi = window.group(1), window.group(2)
+            matches = [r for r in matches
+                       if lo <= r['date_received'] <= hi or lo <= r.get('date_changed', '') <= hi]
+            search = search.replace(window.group(0), '')
+        date_match = re.search(r'date_received:\[(\d{8}) TO (\d{8})\]', search)
+        if date_match:
+            lo, hi = date_match.groups()
+            matches = [r for r in matches if lo <= r['date_received'] <= hi]
+        matches = sorted(matches, key=lambda r: (r['date_received'], r['mdr_report_key']), reverse=True)
+        if not matches:
+            return 404, {'error': {'code': 'NOT_FOUND', 'message': 'No matches found!'}}, {}
+        limit = int(params.get('limit', ['100'])[0])
+        skip = int(params.get('skip', ['0'])[0])
+        if 'search_after' in params:
+            skip = int(params['search_after'][0])
+            if self.fail_after is not None and skip >= self.fail_after:
+                return 500, {'error': {'code': 'SERVER_ERROR', 'message': 'Simulated outage'}}, {}
+        page = matches[skip:skip + limit]
+        headers = {}
+        if 'sort' in params or 'search_after' in params:
+            if skip + limit < len(matches):
+                next_url = f'{self.base}?search={search.replace(" ", "+")}&limit={limit}&search_after={skip + limit}'
+                headers['Link'] = f'<{next_url}>; rel="next"'
+        meta = {'last_updated': self.last_updated, 'results': {'skip': skip, 'limit': limit, 'total': len(matches)}}
+        return 200, {'meta': meta, 'results': page}, headers
+
+
+def setUpModule():
+    # Keep test traffic out of the on-disk response cache
+    global _shared_cache
+    _shared_cache = maude_app.response_cache
+    maude_app.response_cache = ResponseCache(tempfile.gettempdir(), 0, 0)
+
+
+def tearDownModule():
+    maude_app.response_cache = _shared_cache
+
+
+class FetchTestCase(unittest.TestCase):
+    """Runs fetches on `engine`, recording back-off waits instead of sleeping."""
+
+    engine = 'threads'
+
+    def setUp(self):
+        self.waits = []
+        self._sleep = maude_app.time.sleep
+        self._async_sleep = maude_app._async_sleep
+        self._engine = maude_app.FETCH_ENGINE
+
+        async def record_wait(seconds):
+            self.waits.append(seconds)
+
+        maude_app.time.sleep = self.waits.append
+        maude_app._async_sleep = record_wait
+        maude_app.FETCH_ENGINE = self.engine
+
+    def tearDown(self):
+        maude_app.time.sleep = self._sleep
+        maude_app._async_sleep = self._async_sleep
+        maude_app.FETCH_ENGINE = self._engine
+
+
+class TestFetchEngine(FetchTestCase):
+    """Test cases for the openFDA fetch engine."""
+
+    def test_date_range_helpers(self):
+        """The date_received clause can be parsed and narrowed."""
+        q = 'https://api.fda.gov/device/event.json?search=date_received:[20200101+TO+20201231]+AND+(x)'
+        self.assertEqual(_parse_date_range(q), ('20200101', '20201231'))
+        narrowed = _with_date_range(q, '20200301', '20200331')
+        self.assertIn('date_received:[20200301+TO+20200331]+AND+(x)', narrowed)
+        self.assertIsNone(_parse_date_range('https://api.fda.gov/device/event.json?search=*'))
+
+    def test_serial_fetch_returns_all_records(self):
+        """Without sharding every page is walked with search_after."""
+        with FakeOpenFDA(make_records(230)) as fake:
+            data = fetch_all_API_data(fake.query('date_received:[20200101+TO+20211231]'), workers=1)
+        self.assertEqual(len(data), 230)
+        self.assertEqual(data[0]['date_received'], max(r['date_received'] for r in data))
+
+    def test_pages_reuse_keep_alive_connection(self):
+        """Serial pages travel over one pooled keep-alive connection."""
+        with FakeOpenFDA(make_records(1200)) as fake:
+            fetch_all_API_data(fake.query('*'), workers=1)
+            get_http_session().close()
+        pages = fake.page_requests()
+        self.assertGreater(len(pages), 1)
+        self.assertEqual(len({port for _, port in pages}), 1)
+
+    def test_max_records_limits_result(self):
+        """max_records truncates the extraction."""
+        with FakeOpenFDA(make_records(230)) as fake:
+            data = fetch_all_API_data(fake.query('*'), max_records=120, workers=1)
+        self.assertEqual(len(data), 120)
+
+    def test_plan_date_shards_respects_target(self):
+        """Bisection yields disjoint windows no larger than the target."""
+        records = make_records(300)
+        with FakeOpenFDA(records) as fake:
+            q = fake.query('date_received:[20200101+TO+20211231]')
+            shards = _plan_date_shards(q, 300, '', target=50)
+        self.assertGreater(len(shards), 1)
+        self.assertTrue(all(count <= 50 for _, _, count in shards))
+        self.assertEqual(sum(count for _, _, count in shards), 300)
+        # Newest window first
+        self.assertEqual(shards, sorted(shards, key=lambda s: s[0], reverse=True))
+
+    def test_sharded_fetch_matches_serial(self):
+        """The sharded engine returns the same reports, newest first, without duplicates."""
+        records = make_records(300)
+        original_target = maude_app.SHARD_TARGET_RECORDS
+        maude_app.SHARD_TARGET_RECORDS = 40
+        try:
+            with FakeOpenFDA(records) as fake:
+                q = fake.query('date_received:[20200101+TO+20211231]')
+                sharded = fetch_all_API_data(q, workers=4)
+                serial = fetch_all_API_data(q, workers=1)
+        finally:
+            maude_app.SHARD_TARGET_RECORDS = original_target
+        self.assertEqual([r['mdr_report_key'] for r in sharded], [r['mdr_report_key'] for r in serial])
+        self.assertEqual(len({r['mdr_report_key'] for r in sharded}), 300)
+
+
+class TestRateLimiter(FetchTestCase):
+    """Test cases for the adaptive openFDA rate limiter."""
+
+    def setUp(self):
+        super().setUp()
+        maude_app._rate_limiters.clear()
+
+    def tearDown(self):
+        super().tearDown()
+        maude_app._rate_limiters.clear()
+
+    def test_rate_ramps_up_and_shrinks(self):
+        """Successes raise the rate to the quota ceiling; a 429 halves it."""
+        limiter = RateLimiter(240, 1000)
+        for _ in range(50):
+            limiter.on_success({})
+        self.assertAlmostEqual(limiter.rate, 4.0)
+        limiter.on_throttle(3)
+        self.assertAlmostEqual(limiter.rate, 2.0)
+        self.assertGreaterEqual(limiter.reserve(), 2.5)
+
+    def test_low_remaining_quota_slows_down(self):
+        """X-RateLimit-Remaining close to zero shrinks the rate."""
+        limiter = RateLimiter(240, 1000)
+        before = limiter.rate
+        limiter.on_success({'X-RateLimit-Limit': '240', 'X-RateLimit-Remaining': '3'})
+        self.assertLess(limiter.rate, before)
+
+    def test_parse_retry_after(self):
+        """Retry-After accepts seconds and HTTP dates."""
+        self.assertEqual(_parse_retry_after('12'), 12.0)
+        self.assertIsNone(_parse_retry_after(None))
+        self.assertEqual(_parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT'), 0.0)
+
+    def test_limiters_are_shared_per_key(self):
+        """Keyed and keyless requests use separate shared buckets."""
+        self.assertIs(get_rate_limiter('abc'), get_rate_limiter('abc'))
+        self.assertIsNot(get_rate_limiter('abc'), get_rate_limiter(None))
+
+    def test_fetch_honors_retry_after(self):
+        """A 429 holds the fetcher for Retry-After and the page is retried."""
+        with FakeOpenFDA(make_records(100)) as fake:
+            fake.throttle_next = 1
+            data = fetch_all_API_data(fake.query('*'), workers=1)
+        self.assertEqual(len(data), 100)
+        self.assertTrue(any(wait >= 6.5 for wait in self.waits))
+
+
+class TestResponseCache(FetchTestCase):
+    """Test cases for the on-disk openFDA response cache."""
+
+    def setUp(self):
+        super().setUp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = ResponseCache(self.cache_dir, 3600, 10 * 1024 * 1024)
+        self._cache = maude_app.response_cache
+        maude_app.response_cache = self.cache
+
+    def tearDown(self):
+        super().tearDown()
+        maude_app.response_cache = self._cache
+        shutil.rmtree(self.cache_dir)
+
+    def test_repeat_extraction_is_served_from_cache(self):
+        """A second identical extraction fetches no pages from the API."""
+        with FakeOpenFDA(make_records(300)) as fake:
+            first = fetch_all_API_data(fake.query('*'), workers=1)
+            fetched = len(fake.page_requests())
+            second = fetch_all_API_data(fake.query('*'), workers=1)
+            self.assertEqual(len(fake.page_requests()), fetched)
+        self.assertEqual(first, second)
+        stats = self.cache.snapshot()
+        self.assertEqual(stats['hits'], fetched)
+        self.assertGreater(stats['bytes_served'], 0)
+
+    def test_api_update_invalidates_entries(self):
+        """Entries stored for an older meta.last_updated are not reused."""
+        with FakeOpenFDA(make_records(300)) as fake:
+            fetch_all_API_data(fake.query('*'), workers=1)
+            fetched = len(fake.page_requests())
+            fake.last_updated = '2026-10-08'
+            fetch_all_API_data(fake.query('*'), workers=1)
+            self.assertEqual(len(fake.page_requests()), 2 * fetched)
+
+    def test_freshness_is_per_extraction(self):
+        """Each caller's last_updated decides hits and stores; none is kept on the cache."""
+        url = 'https://api.fda.gov/device/event.json?search=x'
+        old = _CachedResponse({'status': 200, 'headers': {}, 'body': '{"meta": {"last_updated": "2026-10-01"}}'})
+        self.cache.put(url, old, '2026-10-08')  # A page from older data than the extraction's
+        self.assertIsNone(self.cache.get(url))
+        self.cache.put(url, old, '2026-10-01')
+        self.assertIsNotNone(self.cache.get(url, '2026-10-01'))
+        self.assertIsNone(self.cache.get(url, '2026-10-08'))
+        self.assertIsNotNone(self.cache.get(url, '2026-10-01'))
+
+    def test_expired_entries_are_ignored(self):
+        """Entries older than the TTL count as misses."""
+        response = _CachedResponse({'status': 200, 'headers': {}, 'body': '{"meta": {}, "results": []}'})
+        self.cache.put('https://api.fda.gov/device/event.json?search=x', response)
+        self.assertIsNotNone(self.cache.get('https://api.fda.gov/device/event.json?search=x'))
+        self.cache.ttl = 1e-9
+        self.assertIsNone(self.cache.get('https://api.fda.gov/device/event.json?search=x'))
+
+    def test_key_ignores_api_key_and_parameter_order(self):
+        """Keyed and keyless URLs for the same page share one entry."""
+        self.assertEqual(ResponseCache.normalize_url('https://api.fda.gov/x.json?search=a&limit=5&api_key=SECRET'),
+                         ResponseCache.normalize_url('https://api.fda.gov/x.json?limit=5&search=a'))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        """The cache stays under its size cap by dropping the oldest entries."""
+        body = json.dumps({'meta': {}, 'results': [{'n': os.urandom(2000).hex()}]})
+        for i in range(6):
+            self.cache.put(f'https://api.fda.gov/x.json?page={i}', _CachedResponse({'status': 200, 'headers': {}, 'body': body}))
+            path = self.cache._path(f'https://api.fda.gov/x.json?page={i}')
+            os.utime(path, (1000 + i, 1000 + i))
+        self.cache.max_bytes = 10000
+        self.cache.get('https://api.fda.gov/x.json?page=0')
+        self.cache.put('https://api.fda.gov/x.json?page=6', _CachedResponse({'status': 200, 'headers': {}, 'body': body}))
+        self.assertLessEqual(self.cache.total_bytes, 10000)
+        self.assertIsNotNone(self.cache.get('https://api.fda.gov/x.json?page=0'))
+        self.assertIsNone(self.cache.get('https://api.fda.gov/x.json?page=1'))
+        self.assertIsNotNone(self.cache.get('https://api.fda.gov/x.json?page=6'))
+
+
+class TestStreamingPipeline(TempDatabaseMixin, FetchTestCase):
+    """Test cases for the fetch-to-SQLite streaming pipeline."""
+
+    def count_events(self):
+        conn = get_db_connection()
+        try:
+            return conn.execute('SELECT COUNT(*) FROM events').fetchone()[0]
+        finally:
+            conn.close()
+
+    def test_pages_are_written_to_database(self):
+        """Every fetched page ends up in the events and devices tables."""
+        with FakeOpenFDA(make_records(230)) as fake:
+            written = stream_API_data_to_db(fake.query('*'), workers=1)
+        self.assertEqual(written, 230)
+        self.assertEqual(self.count_events(), 230)
+
+    def test_sharded_pages_are_written_to_database(self):
+        """Concurrent windows all reach the writer stage exactly once."""
+        original_target = maude_app.SHARD_TARGET_RECORDS
+        maude_app.SHARD_TARGET_RECORDS = 40
+        try:
+            with FakeOpenFDA(make_records(300)) as fake:
+                written = stream_API_data_to_db(fake.query('date_received:[20200101+TO+20211231]'), workers=4)
+        finally:
+            maude_app.SHARD_TARGET_RECORDS = original_target
+        self.assertEqual(written, 300)
+        self.assertEqual(self.count_events(), 300)
+
+    def test_empty_result_keeps_previous_data(self):
+        """A query that returns nothing does not wipe the stored results."""
+        with FakeOpenFDA(make_records(50)) as fake:
+            stream_API_data_to_db(fake.query('*'), workers=1)
+            written = stream_API_data_to_db(fake.query('date_received:[19990101+TO+19991231]'), workers=1)
+        self.assertEqual(written, 0)
+        self.assertEqual(self.count_events(), 50)
+
+    def test_interrupted_extraction_resumes_from_checkpoint(self):
+        """A run cut off by API errors continues from its saved cursor."""
+        with FakeOpenFDA(make_records(1200)) as fake:
+            fake.fail_after = 500
+            written = stream_API_data_to_db(fake.query('*'), workers=1)
+            self.assertEqual(written, 500)
+            conn = get_db_connection()
+            status, next_url = conn.execute('''
+                SELECT e.status, c.next_url FROM extractions e JOIN extraction_cursors c ON c.extraction_id = e.id
+            ''').fetchone()
+            conn.close()
+            self.assertEqual(status, 'interrupted')
+            self.assertIn('search_after=500', next_url)
+            self.assertNotIn('api_key', next_url)
+
+            # A restart keeps the partial data because it can be resumed
+            init_db()
+            self.assertEqual(self.count_events(), 500)
+
+            fake.fail_after = None
+            resumed = resume_extraction()
+        self.assertEqual(resumed, 700)
+        conn = get_db_connection()
+        keys = conn.execute('SELECT COUNT(DISTINCT mdr_report_key) FROM events').fetchone()[0]
+        status = conn.execute('SELECT status FROM extractions').fetchone()[0]
+        conn.close()
+        self.assertEqual(keys, 1200)
+        self.assertEqual(self.count_events(), 1200)
+        self.assertEqual(status, 'completed')
+
+    def test_refresh_upserts_new_and_changed_reports(self):
+        """A refresh only pulls the newer window and replaces changed reports."""
+        records = make_records(300)
+        for record in records:
+            record['date_changed'] = record['date_received']
+        with FakeOpenFDA(records) as fake:
+            stream_API_data_to_db(fake.query('*'), workers=1)
+            fake.records = records + make_records(50, start='20201101')
+            for record in fake.records[300:]:
+                record['mdr_report_key'] = str(200000 + int(record['mdr_report_key']))
+            records[10] = dict(records[10], report_number='RPT-AMENDED', date_changed='20260101')
+            fake.records[10] = records[10]
+            fake.requests.clear()
+            written = refresh_extraction(workers=1)
+            self.assertTrue(all('date_changed' in path for path in fake.requests))
+        self.assertGreaterEqual(written, 51)
+        self.assertLess(written, 60)
+        conn = get_db_connection()
+        keys = conn.execute('SELECT COUNT(DISTINCT mdr_report_key) FROM events').fetchone()[0]
+        amended = conn.execute("SELECT report_number FROM events WHERE mdr_report_key = '100010'").fetchall()
+        modes = [row[0] for row in conn.execute('SELECT mode FROM extractions ORDER BY id')]
+        conn.close()
+        self.assertEqual(keys, 350)
+        self.assertEqual(self.count_events(), 350)
+        self.assertEqual([row[0] for row in amended], ['RPT-AMENDED'])
+        self.assertEqual(modes, ['full', 'refresh'])
+
+
+    def test_corpus_mode_reuses_overlapping_reports(self):
+        """Overlapping searches share stored reports; a new search shows only its own matches."""
+        self._corpus_mode = maude_app.CORPUS_MODE
+        maude_app.CORPUS_MODE = True
+        try:
+            with FakeOpenFDA(make_records(300)) as fake:
+                first = stream_API_data_to_db(fake.query('date_received:[20200101+TO+20200430]'), workers=1)
+                second = stream_API_data_to_db(fake.query('date_received:[20200301+TO+20200630]'), workers=1)
+            self.assertEqual((first, second), (121, 122))
+            self.assertEqual(self.count_events(), 182)
+            conn = get_results_connection()
+            try:
+                shown = [row[0] for row in conn.execute('SELECT MIN(date_received) FROM result_events')]
+                shown_count = conn.execute('SELECT COUNT(*) FROM result_devices').fetchone()[0]
+                statuses = [row[0] for row in conn.execute('SELECT status FROM extractions ORDER BY id')]
+                members = conn.execute('SELECT COUNT(*) FROM extraction_reports').fetchone()[0]
+                hashes = conn.execute('SELECT COUNT(*) FROM events WHERE content_hash IS NULL').fetchone()[0]
+            finally:
+                conn.close()
+            self.assertEqual(shown, ['20200301'])
+            self.assertEqual(shown_count, 122)
+            self.assertEqual(statuses, ['superseded', 'completed'])
+            self.assertEqual(members, 122)
+            self.assertEqual(hashes, 0)
+            init_db()
+            self.assertEqual(self.count_events(), 182)
+        finally:
+            maude_app.CORPUS_MODE = self._corpus_mode
+
+    def test_named_datasets_side_by_side(self):
+        """Datasets keep separate results, switch without refetching and drop independently."""
+        with FakeOpenFDA(make_records(300)) as fake:
+            stream_API_data_to_db(fake.query('date_received:[20200101+TO+20200430]'), workers=1, dataset='spring')
+            stream_API_data_to_db(fake.query('date_received:[20200301+TO+20200630]'), workers=1, dataset='summer')
+            requests_made = len(fake.requests)
+
+            def shown(dataset):
+                conn = get_results_connection(dataset)
+                try:
+                    return conn.execute('SELECT COUNT(*), MIN(date_received) FROM result_events').fetchone()
+                finally:
+                    conn.close()
+
+            self.assertEqual(tuple(shown('spring')), (121, '20200101'))
+            self.assertEqual(tuple(shown('summer')), (122, '20200301'))
+            self.assertEqual(tuple(shown(None)), (122, '20200301'))
+            self.assertEqual(len(fake.requests), requests_made)
+        self.assertEqual(self.count_events(), 182)
+        conn = get_db_connection()
+        try:
+            stats = {row['name']: (row['event_count'], row['device_count'], row['status'])
+                     for row in list_datasets(conn)}
+        finally:
+            conn.close()
+        self.assertEqual(stats, {'spring': (121, 121, 'completed'), 'summer': (122, 122, 'completed')})
+        self.assertTrue(drop_dataset('spring'))
+        self.assertFalse(drop_dataset('spring'))
+        self.assertEqual(self.count_events(), 122)
+        self.assertEqual(tuple(shown('spring')), (122, '20200301'))
+
+class TestBackgroundJobs(TempDatabaseMixin, FetchTestCase):
+    """Test cases for background extraction jobs and the /api/jobs endpoints."""
+
+    def setUp(self):
+        super().setUp()
+        maude_app.app.config['TESTING'] = True
+        self.client = maude_app.app.test_client()
+
+    def wait_for(self, job, timeout=20):
+        deadline = time.monotonic() + timeout
+        while not job.finished and time.monotonic() < deadline:
+            self._sleep(0.05)  # time.sleep itself is patched to record waits
+        self.assertTrue(job.finished, f'job still {job.state}')
+
+    def test_job_runs_in_background_and_reports_progress(self):
+        """An extraction job completes on the pool and exposes its counters."""
+        with FakeOpenFDA(make_records(1200)) as fake:
+            job = submit_job('extract', base_query=fake.query('*'), max_records=None, api_key='')
+            self.wait_for(job)
+        response = self.client.get(f'/api/jobs/{job.id}')
+        self.assertEqual(response.status_code, 200)
+        status = response.get_json()
+        self.assertEqual(status['state'], 'completed')
+        self.assertEqual(status['records_written'], 1200)
+        self.assertEqual(status['total_count'], 1200)
+        results = self.client.get(f'/api/jobs/{job.id}/results').get_json()
+        self.assertEqual(results['counts']['events'], 1200)
+        self.assertIn(job.id, [listed['id'] for listed in self.client.get('/api/jobs').get_json()['jobs']])
+
+    def test_queued_job_can_be_cancelled(self):
+        """Cancelling a job waiting for the dataset stops it before it starts."""
+        with maude_app._dataset_lock(maude_app.DEFAULT_DATASET):
+            job = submit_job('resume', api_key='')
+            response = self.client.post(f'/api/jobs/{job.id}/cancel')
+            self.assertEqual(response.status_code, 202)
+        self.wait_for(job)
+        self.assertEqual(job.state, 'cancelled')
+        self.assertEqual(self.client.post(f'/api/jobs/{job.id}/cancel').status_code, 409)
+        self.assertEqual(self.client.get(f'/api/jobs/{job.id}/results').status_code, 409)
+
+    def test_cancelled_extraction_is_resumable(self):
+        """A cancel stops at the last checkpoint and leaves the extraction interrupted."""
+        job = maude_app.ExtractionJob('extract', {})
+        job.cancel.set()
+        with FakeOpenFDA(make_records(1200)) as fake:
+            written = stream_API_data_to_db(fake.query('*'), workers=1, job=job)
+        self.assertEqual(written, 0)
+        conn = get_db_connection()
+        status = conn.execute('SELECT status FROM extractions').fetchone()[0]
+        conn.close()
+        self.assertEqual(status, 'interrupted')
+        self.assertEqual(job.extraction_id, 1)
+
+    def test_job_api_rejects_bad_requests(self):
+        """Unknown jobs are 404 and malformed submissions 400."""
+        self.assertEqual(self.client.get('/api/jobs/nope').status_code, 404)
+        self.assertEqual(self.client.post('/api/jobs', json={'kind': 'delete'}).status_code, 400)
+        self.assertEqual(self.client.post('/api/jobs', json={'max_records': 'many'}).status_code, 400)
+
+
+    def test_dataset_api_lists_switches_and_drops(self):
+        """Jobs fill named datasets that the results pages and /api/datasets expose."""
+        with FakeOpenFDA(make_records(300)) as fake:
+            for name, window in (('early', '20200101+TO+20200131'), ('late', '20200601+TO+20200630')):
+                job = submit_job('extract', base_query=fake.query(f'date_received:[{window}]'), api_key='',
+                                 dataset=name)
+                self.wait_for(job)
+                self.assertEqual(job.state, 'completed')
+        listed = {row['name']: row['event_count'] for row in self.client.get('/api/datasets').get_json()['datasets']}
+        self.assertEqual(listed, {'early': 31, 'late': 30})
+        self.assertNotIn(b'RPT-0<', self.client.get('/results').data)
+        self.assertIn(b'RPT-0<', self.client.get('/results?dataset=early').data)
+        self.assertIn(b'RPT-0<', self.client.get('/results').data)  # the choice is kept in the session
+        self.assertEqual(self.client.get(f'/api/jobs/{job.id}/results').get_json()['counts']['events'], 30)
+        with maude_app._dataset_lock('late'):
+            self.assertEqual(self.client.delete('/api/datasets/late').status_code, 409)
+        self.assertEqual(self.client.delete('/api/datasets/late').status_code, 204)
+        self.assertEqual(self.client.delete('/api/datasets/late').status_code, 404)
+        self.assertEqual([row['name'] for row in self.client.get('/api/datasets').get_json()['datasets']], ['early'])
+
+class TestFetchEngineAsyncio(TestFetchEngine):
+    """The fetch engine tests, run on the asyncio engine."""
+    engine = 'asyncio'
+
+    def test_client_decodes_chunked_gzip_responses(self):
+        """AsyncHTTPClient handles the chunked, gzip-encoded bodies openFDA sends."""
+        body = gzip.compress(json.dumps({'results': [{'n': i} for i in range(50)]}).encode('utf-8'))
+
+        async def handle(reader, writer):
+            while (await reader.readline()) not in (b'\r\n', b''):
+                pass
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Encoding: gzip\r\nTransfer-Encoding: chunked\r\n\r\n')
+            for start in range(0, len(body), 100):
+                chunk = body[start:start + 100]
+                writer.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            writer.write(b'0\r\n\r\n')
+            await writer.drain()
+            writer.close()
+
+        async def fetch():
+            server = await asyncio.start_server(handle, '127.0.0.1', 0)
+            client = AsyncHTTPClient()
+            try:
+                port = server.sockets[0].getsockname()[1]
+                return await client.get(f'http://127.0.0.1:{port}/device/event.json?search=*')
+            finally:
+                await client.close()
+                server.close()
+
+        response = asyncio.run(fetch())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 50)
+
+    def test_client_reads_bodies_without_a_length(self):
+        """Responses without a length end at once, at EOF or in an error, never in a timeout."""
+        replies = {
+            '/empty': b'HTTP/1.1 204 No Content\r\n\r\n',
+            '/closing': b'HTTP/1.1 200 OK\r\nConnection: close\r\n\r\n{"results": []}',
+            '/unframed': b'HTTP/1.1 200 OK\r\n\r\n{"results": []}',
+        }
+
+        async def handle(reader, writer):
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    return
+                path = request_line.split()[1].decode('latin-1')
+                while (await reader.readline()) not in (b'\r\n', b''):
+                    pass
+                writer.write(replies[path])
+                await writer.drain()
+                if path == '/closing':
+                    writer.close()
+                    return
+
+        async def fetch():
+            server = await asyncio.start_server(handle, '127.0.0.1', 0)
+            client = AsyncHTTPClient()
+            port = server.sockets[0].getsockname()[1]
+            try:
+                empty = await client.get(f'http://127.0.0.1:{port}/empty', timeout=2)
+                closing = await client.get(f'http://127.0.0.1:{port}/closing', timeout=2)
+                with self.assertRaises(requests.exceptions.ConnectionError):
+                    await client.get(f'http://127.0.0.1:{port}/unframed', timeout=2)
+                return empty, closing
+            finally:
+                await client.close()
+                server.close()
+
+        started = time.monotonic()
+        empty, closing = asyncio.run(fetch())
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual((empty.status_code, empty.content), (204, b''))
+        self.assertEqual(closing.json(), {'results': []})
+
+    def test_client_follows_redirects(self):
+        """AsyncHTTPClient follows a relative redirect like requests does."""
+        seen = []
+
+        async def handle(reader, writer):
+            seen.append((await reader.readline()).split()[1].decode('latin-1'))
+            while (await reader.readline()) not in (b'\r\n', b''):
+                pass
+            if seen[-1].startswith('/old'):
+                writer.write(b'HTTP/1.1 301 Moved Permanently\r\nLocation: /device/event.json?search=*\r\nContent-Length: 0\r\n\r\n')
+            else:
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 15\r\n\r\n{"results": []}')
+            await writer.drain()
+            writer.close()
+
+        async def fetch():
+            server = await asyncio.start_server(handle, '127.0.0.1', 0)
+            client = AsyncHTTPClient()
+            try:
+                port = server.sockets[0].getsockname()[1]
+                return await client.get(f'http://127.0.0.1:{port}/old/event.json')
+            finally:
+                await client.close()
+                server.close()
+
+        response = asyncio.run(fetch())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'results': []})
+        self.assertEqual(seen, ['/old/event.json', '/device/event.json?search=*'])
+
+    def test_client_refuses_proxies(self):
+        """A configured proxy is reported instead of being bypassed."""
+        saved = os.environ.get('HTTPS_PROXY')
+        os.environ['HTTPS_PROXY'] = 'http://proxy.invalid:3128'
+        try:
+            with self.assertRaisesRegex(ValueError, 'HTTPS_PROXY'):
+                AsyncHTTPClient()
+        finally:
+            if saved is None:
+                del os.environ['HTTPS_PROXY']
+            else:
+                os.environ['HTTPS_PROXY'] = saved
+
+
+class TestRateLimiterAsyncio(TestRateLimiter):
+    """The rate limiter tests, run on the asyncio engine."""
+    engine = 'asyncio'
+
+
+class TestResponseCacheAsyncio(TestResponseCache):
+    """The response cache tests, run on the asyncio engine."""
+    engine = 'asyncio'
+
+
+class TestStreamingPipelineAsyncio(TestStreamingPipeline):
+    """The streaming pipeline tests, run on the asyncio engine."""
+    engine = 'asyncio'
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,13 +6,16 @@ These tests verify core business logic and data processing.
 import unittest
 import sys
 import os
+import random
+import re
 import tempfile
 import shutil
 
 # Add the parent directory to the path to import app
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app import app, get_db_connection, init_db, sanitize_text, build_search_query
+from app import (app, get_db_connection, init_db, sanitize_text, sanitize_series, sanitize_df, build_search_query,
+                 ValueTransform, format_export_dates, fda_code_mapping, fda_code_transform, OUTCOME_CODES)
 
 class TestMAUDEMetricsFunctionality(unittest.TestCase):
     """Test cases for MAUDEMetrics core functionality."""
@@ -136,5 +139,134 @@ class TestMAUDEMetricsFunctionality(unittest.TestCase):
         q = build_search_query(brand_name='impella')
         self.assertNotIn('date_received', q)
 
+
+def regex_sanitize_text(text):
+    """The regex-and-replace sanitize_text that the translation table must match exactly."""
+    if not isinstance(text, str):
+        return text
+    text = re.sub(r'[\x00-\x08\x0b\x0c\x0e-\x1f]', '', text)
+    text = re.sub(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\x9f]', '', text)
+    text = text.replace('\u201c', '"').replace('\u201d', '"').replace('\u2018', "'").replace('\u2019', "'")
+    text = text.replace('\u2013', '-').replace('\u2014', '-')
+    text = text.replace('\u2022', '\u2022')
+    text = text.replace('\u2026', '...')
+    text = re.sub(r'[\x00-\x1f\x7f-\x9f]', '', text)
+    if len(text) > 32000:
+        text = text[:32000] + "..."
+    return text
+
+
+class TestSanitizer(unittest.TestCase):
+    """Seeded randomized equivalence tests for the table-driven sanitizer."""
+
+    # Control and XML-invalid characters, the translated punctuation, their
+    # neighbours and some non-ASCII text
+    SPECIAL = [chr(c) for c in [*range(0x00, 0x21), *range(0x7e, 0xa1)]] + list(
+        '\u201c\u201d\u2018\u2019\u2013\u2014\u2022\u2026\u2012\u2015\u201a\u00e9\u4e2d\U0001f600')
+
+    def random_text(self, rng):
+        alphabet = self.SPECIAL if rng.random() < 0.5 else self.SPECIAL + list('abc XYZ 0123')
+        if rng.random() < 0.1:
+            # Around the truncation limit, where deleted or expanded characters move the cut
+            base = 'x' * rng.randrange(31990, 32010)
+            position = rng.randrange(len(base))
+            return base[:position] + ''.join(rng.choice(alphabet) for _ in range(rng.randrange(20))) + base[position:]
+        return ''.join(rng.choice(alphabet) for _ in range(rng.randrange(40)))
+
+    def random_value(self, rng):
+        return rng.choice([None, 7, 2.5, b'\x00bytes', float('nan')]) if rng.random() < 0.2 else self.random_text(rng)
+
+    def test_sanitize_text_matches_regex_version(self):
+        """sanitize_text gives the regex version's output for random text."""
+        rng = random.Random(21)
+        for _ in range(3000):
+            text = self.random_text(rng)
+            self.assertEqual(sanitize_text(text), regex_sanitize_text(text), repr(text[:80]))
+        for value in (None, 123, 4.5, b'\x00', ['\x00']):
+            self.assertIs(sanitize_text(value), value)
+
+    def test_sanitize_series_matches_per_cell_version(self):
+        """Sanitizing a whole column gives the per-cell output, values and types alike."""
+        import pandas as pd
+        rng = random.Random(2101)
+        for _ in range(200):
+            values = [self.random_value(rng) for _ in range(rng.randrange(30))]
+            series = pd.Series(values, index=[rng.randrange(5) for _ in values], dtype=object, name='col')
+            result = sanitize_series(series)
+            expected = [regex_sanitize_text(value) for value in values]
+            self.assertEqual(list(result.index), list(series.index))
+            self.assertEqual(result.name, 'col')
+            for got, want in zip(result, expected):
+                if isinstance(want, float) and want != want:
+                    self.assertTrue(isinstance(got, float) and got != got)
+                else:
+                    self.assertEqual((type(got), got), (type(want), want))
+        self.assertEqual(list(series), values)  # The input is not modified
+
+    def test_sanitize_df_only_touches_text_columns(self):
+        """sanitize_df sanitizes object columns and leaves numeric ones alone."""
+        import pandas as pd
+        df = pd.DataFrame({'text': ['a\x00b', None, 5], 'number': [1.5, 2.0, float('nan')], 'integer': [1, 2, 3]})
+        result = sanitize_df(df.copy())
+        self.assertEqual(list(result['text'][[0, 2]]), ['ab', 5])
+        self.assertIsNone(result['text'][1])
+        pd.testing.assert_series_equal(result['number'], df['number'])
+        pd.testing.assert_series_equal(result['integer'], df['integer'])
+
+
+class TestExportTransforms(unittest.TestCase):
+    """Test cases for the memoized date and FDA code transforms of the Excel export."""
+
+    def test_dates_match_per_cell_strptime(self):
+        """Vectorized date formatting gives strptime's output and keeps what is not a date."""
+        import pandas as pd
+        from datetime import datetime, timedelta
+        rng = random.Random(22)
+        day = datetime(1984, 1, 1)
+        values = [(day + timedelta(days=rng.randrange(15000))).strftime('%Y%m%d') for _ in range(300)]
+        # Dates outside pandas' timestamp range still go through strptime
+        values += ['00010101', '99991231', '20201301', '2020010', '2020-01-01', '', 'N/A', None, 20200101, float('nan')]
+        series = pd.Series(values, dtype=object)
+        result = ValueTransform(format_export_dates)(series)
+        for value, got in zip(values, result):
+            if value == '20201301':
+                self.assertEqual(got, value)  # Not a date; kept
+            elif isinstance(value, str) and len(value) == 8 and value.isdigit():
+                self.assertEqual(got, datetime.strptime(value, '%Y%m%d').strftime('%m/%d/%Y'))
+            elif isinstance(value, float):
+                self.assertTrue(got != got)
+            else:
+                self.assertIs(got, value)
+
+    def test_values_are_converted_once(self):
+        """Each distinct value is converted once, across calls too."""
+        import pandas as pd
+        seen = []
+
+        def convert(values):
+            seen.extend(values)
+            return [value.lower() for value in values]
+
+        transform = ValueTransform(convert)
+        first = transform(pd.Series(['A', 'B', 'A', None, 3], dtype=object))
+        second = transform(pd.Series(['B', 'C', 'A'], dtype=object, index=[7, 7, 9]))
+        self.assertEqual(list(first), ['a', 'b', 'a', None, 3])
+        self.assertEqual((list(second), list(second.index)), (['b', 'c', 'a'], [7, 7, 9]))
+        self.assertEqual(sorted(seen), ['A', 'B', 'C'])
+        numbers = pd.Series([1.0, 2.0])
+        self.assertIs(transform(numbers), numbers)
+
+    def test_code_translation(self):
+        """Columns pick their mapping by name and Patient Outcome codes are translated one by one."""
+        import pandas as pd
+        self.assertIs(fda_code_mapping('Patient Outcome 2 1'), OUTCOME_CODES)
+        self.assertIsNone(fda_code_mapping('Brand Name'))
+        flags = fda_code_transform(fda_code_mapping('Health Professional'))
+        self.assertEqual(list(flags(pd.Series(['Y', 'N', 'Q', '', None], dtype=object))), ['Yes', 'No', 'Q', '', None])
+        outcomes = fda_code_transform(OUTCOME_CODES)
+        values = ['H', 'D;H', ' L ; X', '', ';', 'Death', None]
+        self.assertEqual(list(outcomes(pd.Series(values, dtype=object))),
+                         ['Hospitalization', 'Death; Hospitalization', 'Life Threatening; X', '', '; ', 'Death', None])
+
 if __name__ == '__main__':
     unittest.main()